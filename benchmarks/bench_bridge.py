@@ -0,0 +1,241 @@
+"""
+End-to-end throughput and latency benchmark of the bridge.
+
+Drives a real Server and DiscordBot against a local socket.io server, a fake Discord API
+and SQLite (or any database URL), and reports messages/s and p50/p95/p99 latency for the
+new/edit/delete flows in both directions.
+
+Usage:
+    python -m benchmarks.bench_bridge [--messages 500] [--channels 20] [--rate 0]
+        [--discord-latency 20] [--database-url sqlite+aiosqlite:///bench.db]
+        [--set WRITE_BEHIND_ENABLED=true ...]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from benchmarks.fakes import FakeDiscord
+from benchmarks.fakes import FakeDiscordMessage
+from benchmarks.fakes import FakeUpstreamServer
+from benchmarks.fakes import snowflakes
+from dsbridge.codec import DeleteMessageEvent
+from dsbridge.codec import EditMessageEvent
+from dsbridge.codec import NewMessageEvent
+from dsbridge.config import app_config
+from dsbridge.database import Base
+from dsbridge.discord_bot import DiscordBot
+from dsbridge.dispatcher import ChannelDispatcher
+from dsbridge.models import Message
+from dsbridge.models import User
+from dsbridge.server import Server
+
+FLOWS = ('discord-new', 'discord-edit', 'discord-delete', 'server-new', 'server-edit', 'server-delete')
+
+
+def build_config(overrides):
+    values = {name: getattr(app_config, name) for name in dir(app_config) if name.isupper()}
+    # The fake Discord API does not rate limit, so neither does the bridge unless asked to
+    values['DISCORD_CHANNEL_RATE'] = 10 ** 6
+    for override in overrides:
+        name, _, value = override.partition('=')
+        current = values.get(name)
+        if isinstance(current, bool):
+            value = value.lower() in ('1', 'true', 'yes', 'on')
+        elif isinstance(current, (int, float)):
+            value = type(current)(value)
+        values[name] = value
+    return SimpleNamespace(**values)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.config = build_config(args.set)
+        self.engine = create_async_engine(args.database_url)
+        self.session_factory = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.upstream = FakeUpstreamServer(self.config.SERVER_NAMESPACE)
+        self.discord = FakeDiscord(args.discord_latency / 1000)
+        self.dispatcher = ChannelDispatcher.from_config(self.config)
+        self.server = Server(self.config, session_factory=self.session_factory, dispatcher=self.dispatcher)
+        self.discord_bot = DiscordBot(self.config, dispatcher=self.dispatcher)
+        self.server.init_bot(self.discord_bot)
+        self.discord_bot.init_bot(self.server)
+        self.discord.install(self.discord_bot)
+        self.channels = [self.discord.channel(next(snowflakes)) for _ in range(args.channels)]
+        self.tasks = []
+
+    async def setup(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with self.session_factory() as session:
+            user = User(display_name='Benchmark')
+            session.add(user)
+            await session.commit()
+            self.user_id = user.id
+
+        await self.upstream.start()
+        await self.server.socketio.connect(self.upstream.url, namespaces=[self.config.SERVER_NAMESPACE])
+        await self.upstream.connected.wait()
+        self.tasks.append(asyncio.create_task(self.server.outbox.run()))
+        if self.server.batcher is not None:
+            self.tasks.append(asyncio.create_task(self.server.batcher.run()))
+
+    async def teardown(self):
+        for task in self.tasks:
+            task.cancel()
+        await self.server.socketio.disconnect()
+        await self.upstream.stop()
+        await self.engine.dispose()
+
+    async def drive(self, items, submit):
+        """
+        Submit items at the configured rate
+        Returns:
+            Send time of each item
+        """
+        sent = []
+        start = time.perf_counter()
+        for n, item in enumerate(items):
+            if self.args.rate:
+                delay = start + n / self.args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            sent.append(time.perf_counter())
+            await submit(item)
+        return sent
+
+    async def wait_for_acks(self, offset, event_type, count, key):
+        """
+        Wait for count acknowledgements of the given type from the bridge
+        Returns:
+            Arrival time by key
+        """
+        deadline = time.perf_counter() + self.args.timeout
+        while True:
+            acks = {}
+            for received_at, data in self.upstream.received[offset:]:
+                if data['type'] == event_type:
+                    acks[key(data)] = received_at
+                elif event_type == 'new-message' and data['type'] == 'new-messages':
+                    acks.update((message_id, received_at) for message_id in data['message_ids'])
+            if len(acks) >= count or time.perf_counter() > deadline:
+                return acks
+            await asyncio.sleep(0.01)
+
+    async def discord_ids(self):
+        async with self.session_factory() as session:
+            rows = await session.execute(select(Message.id, Message.discord_message_id))
+            return dict(rows.all())
+
+    def report(self, flow, sent, acks):
+        latencies = sorted(acks[k] - t for k, t in sent.items() if k in acks)
+        if not latencies:
+            print(f'{flow:<16} no messages acknowledged')
+            return
+        elapsed = max(acks.values()) - min(sent.values())
+        print(f'{flow:<16} {len(latencies):>7}/{len(sent):<7} {len(latencies) / elapsed:10.1f}/s '
+              f'{percentile(latencies, 0.5) * 1e3:9.1f} {percentile(latencies, 0.95) * 1e3:9.1f} '
+              f'{percentile(latencies, 0.99) * 1e3:9.1f}')
+
+    async def discord_flows(self):
+        messages = [FakeDiscordMessage(next(snowflakes), self.channels[n % len(self.channels)], f'Message {n}')
+                    for n in range(self.args.messages)]
+
+        async def run(flow, event_type, submit, key):
+            offset = len(self.upstream.received)
+            times = await self.drive(messages, submit)
+            acks = await self.wait_for_acks(offset, event_type, len(messages), key)
+            discord_ids = await self.discord_ids()
+            acks = {discord_ids.get(k): t for k, t in acks.items()}
+            self.report(flow, {m.id: t for m, t in zip(messages, times)}, acks)
+
+        if 'discord-new' in self.args.flows:
+            await run('discord-new', 'new-message',
+                      lambda m: self.dispatcher.submit(m.channel.id, self.discord_bot.forward_message, m),
+                      lambda data: data['message_id'])
+        if 'discord-edit' in self.args.flows:
+            await run('discord-edit', 'edit-message',
+                      lambda m: self.dispatcher.submit(
+                          m.channel.id, self.discord_bot.forward_message_edit,
+                          FakeDiscordMessage(m.id, m.channel, m.content + ' (edited)')),
+                      lambda data: data['before_message_id'])
+        if 'discord-delete' in self.args.flows:
+            await run('discord-delete', 'delete-message',
+                      lambda m: self.dispatcher.submit(m.channel.id, self.discord_bot.forward_message_delete, m),
+                      lambda data: data['message_id'])
+
+    async def server_flows(self):
+        async with self.session_factory() as session:
+            channel_ids = []
+            for channel in self.channels:
+                channel_ids.append(await self.server.get_channel_id(session, channel.id, create=True))
+            rows = [{'channel_id': channel_ids[n % len(channel_ids)], 'user_id': self.user_id,
+                     'text': f'Server message {n}'} for n in range(self.args.messages)]
+            message_ids = list(await session.scalars(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True), rows))
+            edited_ids = list(await session.scalars(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                [{**row, 'text': row['text'] + ' (edited)'} for row in rows]))
+            await session.commit()
+
+        async def run(flow, event_type, events, key):
+            offset = len(self.upstream.received)
+            times = await self.drive(events, lambda event: self.upstream.emit(event.to_dict()))
+            acks = await self.wait_for_acks(offset, event_type, len(events), key)
+            self.report(flow, {key(e.to_dict()): t for e, t in zip(events, times)}, acks)
+
+        if 'server-new' in self.args.flows:
+            await run('server-new', 'new-message',
+                      [NewMessageEvent(m) for m in message_ids],
+                      lambda data: data['message_id'])
+        if 'server-edit' in self.args.flows:
+            await run('server-edit', 'edit-message',
+                      [EditMessageEvent(b, a) for b, a in zip(message_ids, edited_ids)],
+                      lambda data: data['after_message_id'])
+        if 'server-delete' in self.args.flows:
+            await run('server-delete', 'delete-message',
+                      [DeleteMessageEvent(m) for m in edited_ids],
+                      lambda data: data['message_id'])
+
+
+async def main(args):
+    bench = Bench(args)
+    await bench.setup()
+    try:
+        print(f'{"flow":<16} {"acked/sent":^15} {"throughput":>12} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        await bench.discord_flows()
+        await bench.server_flows()
+        print(f'Discord API calls: {bench.discord.api_calls}')
+    finally:
+        await bench.teardown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=500, help='Messages per flow')
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=0, help='Messages per second, 0 for as fast as possible')
+    parser.add_argument('--discord-latency', type=float, default=20, help='Fake Discord API latency in ms')
+    parser.add_argument('--database-url', default=None, help='Defaults to a temporary SQLite file')
+    parser.add_argument('--flows', nargs='+', choices=FLOWS, default=FLOWS)
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for acknowledgements')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='Override a Config setting')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.database_url is None:
+            args.database_url = 'sqlite+aiosqlite:///' + os.path.join(directory, 'bench.db')
+        asyncio.run(main(args))
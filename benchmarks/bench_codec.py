@@ -0,0 +1,106 @@
+"""
+Encode/decode throughput of the socket.io JSON codecs on chat-message payloads.
+
+Usage:
+    python -m benchmarks.bench_codec [--payloads 20000]
+"""
+import argparse
+import json
+import random
+import re
+import time
+from datetime import datetime
+
+from dsbridge.codec import NewMessageEvent
+from dsbridge.codec import EditMessageEvent
+from dsbridge.codec import DeleteMessageEvent
+from dsbridge.codec import NewMessagesEvent
+from dsbridge.codec import orjson
+from dsbridge.codec import OrjsonCodec
+from dsbridge.codec import parse_event
+from dsbridge.codec import StdlibJSONCodec
+
+
+class LegacyCodec:
+    """
+    The codec used before dsbridge.codec, kept here as the baseline
+    """
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return json.dumps(obj, **kwargs, default=LegacyCodec.object_jsonify)
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return json.loads(s, **kwargs, object_hook=LegacyCodec.datetime_parser)
+
+    @staticmethod
+    def object_jsonify(o):
+        if callable(getattr(o, 'to_dict', None)):
+            return o.to_dict()
+        elif isinstance(o, datetime):
+            return o.isoformat()
+
+    @staticmethod
+    def datetime_parser(obj):
+        iso_datetime_pattern = re.compile(
+            r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2})?$'
+        )
+        for k, v in obj.items():
+            if isinstance(v, str) and iso_datetime_pattern.match(v):
+                obj[k] = datetime.fromisoformat(v)
+        return obj
+
+
+def build_payloads(count, rng):
+    payloads = []
+    for _ in range(count):
+        roll = rng.random()
+        message_id = rng.randrange(1, 10 ** 9)
+        if roll < 0.6:
+            event = NewMessageEvent(message_id, channel_id=rng.randrange(1, 1000))
+        elif roll < 0.8:
+            event = EditMessageEvent(message_id, message_id + 1)
+        elif roll < 0.95:
+            event = DeleteMessageEvent(message_id)
+        else:
+            event = NewMessagesEvent([message_id + n for n in range(50)])
+        payload = event.to_dict()
+        payload['created_at'] = datetime(2024, 1, 1, 12, 0, rng.randrange(60))
+        payloads.append(payload)
+    return payloads
+
+
+def measure(name, func, items, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    print(f'{name:<36} {len(items) / best:12.0f} payloads/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--payloads', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.payloads, random.Random(0))
+    codecs = [('legacy', LegacyCodec), ('stdlib', StdlibJSONCodec)]
+    if orjson is not None:
+        codecs.append(('orjson', OrjsonCodec))
+    else:
+        print('orjson is not installed, skipping it')
+
+    for name, codec in codecs:
+        encoded = [codec.dumps(p, separators=(',', ':')) for p in payloads]
+        measure(f'{name} encode', lambda p, codec=codec: codec.dumps(p, separators=(',', ':')), payloads, args.repeat)
+        measure(f'{name} decode', codec.loads, encoded, args.repeat)
+        if codec is not LegacyCodec:
+            measure(f'{name} decode + parse_event', lambda s, codec=codec: parse_event(codec.loads(s)),
+                    encoded, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
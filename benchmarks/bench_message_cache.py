@@ -0,0 +1,107 @@
+"""
+Memory used to remember recent Discord messages for edit and delete events.
+
+Compares the MessageRecordCache used by DiscordBot with a dict of slotted records and with
+discord.py's own message cache of full discord.Message objects. The full messages are
+measured on --sample messages and scaled up, since a million of them needs gigabytes.
+
+Usage:
+    python -m benchmarks.bench_message_cache [--messages 1000000] [--sample 20000]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from collections import deque
+
+import discord
+
+from dsbridge.cache import MessageRecordCache
+
+BASE_ID = 10 ** 17
+WORDS = 'hey everyone gg that was a great match did you see the patch notes lol anyone up for a game'.split()
+
+
+class SlottedRecord:
+    __slots__ = ('id', 'channel_id', 'author_id', 'content_hash')
+
+    def __init__(self, message_id, channel_id, author_id, content_hash):
+        self.id = message_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.content_hash = content_hash
+
+
+def generate(count, rng):
+    # IDs arrive as strings in gateway payloads, so each cache holds its own int objects
+    for i in range(count):
+        content = ' '.join(rng.choices(WORDS, k=rng.randint(3, 15)))
+        yield str(BASE_ID + i), str(BASE_ID + i % 1000), str(BASE_ID + rng.randrange(5000)), content
+
+
+def measure(name, build, count, scale=1):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    kept = build()
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] * scale
+    tracemalloc.stop()
+    print(f'{name:<36} {used / 2 ** 20:9.1f} MiB  {used / count:7.0f} B/message  built in {elapsed:.1f}s'
+          + (f' (scaled from {count // scale})' if scale > 1 else ''))
+    return kept
+
+
+def build_record_cache(messages, count):
+    cache = MessageRecordCache(count)
+    for message_id, channel_id, author_id, content in messages:
+        cache.put(int(message_id), int(channel_id), int(author_id), content)
+    return cache
+
+
+def build_slotted(messages):
+    records = {}
+    for message_id, channel_id, author_id, content in messages:
+        message_id = int(message_id)
+        records[message_id] = SlottedRecord(message_id, int(channel_id), int(author_id), hash(content))
+    return records
+
+
+def build_discord_messages(messages):
+    # Parsed the way the gateway client does, kept the way discord.py's message cache keeps them
+    state = discord.Client(intents=discord.Intents.default())._connection
+    channels = {}
+    cache = deque()
+    for message_id, channel_id, author_id, content in messages:
+        channel = channels.setdefault(channel_id, discord.PartialMessageable(state=state, id=int(channel_id)))
+        cache.append(discord.Message(state=state, channel=channel, data={
+            'id': message_id, 'channel_id': channel_id, 'type': 0, 'content': content,
+            'author': {'id': author_id, 'username': f'user-{author_id}', 'discriminator': '0',
+                       'avatar': None, 'global_name': None},
+            'attachments': [], 'embeds': [], 'mentions': [], 'mention_roles': [], 'components': [],
+            'pinned': False, 'mention_everyone': False, 'tts': False, 'flags': 0,
+            'timestamp': '2026-01-01T00:00:00+00:00', 'edited_timestamp': None,
+        }))
+    return cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--sample', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # The message contents are generated up front so their memory is not counted
+    messages = list(generate(args.messages, random.Random(args.seed)))
+    print(f'{args.messages} cached messages')
+    measure('MessageRecordCache', lambda: build_record_cache(messages, args.messages), args.messages)
+    measure('dict of slotted records', lambda: build_slotted(messages), args.messages)
+    sample = messages[:min(args.sample, args.messages)]
+    measure('discord.py message cache', lambda: build_discord_messages(sample), args.messages,
+            scale=args.messages // len(sample))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Micro-benchmark of utils.Sanitizer against the reference sanitize_input functions.
+
+Also compares the SanitizerExecutor modes on long pasted messages, reporting the total
+time and the longest stall of the event loop while they are checked.
+
+Usage:
+    python -m benchmarks.bench_sanitize [--messages 2000] [--banned-words 20000] [--long-messages 200]
+"""
+import argparse
+import asyncio
+import random
+import string
+import time
+
+import dsbridge.utils as utils
+from dsbridge.sanitizer_executor import SanitizerExecutor
+
+CHAT_WORDS = (
+    'hey everyone gg that was a great match did you see the patch notes lol i think the new map '
+    'is way better than the old one anyone up for a game tonight thanks for the help see you '
+    'later who is streaming today the tournament starts at eight'
+).split()
+EXTRAS = [
+    'check https://example.com/news/123', 'mail me at someone@example.org', 'call +44 20 7946 0958',
+    ':thumbsup:', '<@123456789012345678>', 'price is 20 & counting', '<b>bold</b>', 'é ü ß 🙂',
+]
+
+
+def build_banned_words(count, rng):
+    words = ['fuck', 'shit', 'bad word']
+    while len(words) < count:
+        words.append(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))))
+    return words
+
+
+def build_corpus(count, banned_words, rng):
+    corpus = []
+    for _ in range(count):
+        length = rng.choice([3, 8, 15, 40, 200])
+        words = rng.choices(CHAT_WORDS, k=length)
+        roll = rng.random()
+        if roll < 0.1:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(EXTRAS))
+        elif roll < 0.15:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(banned_words))
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def measure(name, func, corpus, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    per_message = best / len(corpus) * 1e6
+    print(f'{name:<32} {per_message:10.1f} us/message {len(corpus) / best:12.0f} messages/s')
+
+
+async def measure_executor(mode, sanitizer, corpus):
+    executor = SanitizerExecutor(sanitizer, mode, workers=2)
+    # Start the pool before timing, as DiscordBot.start does
+    await executor.start()
+
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            stall = max(stall, now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    # One check per handler, as when messages arrive through the dispatcher
+    await asyncio.gather(*(executor.is_clean(text) for text in corpus))
+    elapsed = time.perf_counter() - start
+    done = True
+    await task
+    executor.shutdown()
+    print(f'{"executor " + mode:<32} {elapsed * 1e3:10.1f} ms total {stall * 1e3:10.2f} ms longest stall '
+          f'{executor.batches:6d} batches')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--banned-words', type=int, default=20000)
+    parser.add_argument('--long-messages', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    banned_words = build_banned_words(args.banned_words, rng)
+    corpus = build_corpus(args.messages, banned_words, rng)
+
+    start = time.perf_counter()
+    sanitizer = utils.Sanitizer(banned_words)
+    print(f'Sanitizer built from {len(banned_words)} words in {(time.perf_counter() - start) * 1e3:.1f} ms')
+
+    measure('sanitize_input', lambda text: utils.sanitize_input(text, banned_words), corpus, args.repeat)
+    measure('sanitize_input != text', lambda text: utils.sanitize_input(text, banned_words) != text,
+            corpus, args.repeat)
+    measure('Sanitizer.clean', sanitizer.clean, corpus, args.repeat)
+    measure('Sanitizer.is_clean', sanitizer.is_clean, corpus, args.repeat)
+
+    long_corpus = [' '.join(rng.choices(corpus, k=40)) for _ in range(args.long_messages)]
+    print(f'{len(long_corpus)} long messages of about {sum(map(len, long_corpus)) // len(long_corpus)} characters')
+    for mode in SanitizerExecutor.MODES:
+        asyncio.run(measure_executor(mode, sanitizer, long_corpus))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Local stand-ins for Discord and the upstream socket.io server used by the benchmarks.
+"""
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+
+import socketio
+from aiohttp import web
+from discord.message import Message as DiscordMessage
+
+# Discord snowflakes handed out by the fake API
+snowflakes = itertools.count(10 ** 17)
+
+
+class FakeDiscordMessage(DiscordMessage):
+    """
+    Message as received from the Discord gateway, without a connection state
+    """
+    def __init__(self, message_id, channel, content, author_id=1, webhook_id=None):
+        self.id = message_id
+        self.channel = channel
+        self.content = content
+        self.author = SimpleNamespace(id=author_id, name=f'user-{author_id}')
+        self.webhook_id = webhook_id
+        self.attachments = []
+
+    async def delete(self, *, delay=None):
+        await self.channel.api_call()
+
+    def __repr__(self):
+        return f'<FakeDiscordMessage {self.id}>'
+
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        await self.channel.api_call()
+        return SimpleNamespace(id=self.id, **kwargs)
+
+    async def delete(self):
+        await self.channel.api_call()
+
+
+class FakeChannel:
+    """
+    Discord text channel whose API calls take a fixed latency
+    """
+    def __init__(self, channel_id, latency=0.0):
+        self.id = channel_id
+        self.latency = latency
+        self.api_calls = 0
+
+    async def api_call(self):
+        self.api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, **kwargs):
+        await self.api_call()
+        return SimpleNamespace(id=next(snowflakes), **kwargs)
+
+    def get_partial_message(self, message_id):
+        return FakePartialMessage(self, message_id)
+
+    async def fetch_message(self, message_id):
+        await self.api_call()
+        return FakePartialMessage(self, message_id)
+
+
+class FakeDiscord:
+    """
+    Channel registry patched over the discord.py client of a DiscordBot
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.channels = {}
+
+    def channel(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(channel_id, self.latency)
+        return self.channels[channel_id]
+
+    def install(self, discord_bot):
+        discord_bot.bot.get_channel = self.channel
+        discord_bot.bot.fetch_channel = self._fetch_channel
+
+    async def _fetch_channel(self, channel_id):
+        return self.channel(channel_id)
+
+    @property
+    def api_calls(self):
+        return sum(channel.api_calls for channel in self.channels.values())
+
+
+class FakeUpstreamServer:
+    """
+    Local socket.io server standing in for the upstream chat server.
+    Records the arrival time of every chat-message event from the bridge.
+    """
+    def __init__(self, namespace, host='127.0.0.1', port=0):
+        self.namespace = namespace
+        self.host = host
+        self.port = port
+        self.sio = socketio.AsyncServer(async_mode='aiohttp')
+        self.app = web.Application()
+        self.sio.attach(self.app)
+        self.runner = None
+        self.received = []
+        self.connected = asyncio.Event()
+        self.sid = None
+
+        @self.sio.on('connect', namespace=namespace)
+        async def connect(sid, environ, auth=None):
+            self.sid = sid
+            self.connected.set()
+
+        @self.sio.on('chat-message', namespace=namespace)
+        async def chat_message(sid, data):
+            self.received.append((time.perf_counter(), data))
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def emit(self, data):
+        await self.sio.emit('chat-message', data, to=self.sid, namespace=self.namespace)
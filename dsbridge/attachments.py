@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+
+import aiohttp
+import discord
+
+from dsbridge.cache import LRUCache
+from dsbridge.metrics import ATTACHMENTS
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class StoredAttachment:
+    sha256: str
+    filename: str
+    content_type: str | None
+    size: int
+
+
+class LocalAttachmentStore:
+    """
+    Content-addressed file store on a local or shared volume.
+    Files are kept under their SHA-256, so the same file stored again is not written twice.
+    Writes go to a temporary file first and are moved into place once complete, so readers
+    never see a partial file.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, sha256: str):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    async def write(self, chunks, max_size: int):
+        """
+        Store a file streamed in chunks, hashing it on the way
+        Args:
+            chunks: Async iterator of bytes
+            max_size: Largest size accepted, in bytes
+        Returns:
+            Tuple of the SHA-256 hex digest, the size and whether the file was new
+        Raises:
+            AttachmentTooLarge: If the stream is longer than max_size. Nothing is stored
+        """
+        temp_directory = os.path.join(self.directory, 'tmp')
+        await asyncio.to_thread(os.makedirs, temp_directory, exist_ok=True)
+        temp = await asyncio.to_thread(tempfile.NamedTemporaryFile, dir=temp_directory, delete=False)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise AttachmentTooLarge(f'Attachment is larger than {max_size} bytes')
+                await asyncio.to_thread(self._append, temp, digest, chunk)
+            await asyncio.to_thread(temp.close)
+            sha256 = digest.hexdigest()
+            new = await asyncio.to_thread(self._move_into_place, temp.name, sha256)
+        except BaseException:
+            await asyncio.to_thread(self._discard, temp)
+            raise
+        return sha256, size, new
+
+    @staticmethod
+    def _append(temp, digest, chunk):
+        digest.update(chunk)
+        temp.write(chunk)
+
+    def _move_into_place(self, temp_path, sha256):
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return True
+
+    @staticmethod
+    def _discard(temp):
+        temp.close()
+        if os.path.exists(temp.name):
+            os.remove(temp.name)
+
+
+class AttachmentRelay:
+    """
+    Moves attachments and stickers between Discord and the attachment store shared with the
+    server. Downloads from Discord's CDN are streamed into the store in chunks and uploads
+    to Discord are streamed from it, so files are never held in memory whole. At most
+    concurrency transfers run at once, and files larger than max_size are skipped. Discord
+    attachments already stored are remembered by ID, so edits and replays of a message do
+    not download them again.
+    """
+    def __init__(self, store, max_size, concurrency, chunk_size=64 * 1024, cache_size=10000):
+        self.store = store
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.fetched = LRUCache(cache_size)
+        self.transfers = asyncio.Semaphore(concurrency)
+        self._http = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(LocalAttachmentStore(config.ATTACHMENT_STORE_PATH), config.ATTACHMENT_MAX_SIZE,
+                   config.ATTACHMENT_CONCURRENCY, config.ATTACHMENT_CHUNK_SIZE, config.ATTACHMENT_CACHE_SIZE)
+
+    async def fetch_all(self, message):
+        """
+        Store the attachments and stickers of a Discord message
+        Args:
+            message: DiscordMessage
+        Returns:
+            List of StoredAttachment, without the files that were skipped or failed
+        """
+        items = [*message.attachments, *getattr(message, 'stickers', ())]
+        if not items:
+            return []
+        stored = await asyncio.gather(*(self.fetch(item) for item in items))
+        return [attachment for attachment in stored if attachment is not None]
+
+    async def fetch(self, item):
+        """
+        Store a Discord attachment or sticker
+        Args:
+            item: discord.Attachment or discord.StickerItem
+        Returns:
+            StoredAttachment, or None if it was skipped or failed
+        """
+        stored = self.fetched.get(item.id)
+        if stored is not None:
+            ATTACHMENTS.inc('discord', 'cached')
+            return stored
+
+        if isinstance(item, discord.Attachment):
+            filename, content_type, size = item.filename, item.content_type, item.size
+        else:
+            filename, content_type, size = f'{item.name}.{item.format.file_extension}', None, None
+        if size is not None and size > self.max_size:
+            ATTACHMENTS.inc('discord', 'too_large')
+            logging.info('Skipped Discord attachment %s of %d bytes', item.id, size,
+                         extra={'attachment_id': item.id, 'size': size})
+            return None
+
+        try:
+            async with self.transfers:
+                async with self.http().get(item.url) as response:
+                    response.raise_for_status()
+                    sha256, size, new = await self.store.write(
+                        response.content.iter_chunked(self.chunk_size), self.max_size)
+        except AttachmentTooLarge as e:
+            ATTACHMENTS.inc('discord', 'too_large')
+            logging.info('Skipped Discord attachment %s: %s', item.id, e, extra={'attachment_id': item.id})
+            return None
+        except (aiohttp.ClientError, TimeoutError, OSError) as e:
+            ATTACHMENTS.inc('discord', 'failed')
+            logging.warning('Error downloading Discord attachment %s: %s', item.id, e,
+                            extra={'attachment_id': item.id})
+            return None
+
+        stored = StoredAttachment(sha256, filename, content_type, size)
+        self.fetched.put(item.id, stored)
+        ATTACHMENTS.inc('discord', 'stored' if new else 'deduplicated')
+        return stored
+
+    def discord_files(self, attachments):
+        """
+        Open stored attachments for upload to Discord
+        Args:
+            attachments: Attachment rows or StoredAttachments
+        Returns:
+            List of discord.File, without the files that are too large or missing
+        """
+        files = []
+        for attachment in attachments:
+            if attachment.size > self.max_size:
+                ATTACHMENTS.inc('server', 'too_large')
+                continue
+            try:
+                files.append(discord.File(self.store.path(attachment.sha256), filename=attachment.filename))
+            except OSError as e:
+                ATTACHMENTS.inc('server', 'failed')
+                logging.warning('Error opening stored attachment %s: %s', attachment.sha256, e,
+                                extra={'sha256': attachment.sha256})
+                continue
+            ATTACHMENTS.inc('server', 'sent')
+        return files
+
+    def http(self):
+        if self._http is None or self._http.closed:
+            # No total timeout, since large files take a while; a stalled read still fails
+            self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_read=30))
+        return self._http
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
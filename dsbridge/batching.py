@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+
+class MessageBatcher:
+    """
+    Write-behind queue for Discord messages bound for the server.
+    Messages are inserted in bulk once batch_size messages are queued or flush_interval
+    seconds after the first queued message, whichever comes first. Queue order is kept
+    in the inserts, so messages of a channel keep their order. A batch whose insert fails
+    is held and inserted first on the next flush, retried with exponential backoff; while
+    the queue holds max_size messages, put waits for room.
+    """
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, server, batch_size, flush_interval, max_size=10000):
+        self.server = server
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(max_size)
+        # Batch taken off the queue whose insert has not been committed yet
+        self._held = []
+        self._pending = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    @property
+    def pending(self):
+        """
+        Number of messages not inserted yet
+        """
+        return self.queue.qsize() + len(self._held)
+
+    async def put(self, message, attachments=()):
+        """
+        Queue a message for insertion
+        Args:
+            message: DiscordMessage
+            attachments: StoredAttachments of the message
+        """
+        await self.queue.put((message, attachments))
+        self._pending.set()
+        if self.queue.qsize() >= self.batch_size:
+            try:
+                await self.flush()
+            except Exception as e:
+                # The message is still queued; run() retries the insert
+                logging.warning('Error flushing message queue: %s', e)
+
+    async def flush(self):
+        """
+        Insert all queued messages
+        Raises:
+            Exception: If an insert fails. Its batch is kept and inserted first next time
+        """
+        async with self._lock:
+            while self._held or not self.queue.empty():
+                if not self._held:
+                    while not self.queue.empty() and len(self._held) < self.batch_size:
+                        self._held.append(self.queue.get_nowait())
+                await self.server.insert_messages([message for message, _ in self._held],
+                                                  {message.id: attachments for message, attachments in self._held})
+                self._held = []
+            self._pending.clear()
+
+    async def run(self):
+        """
+        Flush queued messages on the time trigger
+        """
+        logging.info('Starting write-behind message queue')
+        delay = self.flush_interval
+        while True:
+            await self._pending.wait()
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+                delay = self.flush_interval
+            except Exception as e:
+                delay = min(max(delay * 2, 1.0), self.MAX_BACKOFF)
+                logging.error('Error flushing message queue, retrying in %.1fs: %s', delay, e, extra={'delay': delay})
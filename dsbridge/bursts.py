@@ -0,0 +1,71 @@
+import hashlib
+import time
+from collections import Counter
+from collections import deque
+from collections import OrderedDict
+
+
+def content_key(text: str):
+    """
+    Hash message content for the verdict cache and the burst detector
+    Args:
+        text: Message content
+    Returns:
+        16 byte digest
+    """
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class DuplicateBurstDetector:
+    """
+    Spots the same text posted over and over in a channel, as in spam waves.
+    Each channel remembers the content hashes of its messages from the last window seconds;
+    a message whose text was already seen limit times in that window is a repeat. Channels
+    are kept in LRU order and at most max_channels are tracked.
+    """
+    def __init__(self, limit, window, max_channels=10000, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.max_channels = max_channels
+        self.clock = clock
+        self.repeats = 0
+        self._channels = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.DUPLICATE_BURST_LIMIT, config.DUPLICATE_BURST_WINDOW)
+
+    def is_repeat(self, channel_id: int, text: str):
+        """
+        Record a message and check whether it repeats a burst
+        Args:
+            channel_id: Discord channel ID
+            text: Message content
+        Returns:
+            True if the same text was seen limit times in the channel within the window
+        """
+        if not text:
+            return False
+        now = self.clock()
+        state = self._channels.get(channel_id)
+        if state is None:
+            state = self._channels[channel_id] = (deque(), Counter())
+            while len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(channel_id)
+
+        recent, counts = state
+        while recent and recent[0][0] <= now - self.window:
+            _, expired = recent.popleft()
+            counts[expired] -= 1
+            if not counts[expired]:
+                del counts[expired]
+
+        key = content_key(text)
+        repeat = counts[key] >= self.limit
+        recent.append((now, key))
+        counts[key] += 1
+        if repeat:
+            self.repeats += 1
+        return repeat
@@ -0,0 +1,170 @@
+import time
+from array import array
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache with an optional time-to-live per entry
+    """
+    def __init__(self, maxsize=10000, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Get a value from the cache
+        Args:
+            key: Cache key
+            default: Value returned on a miss
+        Returns:
+            Cached value or default
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at is None or expires_at > self.clock():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """
+        Add or replace a value, evicting the least recently used entry when full
+        Args:
+            key: Cache key
+            value: Value to cache
+        """
+        expires_at = self.clock() + self.ttl if self.ttl else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove a value from the cache
+        Args:
+            key: Cache key
+            default: Value returned if the key is not cached
+        Returns:
+            Removed value or default
+        """
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class MessageRecord(NamedTuple):
+    id: int
+    channel_id: int
+    author_id: int
+    content_hash: int
+
+
+class MessageRecordCache:
+    """
+    Bounded cache of the few fields of recent Discord messages needed for raw edit and delete
+    events. Records are stored in preallocated arrays used as a ring, evicting the oldest
+    message when full, so each one costs its index entry and 32 bytes instead of a full
+    discord.Message.
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._ids = array('Q', bytes(8 * maxsize))
+        self._channel_ids = array('Q', bytes(8 * maxsize))
+        self._author_ids = array('Q', bytes(8 * maxsize))
+        self._content_hashes = array('q', bytes(8 * maxsize))
+        self._slots = {}
+        self._next = 0
+
+    def put(self, message_id, channel_id, author_id, content, attachment_ids=()):
+        """
+        Add or update the record of a message, evicting the oldest record when full
+        Args:
+            message_id: Discord message ID
+            channel_id: Discord channel ID
+            author_id: Discord user or webhook ID
+            content: Message content
+            attachment_ids: IDs of the message's attachments
+        Returns:
+            False if the message was already cached with the same content and attachments
+        """
+        if not self.maxsize:
+            return True
+        content_hash = hash((content, tuple(attachment_ids)))
+        slot = self._slots.get(message_id)
+        if slot is not None:
+            if self._content_hashes[slot] == content_hash:
+                return False
+        else:
+            slot = self._next
+            self._next = (slot + 1) % self.maxsize
+            evicted = self._ids[slot]
+            if evicted and self._slots.get(evicted) == slot:
+                del self._slots[evicted]
+            self._slots[message_id] = slot
+            self._ids[slot] = message_id
+        self._channel_ids[slot] = channel_id
+        self._author_ids[slot] = author_id
+        self._content_hashes[slot] = content_hash
+        return True
+
+    def get(self, message_id):
+        """
+        Get the record of a message
+        Args:
+            message_id: Discord message ID
+        Returns:
+            MessageRecord or None
+        """
+        slot = self._slots.get(message_id)
+        if slot is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return MessageRecord(message_id, self._channel_ids[slot], self._author_ids[slot],
+                             self._content_hashes[slot])
+
+    def pop(self, message_id):
+        """
+        Remove the record of a message
+        Args:
+            message_id: Discord message ID
+        Returns:
+            Removed MessageRecord or None
+        """
+        record = self.get(message_id)
+        if record is not None:
+            self._ids[self._slots.pop(message_id)] = 0
+        return record
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._slots)}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, message_id):
+        return message_id in self._slots
@@ -0,0 +1,180 @@
+import json
+import re
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Only these keys are parsed as datetimes when decoding
+DATETIME_FIELDS = frozenset({'created_at', 'last_updated'})
+ISO_DATETIME_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2})?$')
+
+
+def object_jsonify(o):
+    if callable(getattr(o, 'to_dict', None)):
+        return o.to_dict()
+    elif isinstance(o, (datetime, date, timedelta)):
+        return o.isoformat()
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def parse_datetimes(obj):
+    """
+    Convert ISO datetime strings of the known datetime fields, in place
+    Args:
+        obj: Decoded JSON value
+    Returns:
+        The same value
+    """
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if isinstance(v, str):
+                if k in DATETIME_FIELDS and ISO_DATETIME_PATTERN.match(v):
+                    obj[k] = datetime.fromisoformat(v)
+            elif isinstance(v, (dict, list)):
+                parse_datetimes(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            if isinstance(v, (dict, list)):
+                parse_datetimes(v)
+    return obj
+
+
+class StdlibJSONCodec:
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return json.dumps(obj, **kwargs, default=object_jsonify)
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return parse_datetimes(json.loads(s, **kwargs))
+
+
+class OrjsonCodec:
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # orjson always writes compact output, which is what socket.io asks for
+        return orjson.dumps(obj, default=object_jsonify).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return parse_datetimes(orjson.loads(s))
+
+
+def get_codec(name='auto'):
+    """
+    Get the JSON codec for the socket.io client
+    Args:
+        name: 'orjson', 'stdlib' or 'auto' to use orjson when it is installed
+    Returns:
+        Codec class with dumps and loads
+    """
+    if name == 'stdlib' or (name == 'auto' and orjson is None):
+        return StdlibJSONCodec
+    if name in ('orjson', 'auto'):
+        if orjson is None:
+            raise ImportError('orjson is not installed')
+        return OrjsonCodec
+    raise ValueError(f'Unknown JSON codec: {name}')
+
+
+@dataclass(frozen=True, slots=True)
+class NewMessageEvent:
+    message_id: int
+    channel_id: int | None = None
+    type: str = field(default='new-message', init=False)
+
+    def to_dict(self):
+        return _without_none(asdict(self))
+
+
+@dataclass(frozen=True, slots=True)
+class NewMessagesEvent:
+    message_ids: list[int]
+    channel_id: int | None = None
+    type: str = field(default='new-messages', init=False)
+
+    def to_dict(self):
+        return _without_none(asdict(self))
+
+
+@dataclass(frozen=True, slots=True)
+class EditMessageEvent:
+    before_message_id: int
+    after_message_id: int
+    channel_id: int | None = None
+    type: str = field(default='edit-message', init=False)
+
+    def to_dict(self):
+        return _without_none(asdict(self))
+
+
+@dataclass(frozen=True, slots=True)
+class DeleteMessageEvent:
+    message_id: int
+    channel_id: int | None = None
+    type: str = field(default='delete-message', init=False)
+
+    def to_dict(self):
+        return _without_none(asdict(self))
+
+
+EVENT_TYPES = {
+    'new-message': NewMessageEvent,
+    'new-messages': NewMessagesEvent,
+    'edit-message': EditMessageEvent,
+    'delete-message': DeleteMessageEvent,
+}
+
+# (field name, is a list of IDs) for each event, without the fixed type field
+EVENT_FIELDS = {
+    event_type: [(name, annotation == list[int]) for name, annotation in event_type.__annotations__.items()
+                 if name != 'type']
+    for event_type in EVENT_TYPES.values()
+}
+
+
+def parse_event(data):
+    """
+    Validate a chat-message payload
+    Args:
+        data: Decoded payload
+    Returns:
+        Typed event
+    Raises:
+        ValueError: If the payload type is unknown or a field is missing or invalid
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f'Invalid chat-message payload: {data!r}')
+    event_type = EVENT_TYPES.get(data.get('type'))
+    if event_type is None:
+        raise ValueError(f'Unknown message type: {data.get("type")}')
+
+    kwargs = {}
+    for name, is_list in EVENT_FIELDS[event_type]:
+        value = data.get(name)
+        if value is None and name == 'channel_id':
+            continue
+        if is_list:
+            valid = isinstance(value, list) and all(_is_id(v) for v in value)
+        else:
+            valid = _is_id(value)
+        if not valid:
+            raise ValueError(f'Invalid {name} in {data["type"]} payload: {value!r}')
+        kwargs[name] = value
+    return event_type(**kwargs)
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _without_none(data):
+    return {k: v for k, v in data.items() if v is not None}
@@ -1,6 +1,7 @@
 import os
 
 from decouple import config
+from decouple import Csv
 
 
 class Config(object):
@@ -28,15 +29,140 @@ class Config(object):
     APP_SECRET_KEY = config('APP_SECRET_KEY')
     SERVER_NAMESPACE = config('SERVER_NAMESPACE')
     HOST_URL = config('HOST_URL')
-    SQLALCHEMY_DATABASE_URI = '{}://{}:{}@{}:{}/{}'.format(
+    # Server handshake: 'pbkdf2' password hash or 'hmac' signed timestamp
+    SERVER_AUTH_MODE = config('SERVER_AUTH_MODE', default='pbkdf2')
+    SERVER_RECONNECT_BASE = config('SERVER_RECONNECT_BASE', default=1.0, cast=float)
+    SERVER_RECONNECT_MAX = config('SERVER_RECONNECT_MAX', default=60.0, cast=float)
+    # More server namespaces bridged from this process, as namespace=host entries; the host
+    # defaults to HOST_URL and APP_SECRET_KEY is shared. Channels are routed by their
+    # chat_channels.namespace, reloaded every SERVER_ROUTE_REFRESH seconds
+    SERVER_ENDPOINTS = config('SERVER_ENDPOINTS', default='', cast=Csv())
+    SERVER_ROUTE_REFRESH = config('SERVER_ROUTE_REFRESH', default=300, cast=float)
+    SQLALCHEMY_DATABASE_URI = '{}+{}://{}:{}@{}:{}/{}'.format(
         config('DB_ENGINE', default='postgresql'),
+        config('DB_DRIVER', default='asyncpg'),
         config('DB_USERNAME', default='root'),
         config('DB_PASS', default='pass'),
         config('DB_HOST', default='localhost'),
         config('DB_PORT', default=5432),
         config('DB_NAME', default='bets'),
     )
-    BANNED_WORDS = import_txt_as_list(config('BANNED_WORDS_FILE'))
+    # Connection pool, ignored by SQLite. Pre-ping costs a round trip per checkout; without it
+    # stale connections are replaced by pool recycling and the handler retries
+    DB_POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+    DB_MAX_OVERFLOW = config('DB_MAX_OVERFLOW', default=10, cast=int)
+    DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=30, cast=float)
+    DB_POOL_RECYCLE = config('DB_POOL_RECYCLE', default=1800, cast=int)
+    DB_POOL_PRE_PING = config('DB_POOL_PRE_PING', default=False, cast=bool)
+    # Server-side statement timeout in milliseconds, 0 for none (asyncpg only)
+    DB_STATEMENT_TIMEOUT = config('DB_STATEMENT_TIMEOUT', default=0, cast=int)
+    # Prepared statements kept per connection by asyncpg, and compiled statements kept by SQLAlchemy
+    DB_PREPARED_STATEMENT_CACHE_SIZE = config('DB_PREPARED_STATEMENT_CACHE_SIZE', default=100, cast=int)
+    DB_QUERY_CACHE_SIZE = config('DB_QUERY_CACHE_SIZE', default=500, cast=int)
+    # Log every SQL statement
+    DB_ECHO = config('DB_ECHO', default=False, cast=bool)
+    # Reloaded on SIGHUP
+    BANNED_WORDS_FILE = config('BANNED_WORDS_FILE')
+    BANNED_WORDS = import_txt_as_list(BANNED_WORDS_FILE)
+    # Logging: json or text records written by a background thread. LOG_SAMPLE_RATE is the
+    # share of per-message info logs kept; warnings and errors are always kept
+    LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+    LOG_FORMAT = config('LOG_FORMAT', default='json')
+    LOG_SAMPLE_RATE = config('LOG_SAMPLE_RATE', default=1.0, cast=float)
+    METRICS_ENABLED = config('METRICS_ENABLED', default=False, cast=bool)
+    METRICS_HOST = config('METRICS_HOST', default='127.0.0.1')
+    METRICS_PORT = config('METRICS_PORT', default=9108, cast=int)
+    # JSON codec for the socket.io connection: auto, orjson or stdlib
+    JSON_CODEC = config('JSON_CODEC', default='auto')
+
+    # Discord to server ID lookups cached by Server
+    IDENTITY_CACHE_SIZE = config('IDENTITY_CACHE_SIZE', default=100000, cast=int)
+    IDENTITY_CACHE_TTL = config('IDENTITY_CACHE_TTL', default=3600, cast=float)
+
+    # Batched inserts of Discord messages. Handlers wait once WRITE_BEHIND_MAX_QUEUE messages
+    # are waiting, e.g. while the database is down
+    WRITE_BEHIND_ENABLED = config('WRITE_BEHIND_ENABLED', default=False, cast=bool)
+    WRITE_BEHIND_BATCH_SIZE = config('WRITE_BEHIND_BATCH_SIZE', default=100, cast=int)
+    WRITE_BEHIND_FLUSH_INTERVAL = config('WRITE_BEHIND_FLUSH_INTERVAL', default=0.05, cast=float)
+    WRITE_BEHIND_MAX_QUEUE = config('WRITE_BEHIND_MAX_QUEUE', default=10000, cast=int)
+
+    # Events for the server are stored in an outbox and sent by a background relay
+    OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=100, cast=int)
+    OUTBOX_MAX_BACKOFF = config('OUTBOX_MAX_BACKOFF', default=60, cast=float)
+
+    # Catch-up sync of messages missed while offline, run on startup and reconnect
+    SYNC_ENABLED = config('SYNC_ENABLED', default=True, cast=bool)
+    SYNC_WORKERS = config('SYNC_WORKERS', default=8, cast=int)
+    SYNC_PAGE_SIZE = config('SYNC_PAGE_SIZE', default=100, cast=int)
+    # How far back to look for unsent server messages in a channel that was never synced
+    SYNC_LOOKBACK = config('SYNC_LOOKBACK', default=3600, cast=float)
+
+    # Attachments and stickers are relayed through a content-addressed store on a volume
+    # shared with the server. Files over ATTACHMENT_MAX_SIZE bytes are skipped and at most
+    # ATTACHMENT_CONCURRENCY transfers run at once
+    ATTACHMENTS_ENABLED = config('ATTACHMENTS_ENABLED', default=False, cast=bool)
+    ATTACHMENT_STORE_PATH = config('ATTACHMENT_STORE_PATH', default='attachments')
+    ATTACHMENT_MAX_SIZE = config('ATTACHMENT_MAX_SIZE', default=10 * 1024 * 1024, cast=int)
+    ATTACHMENT_CONCURRENCY = config('ATTACHMENT_CONCURRENCY', default=4, cast=int)
+    ATTACHMENT_CHUNK_SIZE = config('ATTACHMENT_CHUNK_SIZE', default=64 * 1024, cast=int)
+    ATTACHMENT_CACHE_SIZE = config('ATTACHMENT_CACHE_SIZE', default=10000, cast=int)
+
+    # Removal of hidden message rows older than RETENTION_MAX_AGE seconds, with edits kept
+    # in the current message's edit_history. Run by the first worker process only
+    RETENTION_ENABLED = config('RETENTION_ENABLED', default=False, cast=bool)
+    RETENTION_INTERVAL = config('RETENTION_INTERVAL', default=3600, cast=float)
+    RETENTION_MAX_AGE = config('RETENTION_MAX_AGE', default=30 * 24 * 3600, cast=float)
+    RETENTION_BATCH_SIZE = config('RETENTION_BATCH_SIZE', default=1000, cast=int)
+    RETENTION_BATCH_PAUSE = config('RETENTION_BATCH_PAUSE', default=0.5, cast=float)
+
+    # Where sanitization runs: process, thread or inline. Messages shorter than the
+    # threshold are always checked inline
+    SANITIZER_MODE = config('SANITIZER_MODE', default='process')
+    SANITIZER_WORKERS = config('SANITIZER_WORKERS', default=2, cast=int)
+    SANITIZER_BATCH_SIZE = config('SANITIZER_BATCH_SIZE', default=64, cast=int)
+    SANITIZER_INLINE_THRESHOLD = config('SANITIZER_INLINE_THRESHOLD', default=1000, cast=int)
+    # Verdicts cached by content hash, 0 to check every message
+    SANITIZER_CACHE_SIZE = config('SANITIZER_CACHE_SIZE', default=10000, cast=int)
+    # A text posted more than DUPLICATE_BURST_LIMIT times in a channel within
+    # DUPLICATE_BURST_WINDOW seconds is not forwarded ('drop') or also deleted from Discord
+    # ('delete'). 0 turns the check off
+    DUPLICATE_BURST_LIMIT = config('DUPLICATE_BURST_LIMIT', default=0, cast=int)
+    DUPLICATE_BURST_WINDOW = config('DUPLICATE_BURST_WINDOW', default=30.0, cast=float)
+    DUPLICATE_BURST_ACTION = config('DUPLICATE_BURST_ACTION', default='drop')
+
+    # Per-channel ordered event handling
+    DISPATCH_MAX_CONCURRENCY = config('DISPATCH_MAX_CONCURRENCY', default=32, cast=int)
+    DISPATCH_MAX_PENDING = config('DISPATCH_MAX_PENDING', default=10000, cast=int)
+    DISPATCH_OVERFLOW = config('DISPATCH_OVERFLOW', default='block')
+
+    # Sharding: 0 runs a single unsharded connection. With WORKER_PROCESSES > 1 the shards
+    # are split between processes, each with its own server connection and database pool
+    DISCORD_SHARD_COUNT = config('DISCORD_SHARD_COUNT', default=0, cast=int)
+    WORKER_PROCESSES = config('WORKER_PROCESSES', default=1, cast=int)
+    # Workers that exit are restarted with exponential backoff. The launcher gives up after
+    # WORKER_MAX_RESTARTS exits in a row (0 for never); an exit after running longer than
+    # WORKER_RESTART_MAX seconds starts the count again
+    WORKER_RESTART_BASE = config('WORKER_RESTART_BASE', default=1.0, cast=float)
+    WORKER_RESTART_MAX = config('WORKER_RESTART_MAX', default=60.0, cast=float)
+    WORKER_MAX_RESTARTS = config('WORKER_MAX_RESTARTS', default=10, cast=int)
+
+    # Server to Discord sends
+    DISCORD_USE_WEBHOOKS = config('DISCORD_USE_WEBHOOKS', default=False, cast=bool)
+    DISCORD_WEBHOOK_NAME = config('DISCORD_WEBHOOK_NAME', default='DSBridge')
+    DISCORD_COALESCE_WINDOW = config('DISCORD_COALESCE_WINDOW', default=0.0, cast=float)
+    DISCORD_CHANNEL_RATE = config('DISCORD_CHANNEL_RATE', default=5, cast=int)
+    DISCORD_CHANNEL_RATE_PERIOD = config('DISCORD_CHANNEL_RATE_PERIOD', default=5.0, cast=float)
+    DISCORD_MESSAGE_CACHE_SIZE = config('DISCORD_MESSAGE_CACHE_SIZE', default=1000, cast=int)
+
+    # Gateway caches. Edits and deletes are matched through DISCORD_MESSAGE_RECORDS compact
+    # records of recent messages. For a low-memory profile set DISCORD_INTENTS=minimal,
+    # DISCORD_MAX_MESSAGES=0 to turn off discord.py's cache of full messages and
+    # DISCORD_MEMBER_CACHE=none
+    DISCORD_INTENTS = config('DISCORD_INTENTS', default='default')
+    DISCORD_MESSAGE_RECORDS = config('DISCORD_MESSAGE_RECORDS', default=100000, cast=int)
+    DISCORD_MAX_MESSAGES = config('DISCORD_MAX_MESSAGES', default=1000, cast=int)
+    DISCORD_MEMBER_CACHE = config('DISCORD_MEMBER_CACHE', default='intents')
+    DISCORD_CHUNK_GUILDS = config('DISCORD_CHUNK_GUILDS', default=False, cast=bool)
 
 
 app_config = Config()
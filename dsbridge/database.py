@@ -1,11 +1,42 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import AsyncAttrs
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import declarative_base
 from dsbridge.config import app_config
-from sqlalchemy.orm import scoped_session
 
 
-engine = create_engine(app_config.SQLALCHEMY_DATABASE_URI, echo=True, pool_pre_ping=True)
-session_factory = sessionmaker(bind=engine)
-session = scoped_session(session_factory)
-Base = declarative_base()
+def create_engine_from_config(config):
+    """
+    Create the async engine with the pool, timeout and cache settings from the config
+    Args:
+        config: Config
+    Returns:
+        AsyncEngine
+    """
+    url = make_url(config.SQLALCHEMY_DATABASE_URI)
+    options = {
+        'pool_pre_ping': config.DB_POOL_PRE_PING,
+        'query_cache_size': config.DB_QUERY_CACHE_SIZE,
+    }
+    if url.get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+            pool_recycle=config.DB_POOL_RECYCLE,
+        )
+
+    connect_args = {}
+    if url.get_driver_name() == 'asyncpg':
+        connect_args['prepared_statement_cache_size'] = config.DB_PREPARED_STATEMENT_CACHE_SIZE
+        if config.DB_STATEMENT_TIMEOUT:
+            connect_args['server_settings'] = {'statement_timeout': str(config.DB_STATEMENT_TIMEOUT)}
+
+    return create_async_engine(url, connect_args=connect_args, **options)
+
+
+engine = create_engine_from_config(app_config)
+# Sessions are created per task, never shared between concurrent handlers
+session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+Base = declarative_base(cls=AsyncAttrs)
@@ -1,21 +1,60 @@
+import asyncio
 import logging
 
 import discord
 from discord.ext import commands
 from discord.message import Message as DiscordMessage
+from discord.message import PartialMessage
+from discord.raw_models import RawBulkMessageDeleteEvent
+from discord.raw_models import RawMessageDeleteEvent
+from discord.raw_models import RawMessageUpdateEvent
 
 import dsbridge.utils as utils
+from dsbridge.attachments import AttachmentRelay
+from dsbridge.bursts import DuplicateBurstDetector
+from dsbridge.cache import MessageRecordCache
+from dsbridge.dispatcher import ChannelDispatcher
+from dsbridge.metrics import EVENTS
+from dsbridge.metrics import SANITIZER_SECONDS
+from dsbridge.metrics import SUPPRESSED_MESSAGES
+from dsbridge.outbound import OutboundSender
+from dsbridge.sanitizer_executor import SanitizerExecutor
 
 
 class DiscordBot:
-    def __init__(self, config):
-        intents = discord.Intents.default()
-        intents.messages = True
-        intents.message_content = True
-        intents.guilds = True
-        self.bot = commands.Bot(command_prefix='!', intents=intents)
+    def __init__(self, config, dispatcher=None, shard_ids=None):
+        intents = build_intents(config)
+        options = {
+            'intents': intents,
+            # Edits and deletes are matched through self.messages, so discord.py's own cache of
+            # full messages can be turned off
+            'max_messages': config.DISCORD_MAX_MESSAGES or None,
+            'member_cache_flags': (discord.MemberCacheFlags.none() if config.DISCORD_MEMBER_CACHE == 'none'
+                                   else discord.MemberCacheFlags.from_intents(intents)),
+            'chunk_guilds_at_startup': config.DISCORD_CHUNK_GUILDS,
+        }
+        # Shard IDs run by this process, or None for a single unsharded connection
+        self.shard_ids = shard_ids
+        # Whether other processes run some of the shards
+        self.partial_shards = False
+        if config.DISCORD_SHARD_COUNT:
+            self.shard_ids = shard_ids or list(range(config.DISCORD_SHARD_COUNT))
+            self.partial_shards = set(self.shard_ids) != set(range(config.DISCORD_SHARD_COUNT))
+            self.bot = commands.AutoShardedBot(command_prefix='!', shard_count=config.DISCORD_SHARD_COUNT,
+                                               shard_ids=self.shard_ids, **options)
+        else:
+            self.bot = commands.Bot(command_prefix='!', **options)
+        self.ready = asyncio.Event()
         self.server_bot = None
         self.config = config
+        self.sanitizer = utils.Sanitizer(config.BANNED_WORDS)
+        self.sanitizer_executor = SanitizerExecutor.from_config(self.sanitizer, config)
+        self.bursts = DuplicateBurstDetector.from_config(config) if config.DUPLICATE_BURST_LIMIT else None
+        self.dispatcher = dispatcher or ChannelDispatcher.from_config(config)
+        self.attachments = AttachmentRelay.from_config(config) if config.ATTACHMENTS_ENABLED else None
+        self.sender = OutboundSender(self.bot, config, self.attachments)
+        self.messages = MessageRecordCache(config.DISCORD_MESSAGE_RECORDS)
+        self.catch_up = None
 
         self.add_routes()
 
@@ -33,51 +72,225 @@ class DiscordBot:
         """
         @self.bot.event
         async def on_ready():
-            logging.info(f'Logged in to Discord as {self.bot.user.name}')
+            logging.info('Logged in to Discord as %s, shards: %s', self.bot.user.name, self.shard_ids or 'all',
+                         extra={'shard_ids': self.shard_ids})
+            self.ready.set()
+            # Mirror whatever was missed while disconnected
+            if self.catch_up is not None:
+                self.catch_up.schedule()
 
         @self.bot.event
         @self.discord_bot_handler
         async def on_message(message: DiscordMessage):
-            sanitized_message = utils.sanitize_input(message.content, self.config.BANNED_WORDS)
-            if sanitized_message != message.content:
-                await message.delete()
-                logging.info(f'Discord message deleted due to sanitization: {message.id}')
-            else:
-                # Forward the message to the server
-                await self.server_bot.send_to_server(message)
-                logging.info(f'Discord message forwarded to server: {message.id}')
+            await self.dispatcher.submit(message.channel.id, self.forward_message, message)
 
+        # Every message is recorded, the bot's own included, so their deletes can be told apart
+        self.bot.add_listener(self.remember_message, 'on_message')
+
+        # The raw events fire for every message, not only those in discord.py's message cache
         @self.bot.event
         @self.discord_bot_handler
-        async def on_message_edit(before_msg: DiscordMessage, after_msg: DiscordMessage):
-            await self.server_bot.edit_message_text(before_msg, after_msg)
-            logging.info(f'Server message ID: {before_msg.id} edited following edit in Discord: {after_msg.id}')
+        async def on_raw_message_edit(payload: RawMessageUpdateEvent):
+            message = payload.message
+            changed = self.messages.put(message.id, message.channel.id, message.author.id, message.content,
+                                        [attachment.id for attachment in message.attachments])
+            # Updates that are not edits, such as link embeds loading or pins, leave edited_timestamp
+            # unset on a message never edited; a cached record also tells whether anything changed
+            if not payload.data.get('edited_timestamp') or not changed:
+                return
+            await self.dispatcher.submit(payload.channel_id, self.forward_message_edit, message)
 
         @self.bot.event
         @self.discord_bot_handler
-        async def on_message_delete(message: DiscordMessage):
-            await self.server_bot.delete_message(message)
-            logging.info(f'Server message deleted following deletion from Discord: {message.id}')
+        async def on_raw_message_delete(payload: RawMessageDeleteEvent):
+            self.messages.pop(payload.message_id)
+            channel = self.bot.get_partial_messageable(payload.channel_id, guild_id=payload.guild_id)
+            await self.dispatcher.submit(payload.channel_id, self.forward_message_delete,
+                                         channel.get_partial_message(payload.message_id))
+
+        @self.bot.event
+        @self.discord_bot_handler
+        async def on_raw_bulk_message_delete(payload: RawBulkMessageDeleteEvent):
+            channel = self.bot.get_partial_messageable(payload.channel_id, guild_id=payload.guild_id)
+            own = {message.id for message in payload.cached_messages if self.is_own_message(message)}
+            for message_id in sorted(payload.message_ids):
+                record = self.messages.pop(message_id)
+                if (record is not None and self.is_own_author(record.author_id)) or message_id in own:
+                    continue
+                await self.dispatcher.submit(payload.channel_id, self.forward_message_delete,
+                                             channel.get_partial_message(message_id))
+
+    async def remember_message(self, message: DiscordMessage):
+        self.messages.put(message.id, message.channel.id, message.author.id, message.content,
+                          [attachment.id for attachment in message.attachments])
+
+    async def forward_message(self, message: DiscordMessage):
+        """
+        Sanitize a new Discord message and forward it to the server
+        Args:
+            message: DiscordMessage
+        """
+        # Repeats of a spam wave never reach the sanitizer or the database
+        if self.bursts is not None and self.bursts.is_repeat(message.channel.id, message.content):
+            action = self.config.DUPLICATE_BURST_ACTION
+            if action == 'delete':
+                await message.delete()
+            SUPPRESSED_MESSAGES.inc(action)
+            logging.info('Repeated Discord message suppressed (%s): %s', action, message.id, extra={
+                'discord_message_id': message.id, 'discord_channel_id': message.channel.id, 'sampled': True})
+            return
+
+        with SANITIZER_SECONDS.time():
+            clean = await self.sanitizer_executor.is_clean(message.content)
+        if not clean:
+            await message.delete()
+            logging.info('Discord message deleted due to sanitization: %s', message.id, extra={
+                'discord_message_id': message.id, 'discord_channel_id': message.channel.id, 'sampled': True})
+        else:
+            # Forward the message to the server
+            attachments = await self.attachments.fetch_all(message) if self.attachments is not None else ()
+            await self.server_bot.send_to_server(message, attachments)
+            logging.info('Discord message forwarded to server: %s', message.id, extra={
+                'discord_message_id': message.id, 'discord_channel_id': message.channel.id, 'sampled': True})
+
+    async def forward_message_edit(self, message: DiscordMessage):
+        """
+        Forward a Discord message edit to the server
+        Args:
+            message: DiscordMessage after the edit
+        """
+        # Only the ID of the message before the edit is needed, and it is the same
+        attachments = await self.attachments.fetch_all(message) if self.attachments is not None else ()
+        await self.server_bot.edit_message_text(message, message, attachments)
+        logging.info('Server message edited following edit in Discord: %s', message.id,
+                     extra={'discord_message_id': message.id, 'discord_channel_id': message.channel.id,
+                            'sampled': True})
+
+    async def forward_message_delete(self, message: DiscordMessage | PartialMessage):
+        """
+        Forward a Discord message deletion to the server
+        Args:
+            message: DiscordMessage or the PartialMessage of a raw delete event
+        """
+        await self.server_bot.delete_message(message)
+        logging.info('Server message deleted following deletion from Discord: %s', message.id, extra={
+            'discord_message_id': message.id, 'discord_channel_id': message.channel.id, 'sampled': True})
+
+    def reload_banned_words(self):
+        """
+        Read the banned words file again and check messages against the new list
+        """
+        banned_words = self.config.import_txt_as_list(self.config.BANNED_WORDS_FILE)
+        self.sanitizer = utils.Sanitizer(banned_words)
+        self.sanitizer_executor.reload(self.sanitizer)
+        logging.info('Reloaded %d banned words', len(banned_words))
+
+    def is_own_message(self, message: DiscordMessage):
+        """
+        Check whether a message was posted by the bot itself, directly or through its webhooks
+        Args:
+            message: DiscordMessage
+        Returns:
+            True if the message came from the bot
+        """
+        return message.author == self.bot.user or message.webhook_id in self.sender.webhook_ids
+
+    def is_own_author(self, author_id: int):
+        """
+        Check whether an author ID is the bot itself or one of its webhooks
+        Args:
+            author_id: Discord user or webhook ID
+        Returns:
+            True if the ID belongs to the bot
+        """
+        return author_id == self.bot.user.id or author_id in self.sender.webhook_ids
+
+    def is_own_event(self, event):
+        """
+        Check whether a message or raw event is about a message posted by the bot itself
+        Args:
+            event: DiscordMessage or raw message event
+        Returns:
+            True if the message came from the bot, False if it did not or is not known
+        """
+        if isinstance(event, RawMessageUpdateEvent):
+            event = event.message
+        if isinstance(event, DiscordMessage):
+            return self.is_own_message(event)
+        if isinstance(event, RawMessageDeleteEvent):
+            record = self.messages.get(event.message_id)
+            if record is not None:
+                return self.is_own_author(record.author_id)
+            # Evicted from our records, but possibly still in discord.py's message cache
+            return event.cached_message is not None and self.is_own_message(event.cached_message)
+        return False
+
+    async def owns_channel(self, discord_channel_id: int):
+        """
+        Check whether a Discord channel belongs to a guild on this process's shards.
+        Only channels of guilds on our shards are cached, so this waits until the shards
+        are ready. A process running every shard handles every channel, cached or not.
+        Args:
+            discord_channel_id: Discord channel ID
+        Returns:
+            True if this process handles the channel
+        """
+        if not self.partial_shards:
+            return True
+        await self.ready.wait()
+        return self.bot.get_channel(discord_channel_id) is not None
+
+    async def get_channel(self, discord_channel_id: int):
+        """
+        Get a Discord channel from the cache, fetching it if it is not cached
+        Args:
+            discord_channel_id: Discord channel ID
+        Returns:
+            Discord channel
+        """
+        return self.bot.get_channel(discord_channel_id) or await self.bot.fetch_channel(discord_channel_id)
 
     async def start(self):
         """
         Start the discord bot
         """
         logging.info('Starting Discord Bot')
+        await self.sanitizer_executor.start()
         await self.bot.start(self.config.DISCORD_TOKEN, reconnect=True)
 
     # decorator for discord bot event handlers
     def discord_bot_handler(self, func):
         async def wrapper(*args, **kwargs):
             try:
-                # Ignore messages from the bot itself
-                if args[0].author == self.bot.user:
+                # Ignore messages from the bot itself, including those posted through its webhooks
+                if self.is_own_event(args[0]):
                     return
+                EVENTS.inc('discord', func.__name__)
                 return await func(*args, **kwargs)
             except Exception as e:
-                logging.error(f'Error in {func.__name__}: {e}')
+                logging.error('Error in %s: %s', func.__name__, e, extra={'handler': func.__name__})
                 raise
 
         wrapper.__name__ = func.__name__
 
         return wrapper
+
+
+def build_intents(config):
+    """
+    Build the gateway intents. The minimal profile only receives guild messages.
+    Args:
+        config: Config
+    Returns:
+        discord.Intents
+    """
+    if config.DISCORD_INTENTS == 'minimal':
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.guild_messages = True
+    else:
+        intents = discord.Intents.default()
+        intents.messages = True
+        intents.guilds = True
+    intents.message_content = True
+    return intents
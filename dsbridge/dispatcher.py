@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import deque
+
+from dsbridge.metrics import JOB_ERRORS
+from dsbridge.metrics import JOB_SECONDS
+
+
+class DispatcherFullError(Exception):
+    pass
+
+
+class ChannelDispatcher:
+    """
+    Runs jobs in order per channel and concurrently across channels.
+    At most max_concurrency jobs run at once and at most max_pending jobs wait in the
+    queues. When the queues are full, submit() waits for room ('block'), drops the job
+    ('drop') or raises DispatcherFullError ('error'), depending on the overflow policy.
+    """
+    OVERFLOW_POLICIES = ('block', 'drop', 'error')
+
+    def __init__(self, max_concurrency=32, max_pending=10000, overflow='block'):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow}')
+        self.overflow = overflow
+        self.pending = 0
+        self.dropped = 0
+        self._queues = {}
+        self._tasks = set()
+        self._slots = asyncio.Semaphore(max_pending)
+        self._workers = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.DISPATCH_MAX_CONCURRENCY, config.DISPATCH_MAX_PENDING, config.DISPATCH_OVERFLOW)
+
+    async def submit(self, key, func, *args):
+        """
+        Queue a job behind earlier jobs with the same key
+        Args:
+            key: Ordering key, usually a channel ID
+            func: Coroutine function to run
+            *args: Arguments for func
+        Returns:
+            True if the job was queued, False if it was dropped
+        """
+        if self._slots.locked() and self.overflow != 'block':
+            self.dropped += 1
+            if self.overflow == 'error':
+                raise DispatcherFullError(f'Dispatcher queue full, rejected job for {key}')
+            logging.warning('Dispatcher queue full, dropped job for %s', key, extra={'key': key})
+            return False
+
+        await self._slots.acquire()
+        self.pending += 1
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            task = asyncio.create_task(self._drain(key, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append((func, args))
+        return True
+
+    async def call(self, key, func, *args):
+        """
+        Run a job behind earlier jobs with the same key and wait for its result
+        Args:
+            key: Ordering key, usually a channel ID
+            func: Coroutine function to run
+            *args: Arguments for func
+        Returns:
+            Result of func
+        """
+        future = asyncio.get_running_loop().create_future()
+
+        async def job():
+            try:
+                result = await func(*args)
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            future.set_result(result)
+
+        job.__name__ = func.__name__
+        if not await self.submit(key, job):
+            raise DispatcherFullError(f'Dispatcher queue full, rejected job for {key}')
+        return await future
+
+    async def join(self):
+        """
+        Wait until all queued jobs have finished
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {'pending': self.pending, 'channels': len(self._queues), 'dropped': self.dropped}
+
+    async def _drain(self, key, queue):
+        try:
+            while queue:
+                func, args = queue.popleft()
+                try:
+                    async with self._workers:
+                        with JOB_SECONDS.time(func.__name__):
+                            await func(*args)
+                except Exception as e:
+                    JOB_ERRORS.inc(func.__name__)
+                    logging.error('Error in %s for %s: %s', func.__name__, key, e,
+                                  extra={'handler': func.__name__, 'key': key})
+                finally:
+                    self.pending -= 1
+                    self._slots.release()
+        finally:
+            del self._queues[key]
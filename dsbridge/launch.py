@@ -1,29 +1,202 @@
 import asyncio
 import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import wait
 
+from dsbridge import logs
+from dsbridge import metrics
+from dsbridge import migrations
 from dsbridge.config import app_config
-from dsbridge.database import Base
 from dsbridge.database import engine
 from dsbridge.discord_bot import DiscordBot
-from dsbridge.server import Server
+from dsbridge.dispatcher import ChannelDispatcher
+from dsbridge.retention import MessageRetention
+from dsbridge.router import ServerRouter
+from dsbridge.sync import CatchUpSync
 
 
-async def runner():
-    logging.info('Starting DSBridge')
+async def runner(worker_id=0, shard_ids=None, migrate=True):
+    """
+    Run the bridge in this process
+    Args:
+        worker_id: Index of this worker process
+        shard_ids: Discord shards run by this process, or None for all of them
+        migrate: Apply pending schema migrations before starting
+    """
+    logs.setup_logging(app_config)
+    logging.info('Starting DSBridge worker %s', worker_id, extra={'worker_id': worker_id})
 
-    # Initialize the server bot
-    server_bot = Server(app_config)
+    # Both bots share one dispatcher so the concurrency cap is global
+    dispatcher = ChannelDispatcher.from_config(app_config)
+
+    # Initialize the server bots, routed by channel when several namespaces are bridged
+    router = ServerRouter.from_config(app_config, dispatcher=dispatcher, worker_id=worker_id)
+    servers = list(router.servers.values())
+    server_bot = router if len(servers) > 1 else router.default
 
     # Initialize the Discord bot
-    discord_bot = DiscordBot(app_config)
+    discord_bot = DiscordBot(app_config, dispatcher=dispatcher, shard_ids=shard_ids)
 
     server_bot.init_bot(discord_bot)
     discord_bot.init_bot(server_bot)
 
-    Base.metadata.create_all(engine)
+    if app_config.SYNC_ENABLED:
+        for server in servers:
+            server.catch_up = CatchUpSync.from_config(server, discord_bot, app_config)
+        discord_bot.catch_up = router if len(servers) > 1 else router.default.catch_up
+
+    if migrate:
+        await migrations.upgrade()
+
+    if hasattr(signal, 'SIGHUP'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, discord_bot.reload_banned_words)
+
+    if app_config.METRICS_ENABLED:
+        register_metrics(servers, discord_bot, dispatcher)
+        # Each worker process serves its own metrics on the next port
+        await metrics.start_metrics_server(app_config.METRICS_HOST, app_config.METRICS_PORT + worker_id)
+
+    tasks = [discord_bot.start(), server_bot.start()]
+    for server in servers:
+        tasks.append(server.outbox.run())
+        if server.batcher is not None:
+            tasks.append(server.batcher.run())
+    # The table is shared, so one worker cleans it up for all of them
+    if app_config.RETENTION_ENABLED and worker_id == 0:
+        tasks.append(MessageRetention.from_config(router.default, app_config).run())
 
     # Start both bots concurrently
-    await asyncio.gather(
-        discord_bot.start(),
-        server_bot.start(),
-    )
+    await asyncio.gather(*tasks)
+
+
+def shard_ranges(shard_count: int, workers: int):
+    """
+    Split the shards between worker processes
+    Args:
+        shard_count: Total number of Discord shards
+        workers: Number of worker processes
+    Returns:
+        List of shard IDs for each worker
+    """
+    if shard_count < workers:
+        raise ValueError(f'DISCORD_SHARD_COUNT ({shard_count}) must be at least WORKER_PROCESSES ({workers})')
+    return [list(range(worker_id, shard_count, workers)) for worker_id in range(workers)]
+
+
+def restart_delay(failures: int, base: float, maximum: float):
+    """
+    Delay before restarting a worker that exited
+    Args:
+        failures: Consecutive exits of the worker, including this one
+        base: Delay after the first exit
+        maximum: Longest delay
+    Returns:
+        Seconds to wait
+    """
+    return min(base * 2 ** (failures - 1), maximum)
+
+
+def run_worker(worker_id: int, shard_ids: list[int]):
+    asyncio.run(runner(worker_id, shard_ids, migrate=False))
+
+
+def run_workers(config):
+    """
+    Run one worker process per shard range and restart any that exit, with exponential
+    backoff. A worker that exits more than WORKER_MAX_RESTARTS times in a row makes this
+    give up and stop the others.
+    Args:
+        config: Config
+    Raises:
+        RuntimeError: If a worker keeps exiting
+    """
+    logs.setup_logging(config)
+    context = multiprocessing.get_context('spawn')
+    ranges = shard_ranges(config.DISCORD_SHARD_COUNT, config.WORKER_PROCESSES)
+    processes = {}
+    started = {}
+    failures = dict.fromkeys(range(len(ranges)), 0)
+    # Worker ID to the time it is restarted at
+    restarts = {}
+
+    async def prepare():
+        # Migrate once here rather than racing in every worker
+        await migrations.upgrade()
+        await engine.dispose()
+
+    asyncio.run(prepare())
+
+    def start(worker_id):
+        process = context.Process(target=run_worker, args=(worker_id, ranges[worker_id]),
+                                  name=f'dsbridge-worker-{worker_id}')
+        process.start()
+        processes[worker_id] = process
+        started[worker_id] = time.monotonic()
+        logging.info('Started worker %s (pid %s) with shards %s', worker_id, process.pid, ranges[worker_id],
+                     extra={'worker_id': worker_id, 'pid': process.pid})
+
+    for worker_id in range(len(ranges)):
+        start(worker_id)
+    if hasattr(signal, 'SIGHUP'):
+        # Pass banned word reloads on to the workers
+        signal.signal(signal.SIGHUP, lambda signum, frame: [os.kill(process.pid, signum)
+                                                            for process in processes.values() if process.is_alive()])
+    try:
+        while True:
+            timeout = max(min(restarts.values()) - time.monotonic(), 0) if restarts else None
+            wait([process.sentinel for worker_id, process in processes.items() if worker_id not in restarts], timeout)
+            now = time.monotonic()
+            for worker_id, process in list(processes.items()):
+                if worker_id in restarts:
+                    if now >= restarts[worker_id]:
+                        del restarts[worker_id]
+                        start(worker_id)
+                    continue
+                if process.is_alive():
+                    continue
+
+                # A worker that ran for a while starts over from the base delay
+                if now - started[worker_id] >= config.WORKER_RESTART_MAX:
+                    failures[worker_id] = 0
+                failures[worker_id] += 1
+                if config.WORKER_MAX_RESTARTS and failures[worker_id] > config.WORKER_MAX_RESTARTS:
+                    raise RuntimeError(f'Worker {worker_id} exited {failures[worker_id]} times in a row, giving up')
+                delay = restart_delay(failures[worker_id], config.WORKER_RESTART_BASE, config.WORKER_RESTART_MAX)
+                logging.error('Worker %s exited with code %s, restarting in %.1fs', worker_id, process.exitcode, delay,
+                              extra={'worker_id': worker_id, 'exitcode': process.exitcode, 'delay': delay})
+                restarts[worker_id] = now + delay
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+
+def register_metrics(servers, discord_bot, dispatcher):
+    """
+    Enable metrics and register the gauges read at scrape time
+    Args:
+        servers: Server bots, whose queues and caches are summed
+        discord_bot: Discord bot
+        dispatcher: Shared dispatcher
+    """
+    metrics.registry.enabled = True
+    metrics.instrument_engine(engine)
+
+    metrics.QUEUE_DEPTH.set_function(lambda: dispatcher.pending, 'dispatcher')
+    metrics.QUEUE_DEPTH.set_function(lambda: discord_bot.sender.stats()['queue_depth'], 'discord_sender')
+    batchers = [server.batcher for server in servers if server.batcher is not None]
+    if batchers:
+        metrics.QUEUE_DEPTH.set_function(lambda: sum(batcher.pending for batcher in batchers), 'write_behind')
+    caches = [('channel_ids', [server.channel_ids for server in servers]),
+              ('message_ids', [server.message_ids for server in servers]),
+              ('message_channels', [server.message_channels for server in servers]),
+              ('discord_messages', [discord_bot.messages])]
+    if discord_bot.sanitizer_executor.verdicts is not None:
+        caches.append(('sanitizer_verdicts', [discord_bot.sanitizer_executor.verdicts]))
+    for name, group in caches:
+        metrics.CACHE_REQUESTS.set_function(lambda group=group: sum(cache.hits for cache in group), name, 'hit')
+        metrics.CACHE_REQUESTS.set_function(lambda group=group: sum(cache.misses for cache in group), name, 'miss')
@@ -0,0 +1,96 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime
+from datetime import timezone
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+
+# Attributes every LogRecord has; anything else on a record came from extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName', 'sampled'}
+
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object, including the fields passed through extra=
+    """
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a share of the records logged with extra={'sampled': True}, such as the
+    per-message info logs. Warnings and errors are always kept.
+    """
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno > logging.INFO or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread as they are. The stock QueueHandler formats the
+    message before queueing it, which would put the formatting back on the event loop.
+    """
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(config):
+    """
+    Send all logging through a queue to a listener thread that formats and writes it.
+    Calling it again does nothing.
+    Args:
+        config: Config
+    Returns:
+        The QueueListener
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(sys.stdout)
+    if config.LOG_FORMAT == 'json':
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    handler = LogQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(config.LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(config.LOG_LEVEL)
+    logging.getLogger('discord').setLevel(config.LOG_LEVEL)
+    # SQL statements are only logged when asked for
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO if config.DB_ECHO else logging.WARNING)
+
+    _listener = QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
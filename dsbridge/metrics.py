@@ -0,0 +1,200 @@
+import logging
+import time
+from contextlib import nullcontext
+
+from aiohttp import web
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_NULL_TIMER = nullcontext()
+
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus-style metrics registry.
+    Metrics are no-ops until enabled, so instrumented code pays one attribute check.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.metrics = []
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        registry.metrics.append(self)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        if registry.enabled:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        for labelvalues, value in self.values.items():
+            yield f'{self.name}{_labels(self.labelnames, labelvalues)} {value}'
+
+
+class Gauge(Metric):
+    """
+    Gauge read from callbacks at scrape time, so it costs nothing between scrapes
+    """
+    kind = 'gauge'
+
+    def set_function(self, func, *labelvalues):
+        self.values[labelvalues] = func
+
+    def samples(self):
+        for labelvalues, func in list(self.values.items()):
+            try:
+                value = func()
+            except Exception as e:
+                logging.error('Error reading %s %s: %s', self.kind, self.name, e, extra={'metric': self.name})
+                continue
+            yield f'{self.name}{_labels(self.labelnames, labelvalues)} {value}'
+
+
+class FunctionCounter(Gauge):
+    """
+    Counter read from callbacks at scrape time, for totals something else already keeps
+    """
+    kind = 'counter'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, *labelvalues):
+        if not registry.enabled:
+            return
+        counts = self.values.get(labelvalues)
+        if counts is None:
+            # Per-bucket counts, then count and sum
+            counts = self.values[labelvalues] = [0] * len(self.buckets) + [0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-2] += 1
+        counts[-1] += value
+
+    def time(self, *labelvalues):
+        """
+        Context manager observing the duration of its block
+        """
+        if not registry.enabled:
+            return _NULL_TIMER
+        return _Timer(self, labelvalues)
+
+    def samples(self):
+        for labelvalues, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labelnames, labelvalues, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_bucket{_labels(self.labelnames, labelvalues, [("le", "+Inf")])} {counts[-2]}'
+            yield f'{self.name}_count{_labels(self.labelnames, labelvalues)} {counts[-2]}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labelvalues)} {counts[-1]}'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labelvalues', 'start')
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+
+EVENTS = Counter('dsbridge_events_total', 'Bridge events received', ('source', 'event'))
+JOB_SECONDS = Histogram('dsbridge_job_seconds', 'Duration of dispatched jobs', ('job',))
+JOB_ERRORS = Counter('dsbridge_job_errors_total', 'Dispatched jobs that raised', ('job',))
+HANDLER_SECONDS = Histogram('dsbridge_handler_seconds', 'Duration of Server handlers', ('handler',))
+HANDLER_RETRIES = Counter('dsbridge_handler_retries_total', 'Database retries of Server handlers', ('handler',))
+DB_QUERY_SECONDS = Histogram('dsbridge_db_query_seconds', 'Duration of database statements')
+DISCORD_API_SECONDS = Histogram('dsbridge_discord_api_seconds', 'Duration of Discord API calls', ('operation',))
+SOCKETIO_EMIT_SECONDS = Histogram('dsbridge_socketio_emit_seconds', 'Duration of socket.io emits', ('event',))
+SANITIZER_SECONDS = Histogram('dsbridge_sanitizer_seconds', 'Duration of message sanitization')
+QUEUE_DEPTH = Gauge('dsbridge_queue_depth', 'Items waiting in bridge queues', ('queue',))
+RETENTION_ROWS = Counter('dsbridge_retention_rows_total', 'Hidden message rows removed by retention', ('action',))
+SUPPRESSED_MESSAGES = Counter('dsbridge_suppressed_messages_total', 'Repeated Discord messages suppressed',
+                              ('action',))
+ATTACHMENTS = Counter('dsbridge_attachments_total', 'Attachments relayed by result', ('source', 'result'))
+CACHE_REQUESTS = FunctionCounter('dsbridge_cache_requests_total', 'Cache lookups by result', ('cache', 'result'))
+
+
+def instrument_engine(engine):
+    """
+    Time every statement executed by a SQLAlchemy engine
+    Args:
+        engine: Engine or AsyncEngine
+    """
+    sync_engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._dsbridge_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY_SECONDS.observe(time.perf_counter() - context._dsbridge_started)
+
+
+async def start_metrics_server(host, port):
+    """
+    Serve the metrics on /metrics
+    Args:
+        host: Interface to listen on
+        port: Port to listen on
+    Returns:
+        aiohttp AppRunner, to be cleaned up on shutdown
+    """
+    async def handle_metrics(request):
+        return web.Response(body=registry.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info('Serving metrics on http://%s:%s/metrics', host, port, extra={'host': host, 'port': port})
+    return runner
@@ -0,0 +1,165 @@
+"""
+Schema migrations.
+
+The schema_version table records the last migration applied. A new database gets the
+current schema from the models and is stamped with the latest version; a database
+created before migrations existed starts at version 0 and runs every migration. Each
+migration must be safe to run against a database that already has some of its changes.
+
+Run with: python -m dsbridge.migrations
+"""
+import asyncio
+import logging
+
+from sqlalchemy import Column
+from sqlalchemy import inspect
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import select
+from sqlalchemy import Table
+from sqlalchemy import text
+
+from dsbridge.database import Base
+from dsbridge.database import engine as default_engine
+from dsbridge.models import Attachment
+from dsbridge.models import ChatChannels
+from dsbridge.models import Message
+from dsbridge.models import OutboxEvent
+
+# Kept out of Base.metadata so create_all never touches it
+schema_version = Table('schema_version', MetaData(), Column('version', Integer, nullable=False))
+
+
+def create_missing_tables(conn):
+    Base.metadata.create_all(conn)
+
+
+def dedupe_channels(conn):
+    # Point messages and sync state at the oldest of the duplicate channels, then drop the rest
+    duplicates = '''
+        SELECT c.id FROM chat_channels c
+        WHERE c.discord_channel_id IS NOT NULL
+          AND c.id > (SELECT MIN(d.id) FROM chat_channels d WHERE d.discord_channel_id = c.discord_channel_id)
+    '''
+    conn.execute(text(f'''
+        UPDATE chat_messages SET channel_id = (
+            SELECT MIN(d.id) FROM chat_channels c JOIN chat_channels d ON d.discord_channel_id = c.discord_channel_id
+            WHERE c.id = chat_messages.channel_id
+        )
+        WHERE channel_id IN ({duplicates})
+    '''))
+    conn.execute(text(f'DELETE FROM chat_channel_sync WHERE channel_id IN ({duplicates})'))
+    conn.execute(text(f'DELETE FROM chat_channels WHERE id IN ({duplicates})'))
+
+    # Replace the plain index with the unique one from the model
+    index = next(i for i in ChatChannels.__table__.indexes if i.name == 'ix_chat_channels_discord_channel_id')
+    conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+    index.create(conn)
+
+
+def add_message_index(conn, name):
+    index = next(i for i in Message.__table__.indexes if i.name == name)
+    index.create(conn, checkfirst=True)
+
+
+def add_visible_message_index(conn):
+    add_message_index(conn, 'ix_discord_message_id_visible')
+
+
+def add_column(conn, column):
+    if column.name in {existing['name'] for existing in inspect(conn).get_columns(column.table.name)}:
+        return
+    conn.execute(text(f'ALTER TABLE {column.table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}'))
+
+
+def add_edit_history(conn):
+    add_column(conn, Message.__table__.c.edit_history)
+
+
+def create_attachments_table(conn):
+    Attachment.__table__.create(conn, checkfirst=True)
+
+
+def add_namespaces(conn):
+    add_column(conn, ChatChannels.__table__.c.namespace)
+    add_column(conn, OutboxEvent.__table__.c.namespace)
+
+
+def add_hidden_message_index(conn):
+    add_message_index(conn, 'ix_id_hidden')
+
+
+# (version, description, function run with a sync connection), in order
+MIGRATIONS = [
+    (1, 'Create outbox and channel sync tables', create_missing_tables),
+    (2, 'Make chat_channels.discord_channel_id unique', dedupe_channels),
+    (3, 'Index visible messages by discord_message_id', add_visible_message_index),
+    (4, 'Add chat_messages.edit_history', add_edit_history),
+    (5, 'Create chat_attachments table', create_attachments_table),
+    (6, 'Add chat_channels.namespace and chat_outbox.namespace', add_namespaces),
+    (7, 'Index hidden messages by id', add_hidden_message_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """
+    Get the schema version of the database
+    Args:
+        conn: Sync connection
+    Returns:
+        Version, 0 for a database from before migrations, or None for an empty database
+    """
+    tables = inspect(conn).get_table_names()
+    if schema_version.name in tables:
+        return conn.scalar(select(schema_version.c.version))
+    return 0 if Message.__tablename__ in tables else None
+
+
+def set_version(conn, version: int):
+    conn.execute(schema_version.delete())
+    conn.execute(schema_version.insert().values(version=version))
+
+
+def run_migrations(conn):
+    """
+    Bring the schema up to date
+    Args:
+        conn: Sync connection
+    Returns:
+        Number of migrations applied
+    """
+    version = get_version(conn)
+    schema_version.create(conn, checkfirst=True)
+    if version is None:
+        Base.metadata.create_all(conn)
+        set_version(conn, LATEST_VERSION)
+        logging.info('Created database schema at version %s', LATEST_VERSION, extra={'version': LATEST_VERSION})
+        return 0
+
+    applied = 0
+    for migration_version, description, migrate in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        logging.info('Applying migration %s: %s', migration_version, description, extra={'version': migration_version})
+        migrate(conn)
+        set_version(conn, migration_version)
+        applied += 1
+    return applied
+
+
+async def upgrade(engine=None):
+    """
+    Apply pending migrations in one transaction
+    Args:
+        engine: Async engine, defaults to the application engine
+    Returns:
+        Number of migrations applied
+    """
+    async with (engine or default_engine).begin() as conn:
+        return await conn.run_sync(run_migrations)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(upgrade())
@@ -8,6 +8,7 @@ from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
 from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import JSON
 from sqlalchemy import String
 from sqlalchemy.orm import relationship
 
@@ -18,9 +19,11 @@ class ChatChannels(Base):
     __tablename__ = 'chat_channels'
 
     id = Column(Integer, primary_key=True)
-    discord_channel_id = Column(BigInteger, index=True)
+    discord_channel_id = Column(BigInteger, index=True, unique=True)
     public = Column(Boolean, nullable=False, default=False)
     closed = Column(Boolean, nullable=False, default=False)
+    # Server namespace the channel is bridged to, or None for the default one
+    namespace = Column(String)
     created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
     last_updated = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
 
@@ -42,28 +45,38 @@ class Message(Base):
     hidden = Column(Boolean, nullable=False, default=False)
     created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
     last_updated = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    # Earlier versions of an edited message, oldest first, once retention has removed their rows
+    edit_history = Column(JSON)
 
     user = relationship('User', uselist=False, primaryjoin='Message.user_id==User.id')
 
     channel = relationship('ChatChannels', uselist=False, back_populates='messages',
                            primaryjoin='Message.channel_id==ChatChannels.id')
 
+    attachments = relationship('Attachment', uselist=True, order_by='Attachment.id',
+                               primaryjoin='Message.id==Attachment.message_id', cascade='all, delete-orphan')
+
     __table_args__ = (
         Index('ix_channel_id_hidden', 'channel_id', 'hidden'),
+        # Edit and delete lookups only ever look for the visible message
+        Index('ix_discord_message_id_visible', 'discord_message_id',
+              postgresql_where=hidden.is_(False), sqlite_where=hidden.is_(False)),
+        # Retention walks the hidden rows in ID order
+        Index('ix_id_hidden', 'id', postgresql_where=hidden.is_(True), sqlite_where=hidden.is_(True)),
     )
 
-    def __init__(self, data, channel):
+    def __init__(self, data, channel_id: int):
         super().__init__()
         if isinstance(data, DiscordMessage):
-            self.from_discord(data, channel)
+            self.from_discord(data, channel_id)
         else:
             raise ValueError('Unexpected initialization type')
 
-    def from_discord(self, data: DiscordMessage, channel):
+    def from_discord(self, data: DiscordMessage, channel_id: int):
         self.discord_message_id = data.id
         self.discord_user_id = data.author.id
         self.text = data.content
-        self.channel_id = channel.id
+        self.channel_id = channel_id
         self.user_id = None
 
     def to_dict(self):
@@ -73,6 +86,46 @@ class Message(Base):
         return f'<Message {self.id}>'
 
 
+class Attachment(Base):
+    __tablename__ = 'chat_attachments'
+
+    id = Column(Integer, primary_key=True)
+    message_id = Column(Integer, ForeignKey('chat_messages.id'), nullable=False, index=True)
+    # SHA-256 of the content, which is also its key in the attachment store
+    sha256 = Column(String(64), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    content_type = Column(String)
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Attachment {self.id}>'
+
+
+class ChannelSyncState(Base):
+    __tablename__ = 'chat_channel_sync'
+
+    channel_id = Column(Integer, ForeignKey('chat_channels.id'), primary_key=True)
+    discord_message_id = Column(BigInteger)
+    last_updated = Column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return f'<ChannelSyncState {self.channel_id}>'
+
+
+class OutboxEvent(Base):
+    __tablename__ = 'chat_outbox'
+
+    id = Column(Integer, primary_key=True)
+    payload = Column(JSON, nullable=False)
+    # Server namespace the event is for, or None for the default one
+    namespace = Column(String)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.id}>'
+
+
 class User(Base):
     __tablename__ = 'users'
 
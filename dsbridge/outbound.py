@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discord
+
+import dsbridge.utils as utils
+from dsbridge.cache import LRUCache
+from dsbridge.metrics import DISCORD_API_SECONDS
+
+# Discord limits for a single message
+MAX_EMBEDS = 10
+MAX_CONTENT_LENGTH = 2000
+# Titles and descriptions of all the embeds of a message together
+MAX_EMBEDS_LENGTH = 6000
+
+
+class TokenBucket:
+    """
+    Token bucket allowing rate calls per period, with reservations so concurrent
+    callers queue up instead of all waking at the same time
+    """
+    def __init__(self, rate, period, clock=time.monotonic):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.clock = clock
+        self.updated = clock()
+
+    def reserve(self):
+        """
+        Take a token
+        Returns:
+            Seconds to wait before the token may be used
+        """
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.fill_rate
+
+
+class OutboundSender:
+    """
+    Sends server messages to Discord channels.
+    Each channel has its own queue and rate limit bucket, so a busy channel waits on its own
+    budget rather than on discord.py's 429 handling. Messages can be posted through a channel
+    webhook to show the author's name. With a coalesce_window, sends that are already queued
+    together for the same channel, such as a batch of new messages, are merged into one Discord
+    message after waiting up to coalesce_window seconds for the rest of the burst; a lone send
+    goes out at once. Messages with attachments are always sent on their own, uploaded from
+    the attachment store.
+    """
+    def __init__(self, bot, config, attachments=None):
+        self.bot = bot
+        self.attachments = attachments
+        self.use_webhooks = config.DISCORD_USE_WEBHOOKS
+        self.webhook_name = config.DISCORD_WEBHOOK_NAME
+        self.coalesce_window = config.DISCORD_COALESCE_WINDOW
+        self.rate = config.DISCORD_CHANNEL_RATE
+        self.period = config.DISCORD_CHANNEL_RATE_PERIOD
+        self.buckets = {}
+        self.webhooks = {}
+        self.webhook_ids = set()
+        self.sent = 0
+        self.latencies = deque(maxlen=1000)
+        # Recently sent messages, so edits and deletes can use them directly
+        self.sent_messages = None
+        if config.DISCORD_MESSAGE_CACHE_SIZE:
+            self.sent_messages = LRUCache(config.DISCORD_MESSAGE_CACHE_SIZE)
+        self._queues = {}
+        self._tasks = set()
+
+    async def send(self, channel, author: str, text: str, attachments=()):
+        """
+        Post a message to a Discord channel
+        Args:
+            channel: Discord channel
+            author: Display name of the author
+            text: Message text
+            attachments: Stored attachments to upload with it, ignored without an AttachmentRelay
+        Returns:
+            The Discord message, shared with any messages coalesced into it
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = self._queues[channel.id] = deque()
+            task = asyncio.create_task(self._drain(channel, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append((author, text, future, time.perf_counter(), attachments if self.attachments else ()))
+        return await future
+
+    async def edit(self, channel, discord_message_id: int, entries: list[tuple[str, str]]):
+        """
+        Replace the content of a Discord message
+        Args:
+            channel: Discord channel
+            discord_message_id: Discord message ID
+            entries: (author, text) pairs the message should show
+        Returns:
+            The edited Discord message
+        """
+        await self._wait_for_bucket(channel.id)
+        kwargs = self.render(entries, edit=True)
+        cached = self.sent_messages.get(discord_message_id) if self.sent_messages is not None else None
+
+        edited_message = None
+        if isinstance(cached, discord.WebhookMessage):
+            with DISCORD_API_SECONDS.time('edit'):
+                edited_message = await cached.edit(**kwargs)
+        elif self.use_webhooks and cached is None:
+            webhook = await self.get_webhook(channel)
+            try:
+                with DISCORD_API_SECONDS.time('edit'):
+                    edited_message = await webhook.edit_message(discord_message_id, **kwargs)
+            except discord.HTTPException as e:
+                # Messages posted before webhooks were enabled belong to the bot
+                logging.info('Webhook edit failed for %s, editing as bot: %s', discord_message_id, e,
+                             extra={'discord_message_id': discord_message_id})
+
+        if edited_message is None:
+            # Edit by ID without fetching the message first
+            with DISCORD_API_SECONDS.time('edit'):
+                edited_message = await channel.get_partial_message(discord_message_id).edit(**kwargs)
+        self._remember(edited_message)
+        return edited_message
+
+    async def delete(self, channel, discord_message_id: int):
+        """
+        Delete a Discord message
+        Args:
+            channel: Discord channel
+            discord_message_id: Discord message ID
+        """
+        await self._wait_for_bucket(channel.id)
+        cached = self.sent_messages.pop(discord_message_id) if self.sent_messages is not None else None
+        try:
+            with DISCORD_API_SECONDS.time('delete'):
+                if isinstance(cached, discord.WebhookMessage):
+                    await cached.delete()
+                else:
+                    await channel.get_partial_message(discord_message_id).delete()
+        except discord.NotFound:
+            # Already deleted, e.g. by an earlier attempt whose commit failed
+            logging.info('Discord message %s was already deleted', discord_message_id,
+                         extra={'discord_message_id': discord_message_id})
+
+    async def get_webhook(self, channel):
+        """
+        Get the bridge webhook of a channel, creating it if needed
+        Args:
+            channel: Discord channel
+        Returns:
+            Webhook
+        """
+        webhook = self.webhooks.get(channel.id)
+        if webhook is None:
+            for existing in await channel.webhooks():
+                if existing.name == self.webhook_name and existing.user == self.bot.user:
+                    webhook = existing
+                    break
+            else:
+                webhook = await channel.create_webhook(name=self.webhook_name)
+            self.webhooks[channel.id] = webhook
+            self.webhook_ids.add(webhook.id)
+        return webhook
+
+    def render(self, entries: list[tuple[str, str]], edit=False):
+        """
+        Build the message arguments showing the given entries
+        Args:
+            entries: (author, text) pairs
+            edit: Whether the arguments are for an edit, which cannot change the author
+        Returns:
+            Keyword arguments for send or edit
+        """
+        if self.use_webhooks:
+            content = '\n'.join(text for _, text in entries)
+            if len(content) <= MAX_CONTENT_LENGTH:
+                kwargs = {'content': content}
+            else:
+                # Too long for message content, but not for an embed description
+                kwargs = {'embeds': [utils.create_embed(author, text) for author, text in entries]}
+            if edit:
+                # Clear whichever of content or embeds the previous version used
+                kwargs.setdefault('content', None)
+                kwargs.setdefault('embeds', [])
+            else:
+                kwargs['username'] = entries[0][0]
+            return kwargs
+        return {'embeds': [utils.create_embed(author, text) for author, text in entries]}
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            'queue_depth': sum(len(queue) for queue in self._queues.values()),
+            'sent': self.sent,
+            'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+            'latency_p99': latencies[int(len(latencies) * 0.99)] if latencies else None,
+        }
+
+    async def _drain(self, channel, queue):
+        try:
+            while queue:
+                # Only wait for more when a burst is under way, never for a lone message
+                if self.coalesce_window and len(queue) > 1:
+                    await asyncio.sleep(self.coalesce_window)
+                batch = self._take_batch(queue)
+                await self._wait_for_bucket(channel.id)
+                try:
+                    discord_message = await self._post(channel, [(author, text) for author, text, *_ in batch],
+                                                       batch[0][4])
+                except Exception as e:
+                    for _, _, future, *_ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                self.sent += 1
+                self._remember(discord_message)
+                now = time.perf_counter()
+                for _, _, future, queued_at, _ in batch:
+                    self.latencies.append(now - queued_at)
+                    if not future.done():
+                        future.set_result(discord_message)
+        finally:
+            del self._queues[channel.id]
+
+    def _take_batch(self, queue):
+        batch = [queue.popleft()]
+        if not self.coalesce_window or batch[0][4]:
+            return batch
+
+        author, text = batch[0][:2]
+        length = len(text) if self.use_webhooks else len(author) + len(text)
+        while queue and len(batch) < MAX_EMBEDS and not queue[0][4]:
+            author, text = queue[0][:2]
+            if self.use_webhooks:
+                # A webhook message has a single author and a plain text body
+                length += len(text) + 1
+                if author != batch[0][0] or length > MAX_CONTENT_LENGTH:
+                    break
+            else:
+                # Each message is an embed titled with its author
+                length += len(author) + len(text)
+                if length > MAX_EMBEDS_LENGTH:
+                    break
+            batch.append(queue.popleft())
+        return batch
+
+    def _remember(self, discord_message):
+        if self.sent_messages is not None:
+            self.sent_messages.put(discord_message.id, discord_message)
+
+    async def _post(self, channel, entries, attachments=()):
+        if attachments:
+            async with self.attachments.transfers:
+                files = self.attachments.discord_files(attachments)
+                return await self._send(channel, self.render(entries) | {'files': files})
+        return await self._send(channel, self.render(entries))
+
+    async def _send(self, channel, kwargs):
+        if self.use_webhooks:
+            webhook = await self.get_webhook(channel)
+            with DISCORD_API_SECONDS.time('send'):
+                return await webhook.send(wait=True, **kwargs)
+        with DISCORD_API_SECONDS.time('send'):
+            return await channel.send(**kwargs)
+
+    async def _wait_for_bucket(self, channel_id):
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.buckets[channel_id] = TokenBucket(self.rate, self.period)
+        delay = bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
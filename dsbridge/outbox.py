@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import random
+
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import select
+
+from dsbridge.models import OutboxEvent
+
+
+class OutboxRelay:
+    """
+    Sends events stored in the outbox table to the server.
+    Handlers write the outbox row in the same transaction as their message change, so an
+    event is never lost when the server is unreachable: the relay retries with exponential
+    backoff and replays everything left over when the connection comes back. Delivery is
+    at least once; a crash between an emit and its delete sends that event again.
+    Every worker process runs a relay over the shared table. On PostgreSQL they take turns
+    through an advisory lock, so events are sent in the order they were written.
+    """
+    BASE_BACKOFF = 0.5
+    # PostgreSQL advisory lock held while a batch is sent and deleted
+    LOCK_KEY = 0x6473_6272
+
+    def __init__(self, server, batch_size, max_backoff):
+        self.server = server
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self._wake = asyncio.Event()
+
+    def notify(self):
+        """
+        Wake the relay after new events were committed or the connection came back
+        """
+        self._wake.set()
+
+    async def drain(self):
+        """
+        Send stored events in order until the outbox is empty
+        Returns:
+            Number of events sent
+        """
+        sent = 0
+        while self.server.socketio.connected:
+            async with self.server.session_factory() as session:
+                if session.bind.dialect.name == 'postgresql':
+                    # Wait for the batch another worker is sending, so later events never overtake it
+                    await session.execute(select(func.pg_advisory_xact_lock(self.LOCK_KEY)))
+                events = (await session.scalars(
+                    select(OutboxEvent).where(self.server.route_filter(OutboxEvent.namespace))
+                    .order_by(OutboxEvent.id).limit(self.batch_size))).all()
+                if not events:
+                    break
+
+                delivered = []
+                try:
+                    for event in events:
+                        await self.server.emit(event.payload)
+                        delivered.append(event.id)
+                finally:
+                    if delivered:
+                        await session.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(delivered)))
+                        await session.commit()
+                        sent += len(delivered)
+                        self.sent += len(delivered)
+        return sent
+
+    async def run(self):
+        """
+        Drain the outbox whenever woken, backing off while sends fail
+        """
+        logging.info('Starting outbox relay')
+        backoff = self.BASE_BACKOFF
+        # Replay whatever was left from a previous run
+        self._wake.set()
+        while True:
+            try:
+                # Poll occasionally too, in case another process wrote to the outbox
+                await asyncio.wait_for(self._wake.wait(), timeout=self.max_backoff)
+            except TimeoutError:
+                pass
+            self._wake.clear()
+
+            try:
+                await self.drain()
+                backoff = self.BASE_BACKOFF
+            except Exception as e:
+                logging.error('Error sending outbox events, retrying in %.1fs: %s', backoff, e,
+                              extra={'delay': backoff})
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+                backoff = min(backoff * 2, self.max_backoff)
+                self._wake.set()
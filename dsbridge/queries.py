@@ -0,0 +1,61 @@
+"""
+Statements Server runs for most events, built once at import.
+
+SQLAlchemy caches the compiled SQL of each statement and asyncpg keeps it prepared per
+connection, so building them up front leaves only parameter binding per event.
+"""
+from sqlalchemy import bindparam
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import joinedload
+
+from dsbridge.models import ChatChannels
+from dsbridge.models import Message
+
+SELECT_CHANNEL_ID = select(ChatChannels.id).where(
+    ChatChannels.discord_channel_id == bindparam('discord_channel_id'))
+
+# Returns no row when another handler or worker created the channel first
+INSERT_CHANNEL = {
+    dialect.dialect.name: dialect.insert(ChatChannels)
+    .values(discord_channel_id=bindparam('new_discord_channel_id'))
+    .on_conflict_do_nothing(index_elements=[ChatChannels.discord_channel_id])
+    .returning(ChatChannels.id)
+    for dialect in (postgresql, sqlite)
+}
+
+# Results need .unique(), as the joined attachments repeat the message rows
+LOAD_MESSAGES = select(Message).options(
+    joinedload(Message.channel), joinedload(Message.user), joinedload(Message.attachments)).where(
+    Message.id.in_(bindparam('message_ids', expanding=True)))
+
+# Channels of server messages, to order their events before they are loaded
+SELECT_MESSAGE_CHANNELS = select(Message.id, Message.channel_id).where(
+    Message.id.in_(bindparam('message_ids', expanding=True)))
+
+# Discord channels of server messages, to check which worker handles them before loading them
+SELECT_MESSAGE_DISCORD_CHANNELS = select(Message.id, ChatChannels.discord_channel_id).join(
+    Message.channel).where(Message.id.in_(bindparam('message_ids', expanding=True)))
+
+# A literal hidden predicate lets the planner use the partial index on visible messages
+_HIDE_MESSAGE = update(Message).values(hidden=True, last_updated=bindparam('now')).returning(
+    Message.id, Message.user_id, Message.created_at).execution_options(synchronize_session=False)
+HIDE_MESSAGE_BY_ID = _HIDE_MESSAGE.where(
+    Message.id == bindparam('message_id'), Message.hidden.is_(False))
+HIDE_MESSAGE_BY_DISCORD_ID = _HIDE_MESSAGE.where(
+    Message.discord_message_id == bindparam('lookup_discord_message_id'), Message.hidden.is_(False))
+# Messages posted on Discord have no server user
+HIDE_DISCORD_MESSAGE_BY_ID = HIDE_MESSAGE_BY_ID.where(Message.user_id.is_(None))
+HIDE_DISCORD_MESSAGE_BY_DISCORD_ID = HIDE_MESSAGE_BY_DISCORD_ID.where(Message.user_id.is_(None))
+
+SELECT_COALESCED_MESSAGES = select(Message).options(joinedload(Message.user)).where(
+    Message.discord_message_id == bindparam('lookup_discord_message_id'),
+    Message.hidden.is_(False),
+    Message.id != bindparam('message_id'),
+).order_by(Message.id)
+
+# Run with a list of parameters to save the Discord message IDs of a batch in one executemany
+SET_DISCORD_MESSAGE_ID = update(Message.__table__).where(Message.__table__.c.id == bindparam('message_id')).values(
+    discord_message_id=bindparam('new_discord_message_id'), last_updated=bindparam('now'))
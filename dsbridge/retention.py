@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+import pytz
+from sqlalchemy import delete
+from sqlalchemy import select
+
+from dsbridge import metrics
+from dsbridge.models import Attachment
+from dsbridge.models import Message
+
+
+class MessageRetention:
+    """
+    Removes the hidden rows that edits and deletes leave in chat_messages.
+    An edit hides the old row and inserts a new one, and a delete only hides the row, so
+    without this the table and its indexes keep every version of every message. Hidden rows
+    older than max_age are removed in batches of batch_size, one transaction each. When a
+    hidden row is an earlier version of a message that is still visible, its text is first
+    appended to that message's edit_history, so the edit chain collapses into one row.
+    Versions are linked through their Discord message ID only: an edit chain of a message
+    that was never posted to Discord, such as one in a channel without a Discord channel,
+    has none, so its earlier versions are removed without being added to an edit_history.
+    PostgreSQL reuses the freed space once autovacuum has run, keeping the table size flat.
+    """
+    def __init__(self, server, interval, max_age, batch_size, batch_pause):
+        self.server = server
+        self.interval = interval
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.compacted = 0
+        self.purged = 0
+
+    @classmethod
+    def from_config(cls, server, config):
+        return cls(server, config.RETENTION_INTERVAL, config.RETENTION_MAX_AGE,
+                   config.RETENTION_BATCH_SIZE, config.RETENTION_BATCH_PAUSE)
+
+    async def run(self):
+        """
+        Clean up periodically
+        """
+        logging.info('Starting message retention')
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error('Error in message retention: %s', e, extra={'error': str(e)})
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """
+        Remove every hidden row older than max_age
+        Returns:
+            Tuple of rows folded into an edit history and rows purged
+        """
+        cutoff = datetime.now(pytz.UTC) - timedelta(seconds=self.max_age)
+        compacted = purged = 0
+        while True:
+            batch_compacted, batch_removed = await self.remove_batch(cutoff)
+            compacted += batch_compacted
+            purged += batch_removed - batch_compacted
+            if batch_removed < self.batch_size:
+                break
+            # Leave room for live traffic between batches
+            await asyncio.sleep(self.batch_pause)
+
+        self.compacted += compacted
+        self.purged += purged
+        metrics.RETENTION_ROWS.inc('compacted', amount=compacted)
+        metrics.RETENTION_ROWS.inc('purged', amount=purged)
+        logging.info('Message retention reclaimed %d rows: %d edits compacted, %d purged',
+                     compacted + purged, compacted, purged,
+                     extra={'compacted': compacted, 'purged': purged})
+        return compacted, purged
+
+    async def remove_batch(self, cutoff):
+        """
+        Remove the oldest batch of hidden rows last updated before the cutoff
+        Args:
+            cutoff: Rows hidden after this are kept
+        Returns:
+            Tuple of rows folded into an edit history and rows removed in total
+        """
+        async with self.server.session_factory() as session:
+            rows = (await session.execute(
+                select(Message.id, Message.discord_message_id, Message.user_id, Message.text, Message.last_updated)
+                .where(Message.hidden.is_(True), Message.last_updated < cutoff)
+                .order_by(Message.id).limit(self.batch_size))).all()
+            if not rows:
+                return 0, 0
+
+            # An edited message keeps its Discord message ID and author, so its current
+            # version is the first visible row after it with both
+            discord_message_ids = {row.discord_message_id for row in rows if row.discord_message_id is not None}
+            visible = {}
+            if discord_message_ids:
+                for message in (await session.scalars(select(Message).where(
+                        Message.discord_message_id.in_(discord_message_ids), Message.hidden.is_(False))
+                        .order_by(Message.id))).all():
+                    visible.setdefault(message.discord_message_id, []).append(message)
+
+            compacted = 0
+            for row in rows:
+                current = next((message for message in visible.get(row.discord_message_id, ())
+                                if message.id > row.id and message.user_id == row.user_id), None)
+                if current is None:
+                    continue
+                # Assign a new list so the change to the JSON column is detected
+                current.edit_history = [*(current.edit_history or []), {
+                    'id': row.id, 'text': row.text, 'replaced_at': row.last_updated.isoformat()}]
+                compacted += 1
+
+            removed = [row.id for row in rows]
+            await session.execute(delete(Attachment).where(Attachment.message_id.in_(removed)))
+            await session.execute(delete(Message).where(Message.id.in_(removed)))
+            await session.commit()
+        return compacted, len(rows)
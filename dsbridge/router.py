@@ -0,0 +1,148 @@
+import asyncio
+import logging
+
+from sqlalchemy import select
+
+from dsbridge.models import ChatChannels
+from dsbridge.server import Server
+
+
+class ServerRouter:
+    """
+    Bridges one Discord bot to several server namespaces from the same process.
+    Every server shares the Discord connection, the dispatcher and the database pool; each
+    has its own socket.io namespace, outbox and catch-up sync. Servers on the same host are
+    multiplexed over one socket.io connection. Discord events are routed by the namespace
+    column of the channel in chat_channels: channels without one, including channels seen for
+    the first time, belong to the default server, configured by SERVER_NAMESPACE and HOST_URL.
+    Events for a namespace not served by this process are dropped.
+    """
+    def __init__(self, servers, refresh_interval=300):
+        self.servers = {server.route: server for server in servers}
+        self.default = self.servers[None]
+        self.refresh_interval = refresh_interval
+        # Discord channel ID to namespace, or None for the default server
+        self.routes = {}
+
+    @classmethod
+    def from_config(cls, config, session_factory=None, dispatcher=None, worker_id=0):
+        """
+        Build the default server and one per SERVER_ENDPOINTS entry
+        Args:
+            config: Config
+            session_factory: Database session factory shared by the servers
+            dispatcher: ChannelDispatcher shared by the servers
+            worker_id: Index of this worker process
+        Returns:
+            ServerRouter
+        Raises:
+            ValueError: If an entry is malformed or a namespace is configured twice
+        """
+        default = Server(config, session_factory=session_factory, dispatcher=dispatcher, worker_id=worker_id)
+        servers = [default]
+        connections = {default.endpoint: default}
+        for entry in config.SERVER_ENDPOINTS:
+            namespace, _, endpoint = entry.partition('=')
+            namespace, endpoint = namespace.strip(), endpoint.strip() or config.HOST_URL
+            if not namespace:
+                raise ValueError(f'Invalid SERVER_ENDPOINTS entry: {entry!r}')
+            if namespace in {server.namespace for server in servers}:
+                raise ValueError(f'Server namespace {namespace} is configured more than once')
+
+            primary = connections.get(endpoint)
+            server = Server(config, session_factory=default.session_factory, dispatcher=default.dispatcher,
+                            worker_id=worker_id, namespace=namespace, endpoint=endpoint,
+                            socketio_client=primary.socketio if primary is not None else None)
+            if primary is not None:
+                # Connected along with the primary's namespaces
+                server.namespaces = []
+                primary.namespaces.append(namespace)
+            else:
+                connections[endpoint] = server
+            servers.append(server)
+        return cls(servers, config.SERVER_ROUTE_REFRESH)
+
+    @property
+    def connections(self):
+        """
+        Servers that own a socket.io connection, with the others multiplexed onto it
+        """
+        return [server for server in self.servers.values() if server.namespaces]
+
+    def init_bot(self, discord_bot):
+        for server in self.servers.values():
+            server.init_bot(discord_bot)
+
+    async def load_routes(self):
+        """
+        Load the namespace of every bridged channel
+        """
+        async with self.default.session_factory() as session:
+            rows = (await session.execute(select(ChatChannels.discord_channel_id, ChatChannels.namespace).where(
+                ChatChannels.discord_channel_id.is_not(None)))).all()
+        self.routes = {row.discord_channel_id: row.namespace for row in rows}
+        logging.info('Loaded %d channel routes', len(self.routes), extra={'routes': len(self.routes)})
+
+    async def server_for(self, discord_channel_id: int):
+        """
+        Find the server a Discord channel is bridged to
+        Args:
+            discord_channel_id: Discord channel ID
+        Returns:
+            Server, or None if the channel belongs to a namespace not served here
+        """
+        if discord_channel_id in self.routes:
+            namespace = self.routes[discord_channel_id]
+        else:
+            # Channels added since the last refresh
+            async with self.default.session_factory() as session:
+                namespace = await session.scalar(select(ChatChannels.namespace).where(
+                    ChatChannels.discord_channel_id == discord_channel_id))
+            self.routes[discord_channel_id] = namespace
+
+        server = self.servers.get(namespace)
+        if server is None:
+            logging.warning('No server for namespace %s of Discord channel %s', namespace, discord_channel_id,
+                            extra={'namespace': namespace, 'discord_channel_id': discord_channel_id})
+        return server
+
+    async def send_to_server(self, data, attachments=()):
+        server = await self.server_for(data.channel.id)
+        if server is not None:
+            await server.send_to_server(data, attachments)
+
+    async def edit_message_text(self, before_msg, after_msg, attachments=()):
+        server = await self.server_for(after_msg.channel.id)
+        if server is not None:
+            await server.edit_message_text(before_msg, after_msg, attachments)
+
+    async def delete_message(self, message):
+        server = await self.server_for(message.channel.id)
+        if server is not None:
+            await server.delete_message(message)
+
+    def schedule(self):
+        """
+        Start a catch-up run of every server
+        """
+        for server in self.servers.values():
+            if server.catch_up is not None:
+                server.catch_up.schedule()
+
+    async def refresh_routes(self):
+        """
+        Reload the routes periodically, so channels moved to another namespace follow
+        """
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load_routes()
+            except Exception as e:
+                logging.error('Error loading channel routes: %s', e, extra={'error': str(e)})
+
+    async def start(self):
+        """
+        Load the routes and connect every server
+        """
+        await self.load_routes()
+        await asyncio.gather(self.refresh_routes(), *(server.start() for server in self.connections))
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import BrokenExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+from dsbridge.bursts import content_key
+from dsbridge.cache import LRUCache
+
+# Sanitizer of the current worker process, set by _init_worker
+_worker_sanitizer = None
+
+
+def _init_worker(sanitizer):
+    global _worker_sanitizer
+    _worker_sanitizer = sanitizer
+
+
+def _warm_up():
+    # Keep the worker busy so the next warm-up job has to start another one
+    time.sleep(0.1)
+
+
+def _check_batch(texts, sanitizer=None):
+    sanitizer = sanitizer or _worker_sanitizer
+    return [sanitizer.is_clean(text) for text in texts]
+
+
+class SanitizerExecutor:
+    """
+    Runs Sanitizer.is_clean off the event loop.
+    In 'process' mode checks run in a pool of worker processes, each holding its own copy
+    of the sanitizer; 'thread' runs them in a thread pool and 'inline' on the event loop.
+    Texts shorter than inline_threshold are always checked inline, since handing them to
+    a worker costs more than the check. Texts queued during the same event loop iteration
+    are sent to a worker together, up to batch_size per call. Verdicts are cached by content
+    hash, up to cache_size of them, so repeated texts are only checked once.
+    """
+    MODES = ('inline', 'thread', 'process')
+
+    def __init__(self, sanitizer, mode='inline', workers=2, batch_size=64, inline_threshold=1000, cache_size=0):
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown sanitizer mode: {mode}')
+        self.sanitizer = sanitizer
+        self.mode = mode
+        self.workers = workers
+        self.batch_size = batch_size
+        self.inline_threshold = inline_threshold
+        self.batches = 0
+        self.verdicts = LRUCache(cache_size) if cache_size else None
+        self._generation = 0
+        self._executor = None
+        self._pending = []
+        self._tasks = set()
+        self._starting = asyncio.Lock()
+
+    @classmethod
+    def from_config(cls, sanitizer, config):
+        return cls(sanitizer, config.SANITIZER_MODE, config.SANITIZER_WORKERS, config.SANITIZER_BATCH_SIZE,
+                   config.SANITIZER_INLINE_THRESHOLD, config.SANITIZER_CACHE_SIZE)
+
+    async def is_clean(self, text: str):
+        """
+        Check whether the text needs no sanitization
+        Args:
+            text: Text to check
+        Returns:
+            True if the text needs no sanitization
+        """
+        if self.verdicts is None:
+            return await self._check(text)
+
+        key = content_key(text)
+        verdict = self.verdicts.get(key)
+        if verdict is None:
+            generation = self._generation
+            verdict = await self._check(text)
+            # A verdict from before a reload may be out of date
+            if generation == self._generation:
+                self.verdicts.put(key, verdict)
+        return verdict
+
+    def reload(self, sanitizer):
+        """
+        Check texts with a new sanitizer from now on, such as after the banned words changed.
+        Cached verdicts are dropped and worker processes are replaced, since they hold a copy
+        of the old sanitizer. Batches already sent to them finish with it.
+        Args:
+            sanitizer: Sanitizer
+        """
+        self.sanitizer = sanitizer
+        self._generation += 1
+        if self.verdicts is not None:
+            self.verdicts.clear()
+        if self.mode == 'process' and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _check(self, text: str):
+        if self.mode == 'inline' or len(text) < self.inline_threshold:
+            return self.sanitizer.is_clean(text)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif len(self._pending) == 1:
+            # Let other handlers queue their texts before sending the batch
+            asyncio.get_running_loop().call_soon(self._flush)
+        return await future
+
+    def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        self.batches += 1
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            executor = await self.start()
+            if self.mode == 'process':
+                results = await asyncio.get_running_loop().run_in_executor(executor, _check_batch, texts)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(
+                    executor, _check_batch, texts, self.sanitizer)
+        except Exception as e:
+            logging.error('Error in sanitizer %s pool: %s', self.mode, e)
+            if isinstance(e, BrokenExecutor):
+                # A worker died; start a new pool for the next batch
+                self.shutdown()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def start(self):
+        """
+        Start the worker pool if it is not running yet
+        Returns:
+            The executor, or None in inline mode
+        """
+        if self.mode == 'inline':
+            return None
+        async with self._starting:
+            if self._executor is None:
+                # Worker processes are spawned from a thread: sending the sanitizer to a new
+                # worker blocks until it has finished importing, which would stall the loop
+                self._executor = await asyncio.get_running_loop().run_in_executor(None, self._create_executor)
+        return self._executor
+
+    def _create_executor(self):
+        if self.mode == 'thread':
+            return ThreadPoolExecutor(self.workers, thread_name_prefix='sanitizer')
+
+        executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(self.sanitizer,))
+        # Workers are spawned on demand, so submit one job per worker to start them all now
+        for future in [executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def shutdown(self):
+        """
+        Stop the worker pool
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
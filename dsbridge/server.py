@@ -1,63 +1,77 @@
 import asyncio
-import json
+import hashlib
+import hmac
 import logging
-import re
-from datetime import date
+import random
+import time
 from datetime import datetime
-from datetime import timedelta
+from functools import partial
 from functools import wraps
 
-import psycopg2
 import pytz
 import socketio
 from discord.message import Message as DiscordMessage
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from werkzeug.security import generate_password_hash
 
-import dsbridge.utils as utils
-from dsbridge.database import session
+from dsbridge import queries
+from dsbridge.batching import MessageBatcher
+from dsbridge.cache import LRUCache
+from dsbridge.codec import DeleteMessageEvent
+from dsbridge.codec import EditMessageEvent
+from dsbridge.codec import get_codec
+from dsbridge.codec import NewMessageEvent
+from dsbridge.codec import NewMessagesEvent
+from dsbridge.codec import parse_event
+from dsbridge.database import session_factory as default_session_factory
 from dsbridge.discord_bot import DiscordBot
-from dsbridge.models import ChatChannels
+from dsbridge.dispatcher import ChannelDispatcher
+from dsbridge.metrics import EVENTS
+from dsbridge.metrics import HANDLER_RETRIES
+from dsbridge.metrics import HANDLER_SECONDS
+from dsbridge.metrics import SOCKETIO_EMIT_SECONDS
+from dsbridge.models import Attachment
 from dsbridge.models import Message
-
-
-class CustomJSONEncodeDecode:
-    @staticmethod
-    def dumps(obj, **kwargs):
-        return json.dumps(obj, **kwargs, default=CustomJSONEncodeDecode.object_jsonify)
-
-    @staticmethod
-    def loads(s, **kwargs):
-        return json.loads(s, **kwargs, object_hook=CustomJSONEncodeDecode.datetime_parser)
-
-    @staticmethod
-    def object_jsonify(o):
-        if callable(getattr(o, 'to_dict', None)):
-            return o.to_dict()
-        elif isinstance(o, (datetime, date, timedelta)):
-            return o.isoformat()
-
-    @staticmethod
-    def datetime_parser(obj):
-        iso_datetime_pattern = re.compile(
-            r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2})?$'
-        )
-        for k, v in obj.items():
-            if isinstance(v, str) and iso_datetime_pattern.match(v):
-                obj[k] = datetime.fromisoformat(v)
-        return obj
+from dsbridge.models import OutboxEvent
+from dsbridge.outbox import OutboxRelay
 
 
 class Server:
-    def __init__(self, config):
-        self.socketio = socketio.AsyncClient(reconnection=False, logger=False, engineio_logger=False,
-                                             json=CustomJSONEncodeDecode)
-        self.session = session
-        self.namespace = config.SERVER_NAMESPACE
-        self.endpoint = config.HOST_URL
+    def __init__(self, config, session_factory=None, dispatcher=None, worker_id=0, namespace=None, endpoint=None,
+                 socketio_client=None):
+        # Servers on the same endpoint share one client, connected by the first of them
+        self.socketio = socketio_client or socketio.AsyncClient(reconnection=False, logger=False,
+                                                                engineio_logger=False,
+                                                                json=get_codec(config.JSON_CODEC))
+        self.session_factory = session_factory or default_session_factory
+        self.dispatcher = dispatcher or ChannelDispatcher.from_config(config)
+        self.namespace = namespace or config.SERVER_NAMESPACE
+        self.endpoint = endpoint or config.HOST_URL
+        # The chat_channels and chat_outbox rows of this server have this namespace; the
+        # default server, configured by SERVER_NAMESPACE, owns the rows without one
+        self.route = namespace
+        # Namespaces connected by start()
+        self.namespaces = [self.namespace]
         self.key = config.APP_SECRET_KEY
         self.config = config
+        self.worker_id = worker_id
         self.discord_bot = None
+        self.channel_ids = LRUCache(config.IDENTITY_CACHE_SIZE, config.IDENTITY_CACHE_TTL)
+        self.message_ids = LRUCache(config.IDENTITY_CACHE_SIZE, config.IDENTITY_CACHE_TTL)
+        # Server message ID to the Discord message ID it was sent as, until that is committed,
+        # so a handler retried after a failed commit does not post the message again
+        self.unsaved_sends = LRUCache(config.IDENTITY_CACHE_SIZE)
+        # Server message ID to server channel ID, which never changes
+        self.message_channels = LRUCache(config.IDENTITY_CACHE_SIZE)
+        # Set once the last event received has been queued
+        self._queued = None
+        self.outbox = OutboxRelay(self, config.OUTBOX_BATCH_SIZE, config.OUTBOX_MAX_BACKOFF)
+        self.catch_up = None
+        self.batcher = None
+        if config.WRITE_BEHIND_ENABLED:
+            self.batcher = MessageBatcher(self, config.WRITE_BEHIND_BATCH_SIZE,
+                                          config.WRITE_BEHIND_FLUSH_INTERVAL, config.WRITE_BEHIND_MAX_QUEUE)
 
         self.add_routes()
 
@@ -68,7 +82,6 @@ class Server:
             discord_bot: Discord bot
         """
         self.discord_bot = discord_bot
-        print('f')
 
     def add_routes(self):
         """
@@ -76,90 +89,325 @@ class Server:
         """
         @self.socketio.on('chat-message', namespace=self.namespace)
         async def on_message(data):
-            if data['type'] == 'new-message':
-                await self.handle_server_message(data['message_id'])
-            elif data['type'] == 'edit-message':
-                await self.handle_server_message_edited(data['message_id'])
-            elif data['type'] == 'delete-message':
-                await self.handle_server_message_deletion(data['message_id'])
-            else:
-                logging.error(f'Unknown message type: {data["type"]}')
+            try:
+                event = parse_event(data)
+            except ValueError as e:
+                logging.error('Invalid server event: %s', e)
+                return
+
+            EVENTS.inc('server', event.type)
+            await self.dispatch_event(event)
 
         @self.socketio.on('connect', namespace=self.namespace)
         async def on_connect():
-            logging.info('Connected to server')
+            logging.info('Connected to server namespace %s', self.namespace, extra={'namespace': self.namespace})
+            # Replay events stored while disconnected
+            self.outbox.notify()
+            if self.catch_up is not None:
+                self.catch_up.schedule()
 
         @self.socketio.on('disconnect', namespace=self.namespace)
         async def on_disconnect():
-            logging.info('Disconnected from server')
+            logging.info('Disconnected from server namespace %s', self.namespace, extra={'namespace': self.namespace})
+
+    async def dispatch_event(self, event):
+        """
+        Queue the handling of a server event in the dispatcher, in order per server channel.
+        Each event runs in its own task, so the channels of events are looked up concurrently
+        but an event is only queued once the events received before it have been.
+        Args:
+            event: Parsed server event
+        """
+        previous, queued = self._queued, asyncio.get_running_loop().create_future()
+        self._queued = queued
+        try:
+            try:
+                jobs = await self.event_jobs(event)
+            except Exception as e:
+                logging.error('Error looking up the channel of server event %s: %s', event.type, e)
+                jobs = self.event_jobs_by_channel(event, {})
+            if previous is not None:
+                await previous
+            for key, func, *args in jobs:
+                await self.dispatcher.submit(key, func, *args)
+        finally:
+            queued.set_result(None)
+
+    async def event_jobs(self, event):
+        """
+        Look up the channels of a server event
+        Args:
+            event: Parsed server event
+        Returns:
+            List of (key, handler, *args) jobs for the dispatcher
+        """
+        message_ids = event.message_ids if isinstance(event, NewMessagesEvent) else [self.event_message_id(event)]
+        if event.channel_id is not None:
+            channels = dict.fromkeys(message_ids, event.channel_id)
+        else:
+            channels = await self.get_message_channels(message_ids)
+        return self.event_jobs_by_channel(event, channels)
+
+    @staticmethod
+    def event_message_id(event):
+        return event.before_message_id if isinstance(event, EditMessageEvent) else event.message_id
+
+    def event_jobs_by_channel(self, event, channels: dict):
+        """
+        Build the dispatcher jobs of a server event. A batch of new messages is split per
+        channel, so each channel's part runs behind that channel's earlier events only.
+        Args:
+            event: Parsed server event
+            channels: Dict of server message ID to server channel ID. Events of unknown
+                messages are queued under ('server', None) and report them missing
+        Returns:
+            List of (key, handler, *args) jobs
+        """
+        if isinstance(event, NewMessagesEvent):
+            groups = {}
+            for message_id in event.message_ids:
+                groups.setdefault(channels.get(message_id), []).append(message_id)
+            return [(('server', channel_id), self.handle_server_messages, message_ids)
+                    for channel_id, message_ids in groups.items()]
+
+        key = ('server', channels.get(self.event_message_id(event)))
+        if isinstance(event, NewMessageEvent):
+            return [(key, self.handle_server_message, event.message_id)]
+        if isinstance(event, EditMessageEvent):
+            return [(key, self.handle_server_message_edited, event.before_message_id, event.after_message_id)]
+        if isinstance(event, DeleteMessageEvent):
+            return [(key, self.handle_server_message_deletion, event.message_id)]
+        logging.error('Unsupported message type: %s', event.type)
+        return []
+
+    async def get_message_channels(self, message_ids: list[int]):
+        """
+        Resolve server message IDs to their channel IDs, consulting the cache first
+        Args:
+            message_ids: Server message IDs
+        Returns:
+            Dict of message ID to channel ID, without the messages that do not exist
+        """
+        channels = {}
+        missing = []
+        for message_id in message_ids:
+            channel_id = self.message_channels.get(message_id)
+            if channel_id is None:
+                missing.append(message_id)
+            else:
+                channels[message_id] = channel_id
+        if missing:
+            async with self.session_factory() as session:
+                for message_id, channel_id in (await session.execute(
+                        queries.SELECT_MESSAGE_CHANNELS, {'message_ids': missing})).all():
+                    channels[message_id] = channel_id
+                    self.message_channels.put(message_id, channel_id)
+        return channels
+
+    async def emit(self, payload: dict):
+        """
+        Send a chat-message payload to the server
+        Args:
+            payload: Event payload
+        """
+        with SOCKETIO_EMIT_SECONDS.time(payload['type']):
+            await self.socketio.emit('chat-message', payload, self.namespace)
+
+    async def commit_with_event(self, session: AsyncSession, event):
+        """
+        Commit the session together with an outbox row for the event, then wake the outbox relay
+        Args:
+            session: Database session
+            event: Event from dsbridge.codec
+        """
+        session.add(OutboxEvent(payload=event.to_dict(), namespace=self.route))
+        await session.commit()
+        self.outbox.notify()
 
     @staticmethod
     def handle_connection_error(f):
+        """
+        Run the handler in its own database session, retrying on database errors.
+        The session is passed to the handler after self, and every attempt gets a
+        fresh session so a failed transaction is never reused. Discord calls made by an
+        attempt are repeated by the next one, so handlers keep them idempotent.
+        """
         @wraps(f)
         async def wrap(self, *args, **kwargs):
             retries = 0
             error = None
             while retries < 3:
-                try:
-                    await self.socketio.sleep(0)
-                    return await f(self, *args, **kwargs)
-                except (SQLAlchemyError, psycopg2.OperationalError) as e:
-                    error = e
-                    await self.session.rollback()
-                    await self.session.reset()
-                    retries += 1
-                    logging.info('Retrying connection to database')
-                except Exception as e:
-                    error = e
-                    await self.session.rollback()
-                    await self.session.reset()
-                    retries += 1
-                    logging.info('Retrying connection to database')
+                async with self.session_factory() as session:
+                    try:
+                        start = time.perf_counter()
+                        with HANDLER_SECONDS.time(f.__name__):
+                            result = await f(self, session, *args, **kwargs)
+                        duration_ms = (time.perf_counter() - start) * 1e3
+                        logging.info('%s finished in %.1f ms', f.__name__, duration_ms, extra={
+                            'handler': f.__name__, 'duration_ms': duration_ms, 'retries': retries, 'sampled': True})
+                        return result
+                    except (SQLAlchemyError, OSError) as e:
+                        error = e
+                        await session.rollback()
+                        retries += 1
+                        HANDLER_RETRIES.inc(f.__name__)
+                        logging.info('Retrying %s after database error: %s', f.__name__, e,
+                                     extra={'handler': f.__name__, 'retries': retries})
+                    except Exception:
+                        await session.rollback()
+                        raise
+                await asyncio.sleep(0.5 * retries)
 
             raise error
         return wrap
 
     @handle_connection_error
-    async def handle_server_message(self, message_id: int):
+    async def handle_server_message(self, session: AsyncSession, message_id: int):
         """
         Forward the message to discord
         Args:
+            session: Database session
             message_id: Message ID from server
         """
-        message = self.session.query(Message).filter_by(id=message_id).first()
-
-        if message.channel.discord_channel_id is not None:
-            discord_channel = self.discord_bot.bot.get_channel(message.channel.discord_channel_id)
-            discord_message = await discord_channel.send(
-                embed=utils.create_embed(message.user.display_name, message.text))
+        if not await self.owned_messages(session, [message_id]):
+            return
+        message = (await self.load_messages(session, message_id)).get(message_id)
+        if message is None:
+            logging.warning('No server message found for new message event: %s', message_id,
+                            extra={'message_id': message_id})
+            return
+        channel = message.channel
+
+        # The message may already have been sent by catch-up sync or an earlier delivery
+        if channel.discord_channel_id is not None and message.discord_message_id is None:
+            discord_channel = await self.discord_bot.get_channel(channel.discord_channel_id)
 
             # Update discord response on server
-            message.discord_message_id = discord_message.id
+            message.discord_message_id = await self.send_once(discord_channel, message)
             message.last_updated = datetime.now(pytz.UTC)
-            self.session.commit()
 
-            logging.info(f'Server message forwarded to Discord: {message.id}')
+            logging.info('Server message forwarded to Discord: %s', message.id, extra={
+                'message_id': message.id, 'discord_message_id': message.discord_message_id,
+                'discord_channel_id': channel.discord_channel_id, 'sampled': True})
+
+        await self.commit_with_event(session, NewMessageEvent(message_id))
+        self.unsaved_sends.pop(message.id)
+        if message.discord_message_id is not None:
+            self.message_ids.put(message.discord_message_id, message.id)
+
+    @handle_connection_error
+    async def handle_server_messages(self, session: AsyncSession, message_ids: list[int]):
+        """
+        Forward a batch of new messages to discord. The messages are loaded in one query and
+        sent concurrently across channels, in order within each, and their Discord message
+        IDs are saved in one bulk update. Messages that were sent are kept when others fail.
+        Args:
+            session: Database session
+            message_ids: Message IDs from server
+        """
+        message_ids = await self.owned_messages(session, list(dict.fromkeys(message_ids)))
+        if not message_ids:
+            return
+        messages = await self.load_messages(session, *message_ids)
+        missing = [message_id for message_id in message_ids if message_id not in messages]
+        if missing:
+            logging.warning('No server messages found for new messages event: %s', missing,
+                            extra={'message_ids': missing})
+
+        acknowledged = []
+        unsent = []
+        for message_id in message_ids:
+            message = messages.get(message_id)
+            if message is None:
+                continue
+            channel = message.channel
+            acknowledged.append(message_id)
+            # The message may already have been sent by catch-up sync or an earlier delivery
+            if channel.discord_channel_id is not None and message.discord_message_id is None:
+                unsent.append(message)
+        if not acknowledged:
+            return
+
+        discord_channel_ids = list(dict.fromkeys(message.channel.discord_channel_id for message in unsent))
+        discord_channels = dict(zip(discord_channel_ids, await asyncio.gather(
+            *(self.discord_bot.get_channel(discord_channel_id) for discord_channel_id in discord_channel_ids))))
+        # The sender keeps the order of the sends within each channel
+        results = await asyncio.gather(*(
+            self.send_once(discord_channels[message.channel.discord_channel_id], message)
+            for message in unsent), return_exceptions=True)
+
+        now = datetime.now(pytz.UTC)
+        sent = []
+        error = None
+        for message, result in zip(unsent, results):
+            if isinstance(result, BaseException):
+                logging.error('Error forwarding server message %s to Discord: %s', message.id, result,
+                              extra={'message_id': message.id})
+                error = error or result
+                acknowledged.remove(message.id)
+            else:
+                sent.append({'message_id': message.id, 'new_discord_message_id': result, 'now': now})
+        if sent:
+            await session.execute(queries.SET_DISCORD_MESSAGE_ID, sent)
+        if acknowledged:
+            await self.commit_with_event(session, NewMessagesEvent(acknowledged))
+        for params in sent:
+            self.unsaved_sends.pop(params['message_id'])
+            self.message_ids.put(params['new_discord_message_id'], params['message_id'])
+        logging.info('%d of %d server messages forwarded to Discord', len(sent), len(unsent),
+                     extra={'message_ids': [params['message_id'] for params in sent], 'sampled': True})
+        if error is not None:
+            raise error
 
-        await self.socketio.emit('chat-message', {'type': 'new-message', 'message_id': message_id},
-                                 self.namespace)
+    async def send_once(self, discord_channel, message: Message):
+        """
+        Send a server message to Discord, unless an earlier attempt of the handler already did
+        and failed to commit its Discord message ID
+        Args:
+            discord_channel: Discord channel
+            message: Server message
+        Returns:
+            Discord message ID
+        """
+        discord_message_id = self.unsaved_sends.get(message.id)
+        if discord_message_id is None:
+            discord_message = await self.discord_bot.sender.send(discord_channel, message.user.display_name,
+                                                                 message.text, message.attachments)
+            discord_message_id = discord_message.id
+            self.unsaved_sends.put(message.id, discord_message_id)
+        return discord_message_id
 
     @handle_connection_error
-    async def handle_server_message_edited(self, before_message_id: int, after_message_id: int):
+    async def handle_server_message_edited(self, session: AsyncSession, before_message_id: int,
+                                           after_message_id: int):
         """
         Edit the message on discord
         Args:
+            session: Database session
             before_message_id: Before message ID from server
             after_message_id: After message ID from server
         """
-        before_message = self.session.query(Message).filter_by(id=before_message_id).first()
-        after_message = self.session.query(Message).filter_by(id=after_message_id).first()
-
-        if before_message.channel.discord_channel_id is not None:
-            discord_channel = self.discord_bot.bot.get_channel(before_message.channel.discord_channel_id)
-            discord_message = await discord_channel.fetch_message(before_message.discord_message_id)
-
-            edited_message = await discord_message.edit(
-                embed=utils.create_embed(before_message.user.display_name, after_message.text))
+        if not await self.owned_messages(session, [before_message_id]):
+            return
+        messages = await self.load_messages(session, before_message_id, after_message_id)
+        before_message = messages.get(before_message_id)
+        after_message = messages.get(after_message_id)
+        if before_message is None or after_message is None:
+            logging.warning('No server message found for edit event: %s -> %s', before_message_id, after_message_id,
+                            extra={'message_id': before_message_id, 'after_message_id': after_message_id})
+            return
+        channel = before_message.channel
+
+        if channel.discord_channel_id is not None:
+            discord_channel = await self.discord_bot.get_channel(channel.discord_channel_id)
+
+            # Keep any other messages coalesced into the same Discord message in place
+            entries = [(m.id, m.user.display_name, m.text)
+                       for m in await self.coalesced_messages(session, before_message)]
+            entries.append((before_message.id, before_message.user.display_name, after_message.text))
+            edited_message = await self.discord_bot.sender.edit(
+                discord_channel, before_message.discord_message_id,
+                [(author, text) for _, author, text in sorted(entries)])
 
             # Update discord response on server
             before_message.hidden = True
@@ -167,118 +415,332 @@ class Server:
 
             after_message.discord_message_id = edited_message.id
             after_message.last_updated = datetime.now(pytz.UTC)
-            self.session.commit()
 
-            logging.info(
-                f'Discord message ID: {discord_message.id} edited following edit in server: {edited_message.id}')
+            logging.info('Discord message ID: %s edited following edit in server: %s',
+                         before_message.discord_message_id, edited_message.id, extra={
+                             'message_id': before_message.id, 'after_message_id': after_message.id,
+                             'discord_message_id': edited_message.id,
+                             'discord_channel_id': channel.discord_channel_id, 'sampled': True})
 
-        await self.socketio.emit('chat-message', {'type': 'edit-message',
-                                                  'before_message_id': before_message_id,
-                                                  'after_message_id': after_message_id},
-                                 self.namespace)
+        await self.commit_with_event(session, EditMessageEvent(before_message_id, after_message_id))
+        if after_message.discord_message_id is not None:
+            self.message_ids.put(after_message.discord_message_id, after_message.id)
 
     @handle_connection_error
-    async def handle_server_message_deletion(self, message_id: int):
+    async def handle_server_message_deletion(self, session: AsyncSession, message_id: int):
         """
         Delete the message from discord
         Args:
+            session: Database session
             message_id: Message ID from server
         """
-        message = self.session.query(Message).filter_by(id=message_id).first()
-
-        if message.channel.discord_channel_id is not None:
-            discord_channel = self.discord_bot.bot.get_channel(message.channel.discord_channel_id)
-            discord_message = await discord_channel.fetch_message(message.discord_message_id)
-
-            await discord_message.delete()
-            logging.info(f'Discord message deleted following deletion from server: {message.id}')
+        if not await self.owned_messages(session, [message_id]):
+            return
+        message = (await self.load_messages(session, message_id)).get(message_id)
+        if message is None:
+            logging.warning('No server message found for delete event: %s', message_id,
+                            extra={'message_id': message_id})
+            return
+        channel = message.channel
+
+        if channel.discord_channel_id is not None:
+            discord_channel = await self.discord_bot.get_channel(channel.discord_channel_id)
+            others = await self.coalesced_messages(session, message)
+            if others:
+                await self.discord_bot.sender.edit(discord_channel, message.discord_message_id,
+                                                   [(m.user.display_name, m.text) for m in others])
+            else:
+                await self.discord_bot.sender.delete(discord_channel, message.discord_message_id)
+            logging.info('Discord message deleted following deletion from server: %s', message.id, extra={
+                'message_id': message.id, 'discord_message_id': message.discord_message_id,
+                'discord_channel_id': channel.discord_channel_id, 'sampled': True})
 
         # Remove from server
         message.hidden = True
         message.last_updated = datetime.now(pytz.UTC)
-        self.session.commit()
-
-        await self.socketio.emit('chat-message', {'type': 'delete-message', 'message_id': message_id},
-                                 self.namespace)
+        await self.commit_with_event(session, DeleteMessageEvent(message_id))
+        self.message_ids.pop(message.discord_message_id)
 
     async def start(self):
         """
-        Start the connection to the server
+        Start the connection to the server, reconnecting with jittered exponential backoff
         """
         logging.info('Starting Server Bot')
+        failures = 0
         while True:
-            timestamp = str(datetime.now(pytz.UTC).timestamp())
-            hash_k = generate_password_hash(self.config.APP_SECRET_KEY + timestamp, method='pbkdf2')
-            headers = {'Authorization': hash_k, 'Timestamp': timestamp}
-
             try:
-                await self.socketio.connect('https://' + self.endpoint, headers=headers, namespaces=[self.namespace])
+                headers = await self.auth_headers()
+                await self.socketio.connect('https://' + self.endpoint, headers=headers, namespaces=self.namespaces)
+                failures = 0
                 await self.socketio.wait()
                 logging.info('Connection to server closed..')
             except Exception as e:
-                logging.error('Error in connection to Server..')
-                logging.error(repr(e))
-                await asyncio.sleep(5)
+                failures += 1
+                logging.error('Error in connection to Server: %r', e, extra={'failures': failures})
 
-    @handle_connection_error
-    async def send_to_server(self, data: DiscordMessage):
+            delay = min(self.config.SERVER_RECONNECT_BASE * 2 ** failures, self.config.SERVER_RECONNECT_MAX)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+    async def auth_headers(self):
+        """
+        Build the Authorization and Timestamp headers for the server handshake.
+        In 'hmac' mode Authorization is 'hmac-sha256:' followed by the hex HMAC-SHA256 of
+        the timestamp keyed with APP_SECRET_KEY. In 'pbkdf2' mode it is a werkzeug password
+        hash of the key and timestamp, computed in an executor since it takes a while.
+        Returns:
+            Dictionary of headers
+        """
+        timestamp = str(datetime.now(pytz.UTC).timestamp())
+        if self.config.SERVER_AUTH_MODE == 'hmac':
+            signature = hmac.new(self.key.encode(), timestamp.encode(), hashlib.sha256).hexdigest()
+            authorization = f'hmac-sha256:{signature}'
+        else:
+            authorization = await asyncio.get_running_loop().run_in_executor(
+                None, partial(generate_password_hash, self.key + timestamp, method='pbkdf2'))
+        return {'Authorization': authorization, 'Timestamp': timestamp}
+
+    def route_filter(self, column):
         """
-        Send the message to the server
+        Build the condition selecting the rows of this server
         Args:
-            data: DiscordMessage
+            column: namespace column of chat_channels or chat_outbox
+        Returns:
+            SQL expression
+        """
+        return column.is_(None) if self.route is None else column == self.route
+
+    async def owns_channel(self, discord_channel_id: int | None):
+        """
+        Check whether this worker handles server events for a channel. Every worker receives
+        every server event; the one whose shards hold the Discord channel handles it, and
+        worker 0 handles channels that are not bridged to Discord.
+        Args:
+            discord_channel_id: Discord channel ID of the server channel, or None
+        Returns:
+            True if this worker should handle the event
+        """
+        if discord_channel_id is None:
+            return self.worker_id == 0
+        return await self.discord_bot.owns_channel(discord_channel_id)
+
+    async def owned_messages(self, session: AsyncSession, message_ids: list[int]):
+        """
+        Select the server messages this worker handles, looking up only their channels so
+        the messages of other workers are never loaded
+        Args:
+            session: Database session
+            message_ids: Server message IDs
+        Returns:
+            List of the message IDs in channels this worker owns, and of those not found, which
+            the handler reports
+        """
+        if self.worker_id == 0 and not self.discord_bot.partial_shards:
+            # This process runs every shard, so it handles every channel
+            return message_ids
+        discord_channel_ids = dict((await session.execute(
+            queries.SELECT_MESSAGE_DISCORD_CHANNELS, {'message_ids': message_ids})).all())
+        owned = {}
+        result = []
+        for message_id in message_ids:
+            if message_id in discord_channel_ids:
+                discord_channel_id = discord_channel_ids[message_id]
+                if discord_channel_id not in owned:
+                    owned[discord_channel_id] = await self.owns_channel(discord_channel_id)
+                if not owned[discord_channel_id]:
+                    continue
+            result.append(message_id)
+        return result
+
+    async def get_channel_id(self, session: AsyncSession, discord_channel_id: int, create=False):
+        """
+        Resolve a Discord channel ID to a server channel ID, consulting the cache first
+        Args:
+            session: Database session
+            discord_channel_id: Discord channel ID
+            create: Create the channel if it does not exist yet
+        Returns:
+            Server channel ID, or None if it does not exist and create is False
         """
-        # Send the message to the server
-        channel = self.session.query(ChatChannels).filter_by(discord_channel_id=data.channel.id).first()
-        if channel is None:
-            channel = ChatChannels(discord_channel_id=data.channel.id)
-            self.session.add(channel)
-            self.session.commit()
+        channel_id = self.channel_ids.get(discord_channel_id)
+        if channel_id is not None:
+            return channel_id
+
+        channel_id = await session.scalar(queries.SELECT_CHANNEL_ID, {'discord_channel_id': discord_channel_id})
+        if channel_id is None and create:
+            # Another handler or worker may create the same channel concurrently
+            channel_id = await session.scalar(queries.INSERT_CHANNEL[session.bind.dialect.name],
+                                              {'new_discord_channel_id': discord_channel_id})
+            if channel_id is None:
+                channel_id = await session.scalar(queries.SELECT_CHANNEL_ID,
+                                                  {'discord_channel_id': discord_channel_id})
+            await session.commit()
+
+        if channel_id is not None:
+            self.channel_ids.put(discord_channel_id, channel_id)
+        return channel_id
+
+    async def hide_message(self, session: AsyncSession, discord_message_id: int, posted_on_discord=False):
+        """
+        Hide the visible server message for a Discord message, consulting the cache first.
+        The change is not committed.
+        Args:
+            session: Database session
+            discord_message_id: Discord message ID
+            posted_on_discord: Only hide a message that was posted on Discord, not one the
+                server sent there
+        Returns:
+            Row with the id, user_id and created_at of the hidden message, or None if not found
+        """
+        by_id, by_discord_id = queries.HIDE_MESSAGE_BY_ID, queries.HIDE_MESSAGE_BY_DISCORD_ID
+        if posted_on_discord:
+            by_id, by_discord_id = queries.HIDE_DISCORD_MESSAGE_BY_ID, queries.HIDE_DISCORD_MESSAGE_BY_DISCORD_ID
+        now = datetime.now(pytz.UTC)
+        row = None
+        message_id = self.message_ids.get(discord_message_id)
+        if message_id is not None:
+            self.message_ids.pop(discord_message_id)
+            row = (await session.execute(by_id, {'message_id': message_id, 'now': now})).first()
+        if row is None:
+            row = (await session.execute(by_discord_id,
+                                         {'lookup_discord_message_id': discord_message_id, 'now': now})).first()
+        return row
+
+    async def load_messages(self, session: AsyncSession, *message_ids: int):
+        """
+        Load server messages together with their channel, user and attachments in one query
+        Args:
+            session: Database session
+            *message_ids: Message IDs
+        Returns:
+            Dict of message ID to Message, without the IDs that were not found
+        """
+        messages = (await session.scalars(queries.LOAD_MESSAGES, {'message_ids': list(message_ids)})).unique()
+        return {message.id: message for message in messages}
 
-        message = Message(data, channel)
-        self.session.add(message)
-        self.session.commit()
+    async def coalesced_messages(self, session: AsyncSession, message: Message):
+        """
+        Get the other visible server messages coalesced into the same Discord message
+        Args:
+            session: Database session
+            message: Server message
+        Returns:
+            Messages with their users loaded, in ID order
+        """
+        if not self.discord_bot.sender.coalesce_window or message.discord_message_id is None:
+            return []
+        return (await session.scalars(queries.SELECT_COALESCED_MESSAGES, {
+            'lookup_discord_message_id': message.discord_message_id, 'message_id': message.id})).all()
 
-        await self.socketio.emit('chat-message', {'type': 'new-message', 'message_id': message.id},
-                                 self.namespace)
+    def cache_stats(self):
+        """
+        Get hit/miss counters of the ID caches
+        Returns:
+            Dictionary of cache statistics by cache name
+        """
+        return {'channel_ids': self.channel_ids.stats(), 'message_ids': self.message_ids.stats(),
+                'message_channels': self.message_channels.stats()}
+
+    async def send_to_server(self, data: DiscordMessage, attachments=()):
+        """
+        Send the message to the server, through the write-behind queue if enabled
+        Args:
+            data: DiscordMessage
+            attachments: StoredAttachments of the message
+        """
+        if self.batcher is not None:
+            await self.batcher.put(data, attachments)
+        else:
+            await self.insert_messages([data], {data.id: attachments})
+
+    @handle_connection_error
+    async def insert_messages(self, session: AsyncSession, messages: list[DiscordMessage], attachments=None):
+        """
+        Insert messages on the server in one transaction
+        Args:
+            session: Database session
+            messages: DiscordMessages in the order they were received
+            attachments: Dict of Discord message ID to the StoredAttachments of that message
+        """
+        server_messages = []
+        for data in messages:
+            channel_id = await self.get_channel_id(session, data.channel.id, create=True)
+            server_message = Message(data, channel_id)
+            server_message.attachments = attachment_rows((attachments or {}).get(data.id, ()))
+            server_messages.append(server_message)
+        session.add_all(server_messages)
+        await session.flush()
+
+        if len(server_messages) == 1:
+            await self.commit_with_event(session, NewMessageEvent(server_messages[0].id))
+        else:
+            await self.commit_with_event(session, NewMessagesEvent([m.id for m in server_messages]))
+
+        for message in server_messages:
+            self.message_ids.put(message.discord_message_id, message.id)
+            self.message_channels.put(message.id, message.channel_id)
 
     @handle_connection_error
-    async def edit_message_text(self, before_msg: DiscordMessage, after_msg: DiscordMessage):
+    async def edit_message_text(self, session: AsyncSession, before_msg: DiscordMessage,
+                                after_msg: DiscordMessage, attachments=()):
         """
         Edit the message on the server
         Args:
+            session: Database session
             before_msg: DiscordMessage
             after_msg: DiscordMessage
+            attachments: StoredAttachments of the message after the edit
         """
-        # Edit the message on the server
-        channel = self.session.query(ChatChannels).filter_by(discord_channel_id=before_msg.channel.id).first()
-        before_server_message = self.session.query(Message).filter_by(
-            discord_message_id=before_msg.id, hidden=False).first()
-        before_server_message.hidden = True
-        before_server_message.last_updated = datetime.now(pytz.UTC)
+        if self.batcher is not None:
+            # The message being changed may still be waiting in the write-behind queue
+            await self.batcher.flush()
 
-        after_server_message = Message(after_msg, channel)
+        # Edit the message on the server
+        channel_id = await self.get_channel_id(session, before_msg.channel.id)
+        before_server_message = await self.hide_message(session, before_msg.id)
+        if before_server_message is None:
+            logging.warning('No server message found for edited Discord message: %s', before_msg.id,
+                            extra={'discord_message_id': before_msg.id, 'discord_channel_id': before_msg.channel.id})
+            return
+
+        after_server_message = Message(after_msg, channel_id)
         after_server_message.user_id = before_server_message.user_id
         after_server_message.created_at = before_server_message.created_at
-        self.session.add(after_server_message)
-        self.session.commit()
-
-        await self.socketio.emit('chat-message', {'type': 'edit-message',
-                                                  'before_message_id': before_server_message.id,
-                                                  'after_message_id': after_server_message.id},
-                                 self.namespace)
+        after_server_message.attachments = attachment_rows(attachments)
+        session.add(after_server_message)
+        await session.flush()
+        await self.commit_with_event(session, EditMessageEvent(before_server_message.id, after_server_message.id))
+        self.message_ids.put(after_server_message.discord_message_id, after_server_message.id)
 
     @handle_connection_error
-    async def delete_message(self, message: DiscordMessage):
+    async def delete_message(self, session: AsyncSession, message: DiscordMessage):
         """
         Delete the message on the server
         Args:
+            session: Database session
             message: DiscordMessage
         """
-        # Delete the message on the server
-        server_msg = self.session.query(Message).filter_by(discord_message_id=message.id, hidden=False).first()
-        server_msg.hidden = True
-        server_msg.last_updated = datetime.now(pytz.UTC)
-        self.session.commit()
-
-        await self.socketio.emit('chat-message', {'type': 'delete-message', 'message_id': server_msg.id},
-                                 self.namespace)
+        if self.batcher is not None:
+            # The message being changed may still be waiting in the write-behind queue
+            await self.batcher.flush()
+
+        # Delete the message on the server. Deletes of the messages the server sent are its
+        # own, coming back from Discord when the bot no longer remembers the message
+        server_msg = await self.hide_message(session, message.id, posted_on_discord=True)
+        if server_msg is None:
+            logging.warning('No server message found for deleted Discord message: %s', message.id,
+                            extra={'discord_message_id': message.id, 'discord_channel_id': message.channel.id})
+            return
+        await self.commit_with_event(session, DeleteMessageEvent(server_msg.id))
+
+
+def attachment_rows(attachments):
+    """
+    Build the rows recording stored attachments
+    Args:
+        attachments: StoredAttachments
+    Returns:
+        List of Attachment
+    """
+    return [Attachment(sha256=attachment.sha256, filename=attachment.filename,
+                       content_type=attachment.content_type, size=attachment.size)
+            for attachment in attachments]
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+import discord
+import pytz
+from sqlalchemy import func
+from sqlalchemy import select
+
+from dsbridge.models import ChannelSyncState
+from dsbridge.models import ChatChannels
+from dsbridge.models import Message
+
+
+class CatchUpSync:
+    """
+    Mirrors messages that were missed while the bridge was offline.
+    Each bridged channel keeps a watermark in chat_channel_sync: the newest Discord message
+    ID and the newest server message last_updated that were reconciled. A run pages through
+    Discord history after the first and through unsent server messages after the second, so
+    repeated runs only look at what is new. Channels are synced concurrently by a bounded
+    pool of workers, and each side of a channel runs through the dispatcher under the same
+    key as live events so catch-up and live traffic stay in order.
+    """
+    def __init__(self, server, discord_bot, workers, page_size, lookback):
+        self.server = server
+        self.discord_bot = discord_bot
+        self.page_size = page_size
+        self.lookback = lookback
+        self.synced = 0
+        self._workers = asyncio.Semaphore(workers)
+        self._task = None
+        self._rerun = False
+
+    @classmethod
+    def from_config(cls, server, discord_bot, config):
+        return cls(server, discord_bot, config.SYNC_WORKERS, config.SYNC_PAGE_SIZE, config.SYNC_LOOKBACK)
+
+    def schedule(self):
+        """
+        Start a catch-up run in the background, or queue another one if a run is in progress
+        """
+        if self._task is not None and not self._task.done():
+            self._rerun = True
+            return
+        self._task = asyncio.create_task(self._run_until_idle())
+
+    async def _run_until_idle(self):
+        while True:
+            self._rerun = False
+            try:
+                await self.run()
+            except Exception as e:
+                logging.error('Error in catch-up sync: %s', e, extra={'error': str(e)})
+            if not self._rerun:
+                break
+
+    async def run(self):
+        """
+        Sync every open bridged channel
+        Returns:
+            Number of messages mirrored
+        """
+        async with self.server.session_factory() as session:
+            channels = (await session.execute(
+                select(ChatChannels.id, ChatChannels.discord_channel_id).where(
+                    ChatChannels.discord_channel_id.is_not(None), ChatChannels.closed.is_(False),
+                    self.server.route_filter(ChatChannels.namespace)))).all()
+        # With several worker processes each one syncs the channels on its own shards
+        channels = [channel for channel in channels if await self.discord_bot.owns_channel(channel[1])]
+
+        logging.info('Starting catch-up sync of %d channels', len(channels), extra={'channels': len(channels)})
+        counts = await asyncio.gather(*(self.sync_channel(channel_id, discord_channel_id)
+                                        for channel_id, discord_channel_id in channels))
+        total = sum(counts)
+        logging.info('Catch-up sync finished, %d messages mirrored', total, extra={'messages': total})
+        return total
+
+    async def sync_channel(self, channel_id: int, discord_channel_id: int):
+        """
+        Sync one channel in both directions
+        Args:
+            channel_id: Server channel ID
+            discord_channel_id: Discord channel ID
+        Returns:
+            Number of messages mirrored
+        """
+        async with self._workers:
+            dispatcher = self.server.dispatcher
+            try:
+                count = await dispatcher.call(discord_channel_id, self.sync_from_discord,
+                                              channel_id, discord_channel_id)
+                count += await dispatcher.call(('server', channel_id), self.sync_from_server, channel_id)
+            except Exception as e:
+                logging.error('Error in catch-up sync of channel %s: %s', channel_id, e,
+                              extra={'channel_id': channel_id})
+                return 0
+        self.synced += count
+        return count
+
+    async def sync_from_discord(self, channel_id: int, discord_channel_id: int):
+        """
+        Forward Discord messages posted after the channel watermark to the server
+        Args:
+            channel_id: Server channel ID
+            discord_channel_id: Discord channel ID
+        Returns:
+            Number of messages forwarded
+        """
+        async with self.server.session_factory() as session:
+            state = await session.get(ChannelSyncState, channel_id)
+            after = state.discord_message_id if state is not None else None
+            if after is None:
+                # First run for this channel: start from the newest message already bridged
+                after = await session.scalar(
+                    select(func.max(Message.discord_message_id)).filter_by(channel_id=channel_id))
+        if after is None:
+            # Nothing was ever bridged here, so there is no gap to fill
+            return 0
+
+        discord_channel = await self.discord_bot.get_channel(discord_channel_id)
+        count = 0
+        page = []
+        async for message in discord_channel.history(limit=None, after=discord.Object(id=after),
+                                                     oldest_first=True):
+            page.append(message)
+            if len(page) >= self.page_size:
+                count += await self.forward_page(channel_id, page)
+                page = []
+        if page:
+            count += await self.forward_page(channel_id, page)
+        return count
+
+    async def forward_page(self, channel_id: int, page: list):
+        """
+        Forward a page of Discord history to the server and advance the watermark
+        Args:
+            channel_id: Server channel ID
+            page: DiscordMessages, oldest first
+        Returns:
+            Number of messages forwarded
+        """
+        async with self.server.session_factory() as session:
+            known = set((await session.scalars(select(Message.discord_message_id).where(
+                Message.discord_message_id.in_([message.id for message in page])))).all())
+
+        page_new = [message for message in page
+                    if message.id not in known and not self.discord_bot.is_own_message(message)]
+        # Checked together so the sanitizer executor can batch the page
+        verdicts = await asyncio.gather(*(self.discord_bot.sanitizer_executor.is_clean(message.content)
+                                          for message in page_new))
+        messages = []
+        for message, clean in zip(page_new, verdicts):
+            if clean:
+                messages.append(message)
+            else:
+                await message.delete()
+                logging.info('Discord message deleted due to sanitization: %s', message.id, extra={
+                    'discord_message_id': message.id, 'discord_channel_id': message.channel.id, 'sampled': True})
+
+        if messages:
+            attachments = {}
+            if self.discord_bot.attachments is not None:
+                stored = await asyncio.gather(*(self.discord_bot.attachments.fetch_all(message)
+                                                for message in messages))
+                attachments = dict(zip((message.id for message in messages), stored))
+            await self.server.insert_messages(messages, attachments)
+        await self.save_state(channel_id, discord_message_id=page[-1].id)
+        return len(messages)
+
+    async def sync_from_server(self, channel_id: int):
+        """
+        Send server messages that never reached Discord
+        Args:
+            channel_id: Server channel ID
+        Returns:
+            Number of messages sent
+        """
+        async with self.server.session_factory() as session:
+            state = await session.get(ChannelSyncState, channel_id)
+            since = state.last_updated if state is not None else None
+            if since is None:
+                since = datetime.now(pytz.UTC) - timedelta(seconds=self.lookback)
+            pending = (await session.execute(
+                select(Message.id, Message.last_updated).where(
+                    Message.channel_id == channel_id,
+                    Message.discord_message_id.is_(None),
+                    Message.hidden.is_(False),
+                    Message.last_updated > since,
+                ).order_by(Message.id))).all()
+
+        for start in range(0, len(pending), self.page_size):
+            page = pending[start:start + self.page_size]
+            for message_id, _ in page:
+                await self.server.handle_server_message(message_id)
+            await self.save_state(channel_id, last_updated=max(last_updated for _, last_updated in page))
+        return len(pending)
+
+    async def save_state(self, channel_id: int, discord_message_id=None, last_updated=None):
+        """
+        Advance the watermarks of a channel
+        Args:
+            channel_id: Server channel ID
+            discord_message_id: Newest Discord message ID reconciled
+            last_updated: Newest server message last_updated reconciled
+        """
+        async with self.server.session_factory() as session:
+            state = await session.get(ChannelSyncState, channel_id)
+            if state is None:
+                state = ChannelSyncState(channel_id=channel_id)
+                session.add(state)
+            if discord_message_id is not None:
+                state.discord_message_id = discord_message_id
+            if last_updated is not None:
+                state.last_updated = last_updated
+            await session.commit()
@@ -72,3 +72,164 @@ def sanitize_input(user_input, banned_words, allowed_domain=None):
     sanitized_input = remove_words(sanitized_input, banned_words)
 
     return sanitized_input
+
+
+# Characters that bleach rewrites; text without them passes through bleach unchanged
+MARKUP_PATTERN = re.compile(r'[\x00-\x08\x0b-\x1f&<>]')
+WORD_PATTERN = re.compile(r'\w+')
+PERSONAL_INFO_PATTERNS = {
+    'email': re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'),
+    'phone': re.compile(r'\+?\d{1,3}?[-.\s]?\(?\d{1,4}?\)?[-.\s]?\d{1,4}[-.\s]?\d{1,9}'),
+    'credit_card': re.compile(r'\b(?:\d[ -]*?){13,16}\b'),
+    'ssn': re.compile(r'\b\d{3}-\d{2}-\d{4}\b'),
+    'url': re.compile(r'https?://[^\s<>"]+|www\.[^\s<>"]+'),
+    'html_tags': re.compile(r'<[^>]+>'),
+}
+DIGIT_PATTERN = re.compile(r'\d')
+# Cheap checks for text each pattern needs, so most messages skip the regex scan entirely
+PERSONAL_INFO_HINTS = {
+    'email': lambda text: '@' in text,
+    'phone': lambda text: DIGIT_PATTERN.search(text) is not None,
+    'credit_card': lambda text: DIGIT_PATTERN.search(text) is not None,
+    'ssn': lambda text: DIGIT_PATTERN.search(text) is not None,
+    'url': lambda text: '://' in text or 'www.' in text,
+    'html_tags': lambda text: '<' in text,
+}
+_END = None
+
+
+class Sanitizer:
+    """
+    Precompiled equivalent of sanitize_input, built once from the banned words list.
+
+    Banned words made of plain words are matched through a word-level trie, so the
+    cost per message depends on its length rather than on the size of the list.
+    Entries containing punctuation fall back to a single regex compiled up front.
+    Where several banned entries overlap, the longest is replaced. Words are compared
+    case-insensitively after str.casefold(), applied alike to the list and the text.
+    """
+    REPLACEMENT = '[REMOVED]'
+
+    def __init__(self, banned_words, allowed_domain=None):
+        self.allowed_domain = allowed_domain
+        self._trie = {}
+        fallback = []
+        for word in banned_words:
+            word = word.strip()
+            if not word:
+                continue
+            tokens = word.split(' ')
+            if all(WORD_PATTERN.fullmatch(token) for token in tokens):
+                node = self._trie
+                for token in tokens:
+                    node = node.setdefault(token.casefold(), {})
+                node[_END] = True
+            else:
+                fallback.append(re.escape(word))
+
+        self._fallback = None
+        if fallback:
+            self._fallback = re.compile(r'\b(' + '|'.join(fallback) + r')\b', flags=re.IGNORECASE)
+
+    def clean(self, text):
+        """
+        Sanitize the text
+        Args:
+            text: Text to sanitize
+        Returns:
+            Sanitized text
+        """
+        if MARKUP_PATTERN.search(text):
+            text = bleach.clean(text, tags=set(), attributes={}, protocols=[], strip=True)
+
+        for key, pattern in PERSONAL_INFO_PATTERNS.items():
+            if not PERSONAL_INFO_HINTS[key](text):
+                continue
+            if key == 'email' and self.allowed_domain:
+                text = pattern.sub(self._replace_email, text)
+            else:
+                text = pattern.sub(self.REPLACEMENT, text)
+
+        return self.remove_words(text)
+
+    def is_clean(self, text):
+        """
+        Check whether clean() would leave the text unchanged, without rewriting it
+        Args:
+            text: Text to check
+        Returns:
+            True if the text needs no sanitization
+        """
+        if MARKUP_PATTERN.search(text):
+            return self.clean(text) == text
+
+        for key, pattern in PERSONAL_INFO_PATTERNS.items():
+            if not PERSONAL_INFO_HINTS[key](text):
+                continue
+            match = pattern.search(text)
+            if match is not None:
+                # An allowed email may still hide other personal info, so check it in full
+                return self._is_allowed_email(match.group(0)) and self.clean(text) == text
+
+        if not self._trie.keys().isdisjoint(map(str.casefold, WORD_PATTERN.findall(text))):
+            if next(self._banned_spans(text), None) is not None:
+                return False
+        return self._fallback is None or self._fallback.search(text) is None
+
+    def remove_words(self, text):
+        """
+        Replace banned words in the text
+        Args:
+            text: Text to filter
+        Returns:
+            Filtered text
+        """
+        spans = list(self._banned_spans(text))
+        if self._fallback is not None:
+            # Match on the original text so replacements do not change word boundaries
+            spans.extend(match.span() for match in self._fallback.finditer(text))
+            spans.sort()
+        if not spans:
+            return text
+
+        parts = []
+        position = 0
+        for start, end in spans:
+            if start < position:
+                continue
+            parts.append(text[position:start])
+            parts.append(self.REPLACEMENT)
+            position = end
+        parts.append(text[position:])
+        return ''.join(parts)
+
+    def _banned_spans(self, text):
+        if not self._trie:
+            return
+        tokens = list(WORD_PATTERN.finditer(text))
+        i = 0
+        while i < len(tokens):
+            node = self._trie.get(tokens[i].group().casefold())
+            j = i
+            last = None
+            while node is not None:
+                if _END in node:
+                    last = j
+                j += 1
+                # Phrases only match across a single space, like the regex they replace
+                if j >= len(tokens) or text[tokens[j - 1].end():tokens[j].start()] != ' ':
+                    break
+                node = node.get(tokens[j].group().casefold())
+
+            if last is None:
+                i += 1
+            else:
+                yield tokens[i].start(), tokens[last].end()
+                i = last + 1
+
+    def _is_allowed_email(self, text):
+        return bool(self.allowed_domain) and '@' in text and text.split('@')[-1] == self.allowed_domain
+
+    def _replace_email(self, match):
+        email = match.group(0)
+        return email if self._is_allowed_email(email) else self.REPLACEMENT
@@ -1,13 +1,12 @@
 import asyncio
-import logging
 
+from dsbridge.config import app_config
+from dsbridge.launch import run_workers
 from dsbridge.launch import runner
 
-# Set up logging
-logging.getLogger('discord').setLevel(logging.INFO)
-logging.getLogger('root').setLevel(logging.INFO)
-logging.getLogger(__name__).setLevel(logging.INFO)
-
 
 if __name__ == '__main__':
-    asyncio.run(runner())
+    if app_config.WORKER_PROCESSES > 1:
+        run_workers(app_config)
+    else:
+        asyncio.run(runner())
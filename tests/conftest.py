@@ -0,0 +1,38 @@
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+from discord.message import Message as DiscordMessage
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from dsbridge.config import app_config
+from dsbridge.database import Base
+from dsbridge.server import Server
+
+
+@pytest.fixture
+async def session_factory():
+    engine = create_async_engine('sqlite+aiosqlite://', poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(bind=engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest.fixture
+def server(session_factory):
+    server = Server(app_config, session_factory=session_factory)
+    server.socketio.emit = AsyncMock()
+    server.socketio.connected = True
+    return server
+
+
+def make_discord_message(message_id, channel_id, content='Hello', author_id=1):
+    message = MagicMock(spec=DiscordMessage)
+    message.id = message_id
+    message.content = content
+    message.channel.id = channel_id
+    message.author.id = author_id
+    return message
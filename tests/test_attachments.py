@@ -0,0 +1,102 @@
+import os
+from unittest.mock import MagicMock
+
+import discord
+import pytest
+from aiohttp import web
+from sqlalchemy import select
+
+from dsbridge.attachments import AttachmentRelay
+from dsbridge.attachments import AttachmentTooLarge
+from dsbridge.attachments import LocalAttachmentStore
+from dsbridge.attachments import StoredAttachment
+from dsbridge.config import app_config
+from dsbridge.models import Attachment
+from dsbridge.outbound import OutboundSender
+from tests.conftest import make_discord_message
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.fixture
+async def cdn():
+    # Stand-in for Discord's CDN serving /<name> with the content in the name
+    requests = []
+
+    async def serve(request):
+        requests.append(request.path)
+        return web.Response(body=request.match_info['name'].encode() * 1000)
+
+    app = web.Application()
+    app.router.add_get('/{name}', serve)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    yield f'http://127.0.0.1:{port}', requests
+    await runner.cleanup()
+
+
+def make_attachment(attachment_id, url, size=None):
+    attachment = MagicMock(spec=discord.Attachment)
+    attachment.id = attachment_id
+    attachment.url = url
+    attachment.filename = f'{attachment_id}.png'
+    attachment.content_type = 'image/png'
+    attachment.size = size or 0
+    return attachment
+
+
+async def test_store_deduplicates_and_enforces_size_limit(tmp_path):
+    store = LocalAttachmentStore(str(tmp_path))
+    sha256, size, new = await store.write(chunks(b'abc', b'def'), max_size=10)
+    assert (size, new) == (6, True)
+    assert open(store.path(sha256), 'rb').read() == b'abcdef'
+    assert (await store.write(chunks(b'abcdef'), max_size=10))[2] is False
+
+    with pytest.raises(AttachmentTooLarge):
+        await store.write(chunks(b'abcdef', b'ghijkl'), max_size=10)
+    assert os.listdir(tmp_path / 'tmp') == []
+
+
+async def test_relay_downloads_each_file_once(tmp_path, cdn):
+    base_url, requests = cdn
+    relay = AttachmentRelay(LocalAttachmentStore(str(tmp_path)), max_size=4000, concurrency=2, chunk_size=512)
+    message = make_discord_message(100, 10)
+    message.attachments = [make_attachment(1, f'{base_url}/cat'), make_attachment(2, f'{base_url}/cat'),
+                           make_attachment(3, f'{base_url}/big', size=5000)]
+    message.stickers = []
+
+    stored = await relay.fetch_all(message)
+    assert await relay.fetch_all(message) == stored
+    await relay.close()
+
+    assert sorted(requests) == ['/cat', '/cat']
+    assert [(attachment.filename, attachment.size) for attachment in stored] == [('1.png', 3000), ('2.png', 3000)]
+    assert stored[0].sha256 == stored[1].sha256
+    assert len(os.listdir(tmp_path / stored[0].sha256[:2])) == 1
+
+
+async def test_attachments_are_recorded_and_uploaded_to_discord(server, session_factory, tmp_path, mocker):
+    relay = AttachmentRelay(LocalAttachmentStore(str(tmp_path)), max_size=100, concurrency=1)
+    sha256, size, _ = await relay.store.write(chunks(b'image'), max_size=100)
+    await server.send_to_server(make_discord_message(100, 10),
+                                [StoredAttachment(sha256, 'cat.png', 'image/png', size)])
+    async with session_factory() as session:
+        rows = (await session.scalars(select(Attachment))).all()
+    assert [(row.message_id, row.sha256, row.filename) for row in rows] == [(1, sha256, 'cat.png')]
+
+    uploads = []
+
+    async def send(**kwargs):
+        uploads.extend((file.filename, file.fp.read()) for file in kwargs['files'])
+        return MagicMock(id=500)
+
+    channel = MagicMock(id=10, send=send)
+    sender = OutboundSender(MagicMock(), app_config, relay)
+    await sender.send(channel, 'Alice', 'Look', rows)
+    assert uploads == [('cat.png', b'image')]
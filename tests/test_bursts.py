@@ -0,0 +1,33 @@
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+from dsbridge.bursts import DuplicateBurstDetector
+from dsbridge.config import app_config
+from dsbridge.discord_bot import DiscordBot
+from tests.conftest import make_discord_message
+
+
+def test_repeats_within_the_window_are_flagged_per_channel():
+    now = [0.0]
+    detector = DuplicateBurstDetector(limit=2, window=10, clock=lambda: now[0])
+    assert [detector.is_repeat(1, 'Buy now') for _ in range(3)] == [False, False, True]
+    assert not detector.is_repeat(2, 'Buy now')
+    assert not detector.is_repeat(1, 'Something else')
+
+    now[0] = 11
+    assert not detector.is_repeat(1, 'Buy now')
+    assert detector.repeats == 1
+
+
+async def test_discord_bot_drops_repeats_before_the_server(mocker):
+    mocker.patch.object(app_config, 'DUPLICATE_BURST_LIMIT', 1)
+    mocker.patch.object(app_config, 'DUPLICATE_BURST_ACTION', 'delete')
+    discord_bot = DiscordBot(app_config)
+    discord_bot.server_bot = MagicMock(send_to_server=AsyncMock())
+    messages = [make_discord_message(message_id, 10, content='Buy now') for message_id in (100, 101)]
+
+    for message in messages:
+        await discord_bot.forward_message(message)
+
+    discord_bot.server_bot.send_to_server.assert_awaited_once_with(messages[0], ())
+    messages[1].delete.assert_awaited_once()
@@ -0,0 +1,44 @@
+from dsbridge.cache import LRUCache
+from dsbridge.cache import MessageRecord
+from dsbridge.cache import MessageRecordCache
+
+
+def test_lru_eviction_and_counters():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 2}
+
+
+def test_ttl_expiry():
+    now = [0.0]
+    cache = LRUCache(maxsize=10, ttl=5, clock=lambda: now[0])
+    cache.put('a', 1)
+    now[0] = 4
+    assert cache.get('a') == 1
+    now[0] = 6
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_message_records_evict_oldest_and_detect_content_changes():
+    cache = MessageRecordCache(maxsize=2)
+    assert cache.put(1, 10, 100, 'Hello')
+    assert not cache.put(1, 10, 100, 'Hello')
+    assert cache.put(1, 10, 100, 'Hello, edited')
+    assert cache.put(1, 10, 100, 'Hello, edited', [7])
+    assert not cache.put(1, 10, 100, 'Hello, edited', [7])
+    cache.put(2, 10, 101, 'Second')
+    cache.put(3, 10, 102, 'Third')
+
+    assert cache.get(1) is None
+    assert cache.get(2) == MessageRecord(2, 10, 101, hash(('Second', ())))
+    assert cache.pop(2).author_id == 101
+    assert 2 not in cache
+    cache.put(4, 10, 103, 'Fourth')
+    assert len(cache) == 2 and 3 in cache and 4 in cache
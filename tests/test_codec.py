@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+
+from dsbridge.codec import EditMessageEvent
+from dsbridge.codec import get_codec
+from dsbridge.codec import NewMessagesEvent
+from dsbridge.codec import parse_event
+from dsbridge.codec import StdlibJSONCodec
+
+
+@pytest.mark.parametrize('name', ['stdlib', 'auto'])
+def test_codec_round_trip(name):
+    codec = get_codec(name)
+    payload = {'type': 'new-message', 'message_id': 1,
+               'created_at': datetime(2024, 1, 2, 3, 4, 5), 'text': '2024-01-02T03:04:05'}
+    decoded = codec.loads(codec.dumps(payload))
+
+    assert decoded['created_at'] == datetime(2024, 1, 2, 3, 4, 5)
+    # Only known datetime fields are parsed
+    assert decoded['text'] == '2024-01-02T03:04:05'
+
+
+def test_stdlib_codec_accepts_socketio_kwargs():
+    assert StdlibJSONCodec.dumps({'a': 1}, separators=(',', ':')) == '{"a":1}'
+
+
+def test_parse_event():
+    event = parse_event({'type': 'edit-message', 'before_message_id': 1, 'after_message_id': 2})
+    assert event == EditMessageEvent(1, 2)
+    assert event.to_dict() == {'type': 'edit-message', 'before_message_id': 1, 'after_message_id': 2}
+    assert parse_event(NewMessagesEvent([1, 2], channel_id=3).to_dict()) == NewMessagesEvent([1, 2], 3)
+
+
+@pytest.mark.parametrize('data', [
+    {'type': 'unknown', 'message_id': 1},
+    {'type': 'new-message'},
+    {'type': 'delete-message', 'message_id': '1'},
+    {'type': 'new-messages', 'message_ids': [1, None]},
+])
+def test_parse_event_rejects_invalid_payloads(data):
+    with pytest.raises(ValueError):
+        parse_event(data)
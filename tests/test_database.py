@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from dsbridge.database import create_engine_from_config
+
+
+def make_config(uri, **overrides):
+    settings = dict(
+        SQLALCHEMY_DATABASE_URI=uri, DB_POOL_SIZE=3, DB_MAX_OVERFLOW=2, DB_POOL_TIMEOUT=5,
+        DB_POOL_RECYCLE=60, DB_POOL_PRE_PING=False, DB_STATEMENT_TIMEOUT=0,
+        DB_PREPARED_STATEMENT_CACHE_SIZE=100, DB_QUERY_CACHE_SIZE=500,
+    )
+    settings.update(overrides)
+    return SimpleNamespace(**settings)
+
+
+def test_pool_settings_come_from_config():
+    engine = create_engine_from_config(make_config('postgresql+asyncpg://u:p@localhost/db'))
+    assert engine.pool.size() == 3
+    assert engine.pool.timeout() == 5
+    assert not engine.sync_engine.echo
+
+
+def test_pool_settings_are_skipped_for_sqlite():
+    engine = create_engine_from_config(make_config('sqlite+aiosqlite://', DB_STATEMENT_TIMEOUT=1000))
+    assert engine.dialect.name == 'sqlite'
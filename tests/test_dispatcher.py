@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from dsbridge.dispatcher import ChannelDispatcher
+from dsbridge.dispatcher import DispatcherFullError
+
+
+async def test_jobs_run_in_order_per_channel():
+    dispatcher = ChannelDispatcher(max_concurrency=4)
+    events = []
+
+    async def job(channel, n):
+        await asyncio.sleep(0.01 if n == 0 else 0)
+        events.append((channel, n))
+
+    for n in range(3):
+        await dispatcher.submit('a', job, 'a', n)
+        await dispatcher.submit('b', job, 'b', n)
+    await dispatcher.join()
+
+    assert [n for c, n in events if c == 'a'] == [0, 1, 2]
+    assert [n for c, n in events if c == 'b'] == [0, 1, 2]
+    assert dispatcher.stats() == {'pending': 0, 'channels': 0, 'dropped': 0}
+
+
+async def test_concurrency_cap():
+    dispatcher = ChannelDispatcher(max_concurrency=2)
+    running = []
+    peak = []
+
+    async def job():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    for channel in range(6):
+        await dispatcher.submit(channel, job)
+    await dispatcher.join()
+
+    assert max(peak) == 2
+
+
+@pytest.mark.parametrize('overflow', ['drop', 'error'])
+async def test_overflow_policies(overflow):
+    dispatcher = ChannelDispatcher(max_pending=1, overflow=overflow)
+    release = asyncio.Event()
+
+    async def job():
+        await release.wait()
+
+    assert await dispatcher.submit('a', job)
+    if overflow == 'drop':
+        assert not await dispatcher.submit('b', job)
+    else:
+        with pytest.raises(DispatcherFullError):
+            await dispatcher.submit('b', job)
+    assert dispatcher.stats()['dropped'] == 1
+
+    release.set()
+    await dispatcher.join()
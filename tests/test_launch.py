@@ -0,0 +1,30 @@
+import pytest
+
+from dsbridge.config import app_config
+from dsbridge.discord_bot import DiscordBot
+from dsbridge.launch import restart_delay
+from dsbridge.launch import shard_ranges
+
+
+def test_shard_ranges_cover_every_shard_once():
+    ranges = shard_ranges(8, 3)
+    assert ranges == [[0, 3, 6], [1, 4, 7], [2, 5]]
+    assert sorted(sum(ranges, [])) == list(range(8))
+
+
+def test_shard_ranges_need_a_shard_per_worker():
+    with pytest.raises(ValueError):
+        shard_ranges(2, 3)
+
+
+def test_restart_delay_backs_off_up_to_the_maximum():
+    assert [restart_delay(failures, 1.0, 10.0) for failures in range(1, 6)] == [1.0, 2.0, 4.0, 8.0, 10.0]
+
+
+async def test_process_running_every_shard_owns_uncached_channels(mocker):
+    mocker.patch.object(app_config, 'DISCORD_SHARD_COUNT', 4)
+    assert await DiscordBot(app_config).owns_channel(10)
+
+    discord_bot = DiscordBot(app_config, shard_ids=[0, 2])
+    discord_bot.ready.set()
+    assert not await discord_bot.owns_channel(10)
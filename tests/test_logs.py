@@ -0,0 +1,36 @@
+import json
+import logging
+import queue
+
+from dsbridge.logs import JSONFormatter
+from dsbridge.logs import LogQueueHandler
+from dsbridge.logs import SamplingFilter
+
+
+def make_record(level=logging.INFO, **extra):
+    record = logging.LogRecord('dsbridge', level, __file__, 1, 'Forwarded %s', (42,), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_extra_fields():
+    data = json.loads(JSONFormatter().format(make_record(discord_message_id=42, duration_ms=1.5)))
+    assert data['message'] == 'Forwarded 42'
+    assert data['level'] == 'INFO'
+    assert data['discord_message_id'] == 42
+    assert data['duration_ms'] == 1.5
+
+
+def test_sampling_only_drops_sampled_info_records():
+    sampler = SamplingFilter(0)
+    assert not sampler.filter(make_record(sampled=True))
+    assert sampler.filter(make_record())
+    assert sampler.filter(make_record(logging.WARNING, sampled=True))
+
+
+def test_queue_handler_leaves_formatting_to_the_listener():
+    log_queue = queue.SimpleQueue()
+    LogQueueHandler(log_queue).handle(make_record())
+    record = log_queue.get_nowait()
+    assert record.msg == 'Forwarded %s'
+    assert record.args == (42,)
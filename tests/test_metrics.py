@@ -0,0 +1,40 @@
+import pytest
+
+from dsbridge import metrics
+
+
+@pytest.fixture
+def enabled():
+    metrics.registry.enabled = True
+    yield
+    metrics.registry.enabled = False
+
+
+def test_metrics_are_noops_when_disabled():
+    counter = metrics.Counter('test_disabled_total', 'Test counter')
+    counter.inc()
+    assert metrics.Histogram('test_disabled_seconds', 'Test histogram').time() is metrics._NULL_TIMER
+    assert counter.values == {}
+
+
+def test_render(enabled):
+    counter = metrics.Counter('test_events_total', 'Test counter', ('source',))
+    histogram = metrics.Histogram('test_seconds', 'Test histogram', buckets=(0.1, 1.0))
+    gauge = metrics.Gauge('test_depth', 'Test gauge', ('queue',))
+    counter.inc('discord')
+    counter.inc('discord', amount=2)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    gauge.set_function(lambda: 7, 'dispatcher')
+    lookups = metrics.FunctionCounter('test_lookups_total', 'Test function counter', ('result',))
+    lookups.set_function(lambda: 12, 'hit')
+
+    text = metrics.registry.render()
+    assert 'test_events_total{source="discord"} 3' in text
+    assert 'test_seconds_bucket{le="0.1"} 0' in text
+    assert 'test_seconds_bucket{le="1.0"} 1' in text
+    assert 'test_seconds_bucket{le="+Inf"} 2' in text
+    assert 'test_seconds_sum 5.5' in text
+    assert 'test_depth{queue="dispatcher"} 7' in text
+    assert '# TYPE test_lookups_total counter' in text
+    assert 'test_lookups_total{result="hit"} 12' in text
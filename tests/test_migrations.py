@@ -0,0 +1,65 @@
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from dsbridge import migrations
+from dsbridge.database import Base
+from dsbridge.models import ChatChannels
+from dsbridge.models import Message
+
+
+def create_legacy_schema(conn):
+    # Tables as they were before migrations, with duplicate channels already in them
+    Base.metadata.create_all(conn, tables=[ChatChannels.__table__, Message.__table__,
+                                           Base.metadata.tables['users']])
+    conn.execute(text('DROP INDEX ix_chat_channels_discord_channel_id'))
+    conn.execute(text('DROP INDEX ix_discord_message_id_visible'))
+    conn.execute(text('DROP INDEX ix_id_hidden'))
+    conn.execute(text('ALTER TABLE chat_messages DROP COLUMN edit_history'))
+    conn.execute(text('ALTER TABLE chat_channels DROP COLUMN namespace'))
+    conn.execute(text('CREATE INDEX ix_chat_channels_discord_channel_id ON chat_channels (discord_channel_id)'))
+    conn.execute(text('INSERT INTO chat_channels (id, discord_channel_id, public, closed, created_at, last_updated) '
+                      "VALUES (1, 10, 0, 0, '2026-01-01', '2026-01-01'), (2, 10, 0, 0, '2026-01-01', '2026-01-01')"))
+    conn.execute(text('INSERT INTO chat_messages (channel_id, discord_message_id, text, hidden, created_at, '
+                      "last_updated) VALUES (2, 100, 'Hello', 0, '2026-01-01', '2026-01-01')"))
+
+
+async def test_legacy_database_is_migrated():
+    engine = create_async_engine('sqlite+aiosqlite://', poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(create_legacy_schema)
+
+    assert await migrations.upgrade(engine) == len(migrations.MIGRATIONS)
+    assert await migrations.upgrade(engine) == 0
+
+    async with engine.connect() as conn:
+        assert await conn.scalar(select(migrations.schema_version.c.version)) == migrations.LATEST_VERSION
+        assert (await conn.scalars(select(ChatChannels.id))).all() == [1]
+        assert await conn.scalar(select(Message.channel_id)) == 1
+        indexes = await conn.run_sync(lambda conn: {
+            index['name']: index['unique'] for index in
+            inspect(conn).get_indexes('chat_channels')})
+        message_indexes = await conn.run_sync(lambda conn: {
+            index['name'] for index in inspect(conn).get_indexes('chat_messages')})
+        columns = await conn.run_sync(lambda conn: {
+            (table, column['name']) for table in ('chat_messages', 'chat_channels', 'chat_outbox')
+            for column in inspect(conn).get_columns(table)})
+    assert indexes['ix_chat_channels_discord_channel_id']
+    assert {'ix_discord_message_id_visible', 'ix_id_hidden'} <= message_indexes
+    assert {('chat_messages', 'edit_history'), ('chat_channels', 'namespace'),
+            ('chat_outbox', 'namespace')} <= columns
+    await engine.dispose()
+
+
+async def test_new_database_is_created_at_latest_version():
+    engine = create_async_engine('sqlite+aiosqlite://', poolclass=StaticPool)
+    assert await migrations.upgrade(engine) == 0
+
+    async with engine.connect() as conn:
+        assert await conn.scalar(select(migrations.schema_version.c.version)) == migrations.LATEST_VERSION
+        tables = await conn.run_sync(lambda conn: set(Base.metadata.tables) - set(
+            inspect(conn).get_table_names()))
+    assert tables == set()
+    await engine.dispose()
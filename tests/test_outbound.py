@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+from dsbridge.config import app_config
+from dsbridge.outbound import OutboundSender
+from dsbridge.outbound import TokenBucket
+
+
+def make_sender(**overrides):
+    config = SimpleNamespace(**{**vars(type(app_config)), **overrides})
+    return OutboundSender(MagicMock(), config)
+
+
+def make_channel():
+    channel = MagicMock()
+    channel.id = 10
+    channel.send = AsyncMock(side_effect=lambda **kwargs: SimpleNamespace(id=channel.send.await_count))
+    return channel
+
+
+def test_token_bucket_reservations():
+    now = [0.0]
+    bucket = TokenBucket(2, 1.0, clock=lambda: now[0])
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    now[0] = 2.0
+    assert bucket.reserve() == 0
+
+
+async def test_send_without_coalescing():
+    sender = make_sender(DISCORD_COALESCE_WINDOW=0.0)
+    channel = make_channel()
+    first = await sender.send(channel, 'Alice', 'one')
+    second = await sender.send(channel, 'Bob', 'two')
+
+    assert (first.id, second.id) == (1, 2)
+    assert sender.stats()['sent'] == 2
+    assert sender.stats()['queue_depth'] == 0
+
+
+async def test_concurrent_sends_are_coalesced():
+    sender = make_sender(DISCORD_COALESCE_WINDOW=0.01)
+    channel = make_channel()
+    messages = await asyncio.gather(*(sender.send(channel, 'Alice', str(n)) for n in range(3)))
+
+    assert channel.send.await_count == 1
+    assert len({m.id for m in messages}) == 1
+    assert [e.description for e in channel.send.await_args.kwargs['embeds']] == ['0', '1', '2']
+
+
+async def test_coalesced_embeds_stay_within_the_length_limit():
+    sender = make_sender(DISCORD_COALESCE_WINDOW=0.01, DISCORD_USE_WEBHOOKS=False)
+    channel = make_channel()
+    await asyncio.gather(*(sender.send(channel, 'Alice', 'x' * 2500) for _ in range(3)))
+
+    assert [len(call.kwargs['embeds']) for call in channel.send.await_args_list] == [2, 1]
+    for call in channel.send.await_args_list:
+        assert sum(len(e.title) + len(e.description) for e in call.kwargs['embeds']) <= 6000
+
+
+def test_webhook_render_uses_author_name():
+    sender = make_sender(DISCORD_USE_WEBHOOKS=True)
+    assert sender.render([('Alice', 'one'), ('Alice', 'two')]) == {'content': 'one\ntwo', 'username': 'Alice'}
+    assert sender.render([('Alice', 'one')], edit=True) == {'content': 'one', 'embeds': []}
+
+
+def test_long_webhook_messages_are_sent_as_embeds():
+    sender = make_sender(DISCORD_USE_WEBHOOKS=True)
+    kwargs = sender.render([('Alice', 'x' * 3000)])
+    assert 'content' not in kwargs and kwargs['username'] == 'Alice'
+    assert [e.description for e in kwargs['embeds']] == ['x' * 3000]
+    assert sender.render([('Alice', 'x' * 3000)], edit=True)['content'] is None
+
+
+async def test_lone_sends_do_not_wait_for_the_window():
+    sender = make_sender(DISCORD_COALESCE_WINDOW=10.0)
+    channel = make_channel()
+    first = await asyncio.wait_for(sender.send(channel, 'Alice', 'one'), 1)
+    second = await asyncio.wait_for(sender.send(channel, 'Alice', 'two'), 1)
+
+    assert (first.id, second.id) == (1, 2)
+
+
+async def test_edit_and_delete_use_partial_messages():
+    sender = make_sender(DISCORD_COALESCE_WINDOW=0.0)
+    channel = make_channel()
+    partial = channel.get_partial_message.return_value
+    partial.edit = AsyncMock(return_value=SimpleNamespace(id=5))
+    partial.delete = AsyncMock()
+
+    await sender.edit(channel, 5, [('Alice', 'edited')])
+    await sender.delete(channel, 5)
+
+    channel.fetch_message.assert_not_called()
+    partial.edit.assert_awaited_once()
+    partial.delete.assert_awaited_once()
+    assert 5 not in sender.sent_messages
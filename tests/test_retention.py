@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy import update
+
+from dsbridge.models import Message
+from dsbridge.retention import MessageRetention
+from tests.conftest import make_discord_message
+
+
+async def test_edits_are_compacted_and_deleted_messages_purged(server, session_factory):
+    await server.send_to_server(make_discord_message(100, 10, content='First'))
+    await server.edit_message_text(make_discord_message(100, 10, content='First'),
+                                   make_discord_message(100, 10, content='Second'))
+    await server.edit_message_text(make_discord_message(100, 10, content='Second'),
+                                   make_discord_message(100, 10, content='Third'))
+    await server.send_to_server(make_discord_message(101, 10, content='Gone'))
+    await server.delete_message(make_discord_message(101, 10))
+    await server.send_to_server(make_discord_message(102, 10, content='Recent'))
+    await server.edit_message_text(make_discord_message(102, 10, content='Recent'),
+                                   make_discord_message(102, 10, content='Recent, edited'))
+
+    async with session_factory() as session:
+        # Everything but the last edit was hidden long ago
+        await session.execute(update(Message).where(Message.discord_message_id != 102).values(
+            last_updated=datetime(2020, 1, 1)))
+        await session.commit()
+
+    retention = MessageRetention(server, interval=3600, max_age=3600, batch_size=2, batch_pause=0)
+    assert await retention.run_once() == (2, 1)
+    assert await retention.run_once() == (0, 0)
+
+    async with session_factory() as session:
+        messages = (await session.scalars(select(Message).order_by(Message.id))).all()
+    assert [(m.discord_message_id, m.text, m.hidden) for m in messages] == [
+        (100, 'Third', False), (102, 'Recent', True), (102, 'Recent, edited', False)]
+    assert [entry['text'] for entry in messages[0].edit_history] == ['First', 'Second']
+    assert messages[2].edit_history is None
+
+
+async def test_batches_read_the_hidden_message_index(session_factory):
+    query = (select(Message.id).where(Message.hidden.is_(True), Message.last_updated < datetime(2020, 1, 1))
+             .order_by(Message.id).limit(10))
+    async with session_factory() as session:
+        sql = str(query.compile(session.bind.sync_engine, compile_kwargs={'literal_binds': True}))
+        plan = (await session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))).all()
+    assert 'USING INDEX ix_id_hidden' in plan[0][-1]
@@ -0,0 +1,59 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from sqlalchemy import select
+
+from dsbridge.config import app_config
+from dsbridge.models import ChatChannels
+from dsbridge.models import Message
+from dsbridge.router import ServerRouter
+from tests.conftest import make_discord_message
+
+
+@pytest.fixture
+def router(session_factory, mocker):
+    mocker.patch.object(app_config, 'SERVER_ENDPOINTS', ['league', 'arena=arena.example.com'])
+    router = ServerRouter.from_config(app_config, session_factory=session_factory)
+    for server in router.servers.values():
+        server.socketio.emit = AsyncMock()
+        server.socketio.connected = True
+    return router
+
+
+async def test_servers_on_one_host_share_a_connection(router):
+    default, league, arena = router.servers.values()
+    assert league.socketio is default.socketio
+    assert arena.socketio is not default.socketio
+    assert default.namespaces == [app_config.SERVER_NAMESPACE, 'league']
+    assert router.connections == [default, arena]
+
+
+async def test_duplicate_namespace_is_rejected(mocker):
+    mocker.patch.object(app_config, 'SERVER_ENDPOINTS', ['league', 'league=other.example.com'])
+    with pytest.raises(ValueError):
+        ServerRouter.from_config(app_config)
+
+
+async def test_messages_are_routed_by_channel_namespace(router, session_factory):
+    async with session_factory() as session:
+        session.add_all([ChatChannels(discord_channel_id=20, namespace='league'),
+                         ChatChannels(discord_channel_id=30, namespace='retired')])
+        await session.commit()
+    await router.load_routes()
+
+    await router.send_to_server(make_discord_message(100, 10))
+    await router.send_to_server(make_discord_message(101, 20))
+    await router.send_to_server(make_discord_message(102, 30))
+
+    # Each server only relays the events of its own channels
+    default, league, arena = router.servers.values()
+    assert await arena.outbox.drain() == 0
+    assert await league.outbox.drain() == 1
+    assert await default.outbox.drain() == 1
+    assert [call.args[2] for call in default.socketio.emit.await_args_list] == [
+        'league', app_config.SERVER_NAMESPACE]
+
+    async with session_factory() as session:
+        messages = (await session.scalars(select(Message).order_by(Message.id))).all()
+    assert [m.discord_message_id for m in messages] == [100, 101]
+    assert router.routes == {10: None, 20: 'league', 30: 'retired'}
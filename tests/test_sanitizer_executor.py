@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from dsbridge.sanitizer_executor import SanitizerExecutor
+from dsbridge.utils import Sanitizer
+
+
+@pytest.mark.parametrize('mode', ['inline', 'thread', 'process'])
+async def test_executor_modes_agree_with_sanitizer(mode):
+    sanitizer = Sanitizer(['darn'])
+    executor = SanitizerExecutor(sanitizer, mode, workers=1, inline_threshold=0)
+    texts = ['hello there', 'well darn it', 'mail me at someone@example.org', 'fine']
+    try:
+        verdicts = await asyncio.gather(*(executor.is_clean(text) for text in texts))
+    finally:
+        executor.shutdown()
+    assert verdicts == [sanitizer.is_clean(text) for text in texts]
+
+
+async def test_executor_batches_and_keeps_short_texts_inline():
+    executor = SanitizerExecutor(Sanitizer(['darn']), 'thread', batch_size=2, inline_threshold=10)
+    try:
+        verdicts = await asyncio.gather(*(executor.is_clean(text) for text in
+                                          ['short', 'a long clean message', 'a long darn message',
+                                           'another long clean one']))
+    finally:
+        executor.shutdown()
+    assert verdicts == [True, True, False, True]
+    assert executor.batches == 2
+
+
+async def test_verdicts_are_cached_until_reload():
+    executor = SanitizerExecutor(Sanitizer(['darn']), cache_size=10)
+    assert await executor.is_clean('well heck')
+    assert await executor.is_clean('well heck')
+    assert executor.verdicts.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    executor.reload(Sanitizer(['heck']))
+    assert not await executor.is_clean('well heck')
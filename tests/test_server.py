@@ -0,0 +1,374 @@
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+from discord.raw_models import RawMessageDeleteEvent
+from sqlalchemy import event
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import check_password_hash
+
+from dsbridge.batching import MessageBatcher
+from dsbridge.codec import DeleteMessageEvent
+from dsbridge.codec import NewMessagesEvent
+from dsbridge.config import app_config
+from dsbridge.discord_bot import DiscordBot
+from dsbridge.models import ChatChannels
+from dsbridge.models import Message
+from dsbridge.models import OutboxEvent
+from dsbridge.models import User
+from tests.conftest import make_discord_message
+
+
+async def test_send_to_server_creates_channel_and_message(server, session_factory):
+    await server.send_to_server(make_discord_message(100, 10))
+    await server.send_to_server(make_discord_message(101, 10))
+    assert await server.outbox.drain() == 2
+
+    async with session_factory() as session:
+        channels = (await session.scalars(select(ChatChannels))).all()
+        messages = (await session.scalars(select(Message).order_by(Message.id))).all()
+    assert len(channels) == 1
+    assert [m.discord_message_id for m in messages] == [100, 101]
+    assert server.socketio.emit.await_count == 2
+
+
+async def test_edit_and_delete_message(server, session_factory):
+    await server.send_to_server(make_discord_message(100, 10))
+    await server.edit_message_text(make_discord_message(100, 10),
+                                   make_discord_message(100, 10, content='Edited'))
+
+    async with session_factory() as session:
+        visible = await session.scalar(select(Message).filter_by(hidden=False))
+    assert visible.text == 'Edited'
+
+    await server.delete_message(make_discord_message(100, 10))
+    async with session_factory() as session:
+        visible = await session.scalar(select(Message).filter_by(hidden=False))
+    assert visible is None
+
+
+async def test_retry_after_a_failed_commit_does_not_send_again(server, session_factory, mocker):
+    mocker.patch('dsbridge.server.asyncio.sleep')
+    server.discord_bot = mocker.MagicMock()
+    server.discord_bot.owns_channel = mocker.AsyncMock(return_value=True)
+    server.discord_bot.get_channel = mocker.AsyncMock()
+    server.discord_bot.sender.send = mocker.AsyncMock(return_value=mocker.MagicMock(id=500))
+    async with session_factory() as session:
+        user = User(display_name='Alice')
+        session.add_all([user, ChatChannels(discord_channel_id=10)])
+        await session.flush()
+        message = Message(make_discord_message(0, 0), 1)
+        message.discord_message_id = None
+        message.user_id = user.id
+        session.add(message)
+        await session.commit()
+
+    commit_with_event = server.commit_with_event
+    attempts = []
+
+    async def flaky_commit(session, event):
+        attempts.append(event)
+        if len(attempts) == 1:
+            raise OperationalError('COMMIT', {}, Exception('connection lost'))
+        await commit_with_event(session, event)
+
+    mocker.patch.object(server, 'commit_with_event', side_effect=flaky_commit)
+    await server.handle_server_message(1)
+
+    server.discord_bot.sender.send.assert_awaited_once()
+    async with session_factory() as session:
+        assert (await session.get(Message, 1)).discord_message_id == 500
+    assert len(server.unsaved_sends) == 0
+
+
+async def test_discord_delete_of_a_server_message_is_ignored(server, session_factory):
+    async with session_factory() as session:
+        user = User(display_name='Alice')
+        session.add_all([user, ChatChannels(discord_channel_id=10)])
+        await session.flush()
+        message = Message(make_discord_message(100, 10), 1)
+        message.user_id = user.id
+        session.add(message)
+        await session.commit()
+
+    # The bot no longer remembers posting it, so the delete was forwarded
+    await server.delete_message(make_discord_message(100, 10))
+    async with session_factory() as session:
+        assert not (await session.scalar(select(Message))).hidden
+        assert (await session.scalars(select(OutboxEvent))).all() == []
+
+
+def test_evicted_own_messages_are_recognized_from_discord_cache(mocker):
+    discord_bot = DiscordBot(app_config)
+    mocker.patch.object(discord_bot, 'is_own_message', return_value=True)
+    cached = make_discord_message(100, 10)
+    payload = RawMessageDeleteEvent({'id': '100', 'channel_id': '10'})
+    assert not discord_bot.is_own_event(payload)
+    payload.cached_message = cached
+    assert discord_bot.is_own_event(payload)
+    discord_bot.is_own_message.assert_called_once_with(cached)
+
+
+async def test_only_content_and_attachment_changes_are_forwarded_as_edits(mocker):
+    discord_bot = DiscordBot(app_config)
+    discord_bot.dispatcher = mocker.MagicMock(submit=mocker.AsyncMock())
+    mocker.patch.object(discord_bot, 'is_own_event', return_value=False)
+    message = make_discord_message(100, 10)
+    message.attachments = []
+
+    async def update(edited_timestamp='2026-01-01T00:00:00+00:00'):
+        await discord_bot.bot.on_raw_message_edit(mocker.MagicMock(
+            message=message, channel_id=10, data={'id': '100', 'edited_timestamp': edited_timestamp}))
+
+    # An embed unfurling on a message that is not cached
+    await update(edited_timestamp=None)
+    # An edit, then an update that changes nothing
+    message.content = 'Hello, edited'
+    await update()
+    await update()
+    # An edit that only removes an attachment
+    message.attachments = [mocker.MagicMock(id=7)]
+    await discord_bot.remember_message(message)
+    message.attachments = []
+    await update()
+
+    assert discord_bot.dispatcher.submit.await_count == 2
+
+
+async def test_handle_connection_error_retries_with_fresh_session(server, mocker):
+    mocker.patch('dsbridge.server.asyncio.sleep')
+    sessions = []
+
+    @server.handle_connection_error
+    async def flaky(self, session):
+        sessions.append(session)
+        if len(sessions) < 3:
+            raise OperationalError('SELECT 1', {}, Exception('connection lost'))
+        return 'ok'
+
+    assert await flaky(server) == 'ok'
+    assert len(set(map(id, sessions))) == 3
+
+
+async def test_id_caches_stay_coherent(server, session_factory):
+    await server.send_to_server(make_discord_message(100, 10))
+    await server.send_to_server(make_discord_message(101, 10))
+    await server.edit_message_text(make_discord_message(100, 10),
+                                   make_discord_message(100, 10, content='Edited'))
+    await server.delete_message(make_discord_message(100, 10))
+
+    stats = server.cache_stats()
+    assert stats['channel_ids']['hits'] == 2
+    assert stats['message_ids']['hits'] == 2
+    assert 100 not in server.message_ids
+
+    async with session_factory() as session:
+        messages = (await session.scalars(select(Message).filter_by(discord_message_id=100))).all()
+    assert all(m.hidden for m in messages)
+
+
+async def test_write_behind_batches_inserts(server, session_factory):
+    server.batcher = MessageBatcher(server, batch_size=3, flush_interval=60)
+    await server.send_to_server(make_discord_message(100, 10))
+    await server.send_to_server(make_discord_message(200, 20))
+    server.socketio.emit.assert_not_awaited()
+
+    # Editing a queued message flushes the queue first
+    await server.edit_message_text(make_discord_message(100, 10),
+                                   make_discord_message(100, 10, content='Edited'))
+    await server.outbox.drain()
+    batch_event = server.socketio.emit.await_args_list[0].args[1]
+    assert batch_event['type'] == 'new-messages'
+
+    async with session_factory() as session:
+        messages = (await session.scalars(select(Message).order_by(Message.id))).all()
+    assert [m.id for m in messages[:2]] == batch_event['message_ids']
+    assert [m.discord_message_id for m in messages] == [100, 200, 100]
+
+
+async def test_write_behind_keeps_a_failed_batch(server, session_factory, mocker):
+    server.batcher = MessageBatcher(server, batch_size=2, flush_interval=60, max_size=10)
+    insert_messages = server.insert_messages
+    calls = []
+
+    async def flaky_insert(messages, attachments):
+        calls.append([m.id for m in messages])
+        if len(calls) == 1:
+            raise RuntimeError('database down')
+        await insert_messages(messages, attachments)
+
+    mocker.patch.object(server, 'insert_messages', side_effect=flaky_insert)
+    for message_id in (100, 101, 102):
+        await server.send_to_server(make_discord_message(message_id, 10))
+    assert server.batcher.pending == 3
+
+    await server.batcher.flush()
+    assert calls == [[100, 101], [100, 101], [102]]
+    assert server.batcher.pending == 0
+    async with session_factory() as session:
+        messages = (await session.scalars(select(Message).order_by(Message.id))).all()
+    assert [m.discord_message_id for m in messages] == [100, 101, 102]
+
+
+async def test_outbox_keeps_events_until_connected(server, session_factory):
+    server.socketio.connected = False
+    await server.send_to_server(make_discord_message(100, 10))
+    await server.delete_message(make_discord_message(100, 10))
+    assert await server.outbox.drain() == 0
+
+    server.socketio.connected = True
+    assert await server.outbox.drain() == 2
+    assert [call.args[1]['type'] for call in server.socketio.emit.await_args_list] == [
+        'new-message', 'delete-message']
+    async with session_factory() as session:
+        assert (await session.scalars(select(OutboxEvent))).all() == []
+
+
+async def test_server_events_handled_by_owning_worker(server, session_factory, mocker):
+    server.discord_bot = mocker.MagicMock()
+    server.discord_bot.partial_shards = True
+    server.discord_bot.owns_channel = mocker.AsyncMock(side_effect=lambda discord_channel_id: discord_channel_id == 10)
+    server.discord_bot.get_channel = mocker.AsyncMock()
+    server.discord_bot.sender.coalesce_window = 0
+    server.discord_bot.sender.delete = mocker.AsyncMock()
+    await server.send_to_server(make_discord_message(100, 10))
+    await server.send_to_server(make_discord_message(200, 20))
+    load_messages = mocker.spy(server, 'load_messages')
+
+    await server.handle_server_message_deletion(1)
+    await server.handle_server_message_deletion(2)
+
+    server.discord_bot.sender.delete.assert_awaited_once()
+    # Messages of channels owned by other workers are not loaded
+    assert [call.args[1:] for call in load_messages.call_args_list] == [(1,)]
+    async with session_factory() as session:
+        hidden = (await session.scalars(select(Message.discord_message_id).filter_by(hidden=True))).all()
+    assert hidden == [100]
+
+
+async def test_server_edit_loads_messages_in_one_query(server, session_factory, mocker):
+    server.discord_bot = mocker.MagicMock()
+    server.discord_bot.partial_shards = False
+    server.discord_bot.owns_channel = mocker.AsyncMock(return_value=True)
+    server.discord_bot.get_channel = mocker.AsyncMock()
+    server.discord_bot.sender.coalesce_window = 0
+    server.discord_bot.sender.edit = mocker.AsyncMock(return_value=mocker.MagicMock(id=100))
+    async with session_factory() as session:
+        user = User(display_name='Alice')
+        session.add(user)
+        await session.flush()
+        channel = ChatChannels(discord_channel_id=10)
+        session.add(channel)
+        await session.flush()
+        for text in ('Hello', 'Edited'):
+            message = Message(make_discord_message(100, 10, content=text), channel.id)
+            message.user_id = user.id
+            session.add(message)
+        await session.commit()
+
+    statements = []
+    engine = session_factory.kw['bind'].sync_engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        await server.handle_server_message_edited(1, 2)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+    assert len([s for s in statements if s.lstrip().upper().startswith('SELECT')]) == 1
+    server.discord_bot.sender.edit.assert_awaited_once_with(mocker.ANY, 100, [('Alice', 'Edited')])
+
+
+async def test_server_message_batch_is_sent_per_channel_and_saved_in_bulk(server, session_factory, mocker):
+    server.discord_bot = mocker.MagicMock()
+    server.discord_bot.partial_shards = False
+    server.discord_bot.owns_channel = mocker.AsyncMock(return_value=True)
+    server.discord_bot.get_channel = mocker.AsyncMock(side_effect=lambda discord_channel_id: mocker.MagicMock(
+        id=discord_channel_id))
+    sent = []
+
+    async def send(channel, author, text, attachments=()):
+        sent.append((channel.id, text))
+        if text == 'Fails':
+            raise RuntimeError('Discord unavailable')
+        return mocker.MagicMock(id=1000 + len(sent))
+
+    server.discord_bot.sender.send = send
+    async with session_factory() as session:
+        user = User(display_name='Alice')
+        session.add_all([user, ChatChannels(discord_channel_id=10), ChatChannels(discord_channel_id=20)])
+        await session.flush()
+        for channel_id, text in ((1, 'First'), (2, 'Second'), (1, 'Third'), (2, 'Fails')):
+            message = Message(make_discord_message(0, 0, content=text), channel_id)
+            message.discord_message_id = None
+            message.user_id = user.id
+            session.add(message)
+        await session.commit()
+
+    statements = []
+    engine = session_factory.kw['bind'].sync_engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        with pytest.raises(RuntimeError):
+            await server.handle_server_messages([1, 2, 3, 4, 5])
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+    assert sent == [(10, 'First'), (20, 'Second'), (10, 'Third'), (20, 'Fails')]
+    assert len([s for s in statements if s.lstrip().upper().startswith('SELECT')]) == 1
+    assert len([s for s in statements if s.lstrip().upper().startswith('UPDATE')]) == 1
+    async with session_factory() as session:
+        messages = (await session.scalars(select(Message).order_by(Message.id))).all()
+        events = (await session.scalars(select(OutboxEvent))).all()
+    assert [m.discord_message_id for m in messages] == [1001, 1002, 1003, None]
+    assert [e.payload for e in events] == [{'message_ids': [1, 2, 3], 'type': 'new-messages'}]
+
+
+async def test_server_events_are_queued_per_channel_in_order(server, session_factory, mocker):
+    async with session_factory() as session:
+        session.add_all([ChatChannels(discord_channel_id=10), ChatChannels(discord_channel_id=20)])
+        await session.flush()
+        for channel_id in (1, 2, 1):
+            session.add(Message(make_discord_message(0, 0), channel_id))
+        await session.commit()
+    submit = mocker.patch.object(server.dispatcher, 'submit')
+    server.message_channels.put(3, 1)
+
+    # Each event runs in its own task; the second is resolved from the cache first but
+    # still waits for the first to be queued
+    await asyncio.gather(server.dispatch_event(NewMessagesEvent([1, 2, 9])),
+                         server.dispatch_event(DeleteMessageEvent(3)))
+    assert [call.args for call in submit.await_args_list] == [
+        (('server', 1), server.handle_server_messages, [1]),
+        (('server', 2), server.handle_server_messages, [2]),
+        (('server', None), server.handle_server_messages, [9]),
+        (('server', 1), server.handle_server_message_deletion, 3),
+    ]
+
+
+async def test_hmac_auth_headers_sign_the_timestamp(server, mocker):
+    mocker.patch.object(server.config, 'SERVER_AUTH_MODE', 'hmac')
+    headers = await server.auth_headers()
+    expected = hmac.new(server.key.encode(), headers['Timestamp'].encode(), hashlib.sha256).hexdigest()
+    assert headers['Authorization'] == f'hmac-sha256:{expected}'
+
+
+async def test_pbkdf2_auth_headers_stay_verifiable(server, mocker):
+    mocker.patch.object(server.config, 'SERVER_AUTH_MODE', 'pbkdf2')
+    headers = await server.auth_headers()
+    assert check_password_hash(headers['Authorization'], server.key + headers['Timestamp'])
+
+
+async def test_reconnect_backs_off_exponentially(server, mocker):
+    sleep = mocker.patch('dsbridge.server.asyncio.sleep', side_effect=[None, None, None, asyncio.CancelledError])
+    mocker.patch('dsbridge.server.random.uniform', return_value=1.0)
+    mocker.patch.object(server.config, 'SERVER_AUTH_MODE', 'hmac')
+    server.socketio.connect = mocker.AsyncMock(side_effect=OSError('refused'))
+
+    with pytest.raises(asyncio.CancelledError):
+        await server.start()
+    base = server.config.SERVER_RECONNECT_BASE
+    assert [call.args[0] for call in sleep.await_args_list] == [base * 2, base * 4, base * 8, base * 16]
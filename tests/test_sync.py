@@ -0,0 +1,64 @@
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+from sqlalchemy import select
+
+from dsbridge.models import ChannelSyncState
+from dsbridge.models import Message
+from dsbridge.models import User
+from dsbridge.sanitizer_executor import SanitizerExecutor
+from dsbridge.sync import CatchUpSync
+from dsbridge.utils import Sanitizer
+from tests.conftest import make_discord_message
+
+
+def make_discord_bot(history):
+    async def fetch_history(**kwargs):
+        for message in history:
+            if message.id > kwargs['after'].id:
+                yield message
+
+    discord_channel = MagicMock()
+    discord_channel.history = fetch_history
+    discord_bot = MagicMock()
+    discord_bot.sanitizer_executor = SanitizerExecutor(Sanitizer(['darn']))
+    discord_bot.attachments = None
+    discord_bot.is_own_message.return_value = False
+    discord_bot.get_channel = AsyncMock(return_value=discord_channel)
+    discord_bot.owns_channel = AsyncMock(return_value=True)
+    discord_bot.sender.send = AsyncMock(side_effect=lambda *args: MagicMock(id=500))
+    return discord_bot
+
+
+async def test_catch_up_mirrors_missed_messages_once(server, session_factory):
+    await server.send_to_server(make_discord_message(100, 10))
+    async with session_factory() as session:
+        user = User(display_name='Alice')
+        session.add(user)
+        await session.flush()
+        server_message = Message(make_discord_message(0, 10, content='From server'), 1)
+        server_message.discord_message_id = None
+        server_message.user_id = user.id
+        session.add(server_message)
+        await session.commit()
+
+    history = [
+        make_discord_message(100, 10),
+        make_discord_message(101, 10, content='Missed'),
+        make_discord_message(102, 10, content='darn'),
+    ]
+    discord_bot = make_discord_bot(history)
+    server.discord_bot = discord_bot
+    catch_up = CatchUpSync(server, discord_bot, workers=2, page_size=2, lookback=3600)
+
+    assert await catch_up.run() == 2
+    history[2].delete.assert_awaited_once()
+    discord_bot.sender.send.assert_awaited_once()
+    async with session_factory() as session:
+        state = await session.get(ChannelSyncState, 1)
+        messages = (await session.scalars(select(Message).order_by(Message.id))).all()
+    assert state.discord_message_id == 102
+    assert [m.discord_message_id for m in messages] == [100, 500, 101]
+
+    # Watermarks make the next run a no-op
+    assert await catch_up.run() == 0
@@ -15,3 +15,36 @@ def test_message_sanitization_unsafe(config):
     message = 'Go fuck yourself'
     sanitized_msg = utils.sanitize_input(message, config.BANNED_WORDS)
     assert message != sanitized_msg
+
+@pytest.fixture(scope="module")
+def sanitizer(config):
+    return utils.Sanitizer(config.BANNED_WORDS)
+
+@pytest.mark.parametrize("message", [
+    'Greetings everyone!',
+    'Go fuck yourself',
+    'Mail me at someone@example.org or call +44 20 7946 0958',
+    'See https://example.com & <b>this</b>',
+])
+def test_sanitizer_matches_sanitize_input(config, sanitizer, message):
+    expected = utils.sanitize_input(message, config.BANNED_WORDS)
+    assert sanitizer.clean(message) == expected
+    assert sanitizer.is_clean(message) == (message == expected)
+
+def test_sanitizer_phrases_and_punctuation():
+    sanitizer = utils.Sanitizer(['bad word', 'f*ck', ''])
+    assert sanitizer.clean('a bad word here') == 'a [REMOVED] here'
+    assert sanitizer.is_clean('a bad  word here')
+    assert sanitizer.clean('what the f*ck') == 'what the [REMOVED]'
+
+def test_sanitizer_allowed_domain():
+    sanitizer = utils.Sanitizer([], allowed_domain='example.com')
+    assert sanitizer.is_clean('contact me@example.com')
+    assert not sanitizer.is_clean('contact me@other.com')
+
+def test_sanitizer_folds_non_ascii_case():
+    sanitizer = utils.Sanitizer(['İstanbul', 'straße'])
+    assert sanitizer.clean('İSTANBUL is far') == '[REMOVED] is far'
+    assert sanitizer.clean('the STRASSE sign') == 'the [REMOVED] sign'
+    assert not sanitizer.is_clean('Straße')
+    assert sanitizer.is_clean('Istanbul')